@@ -3,16 +3,36 @@
 import asyncio
 import json
 import os
+import threading
+import time
 import urllib.parse
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from PIL import Image
 
+import modules.async_worker as worker
 import shared
-from modules.imagebrowser import ImageBrowser, format_metadata, format_metadata_string
-from api.schemas import BrowseImageItem, BrowseImagesResponse, ImageMetadataResponse, UpdateDBResponse
+from modules import thumbnails
+from modules.metadata_cache import read_parameters
+from modules.semantic_search import get_search
+from modules.imagebrowser import ImageBrowser, format_metadata, format_metadata_string, range_text
+from api.schemas import (
+    BrowseImageItem,
+    BulkRequest,
+    BulkResponse,
+    BrowseImagesResponse,
+    ImageMetadataResponse,
+    SemanticImageItem,
+    SemanticIndexStatus,
+    SemanticSearchResponse,
+    SimilarImageItem,
+    SimilarImagesResponse,
+    UpdateDBResponse,
+)
 
 router = APIRouter()
 
@@ -35,26 +55,48 @@ def _path_to_url(fullpath: str, outputs_dir: str) -> str:
     return f"/api/browser/image?path={urllib.parse.quote(fullpath)}"
 
 
+def _thumb_url(fullpath: str) -> str:
+    return f"/api/browser/thumb?path={urllib.parse.quote(fullpath)}"
+
+
 @router.get("/browser/images", response_model=BrowseImagesResponse)
 async def browse_images(
     page: int = Query(1, ge=1),
     search: str = Query(""),
+    cursor: str | None = Query(None),
+    collapse: bool = Query(False),
+    radius: int = Query(4, ge=0, le=16),
 ):
-    """Return a paginated list of images from the browser database."""
+    """Return a paginated list of images from the browser database.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the page after it
+    without SQLite having to skip over all the earlier rows. With ``collapse``
+    near duplicates on the page are folded into the first one of them.
+    """
     browser = _get_browser()
     outputs_dir = str(shared.path_manager.model_paths["temp_outputs_path"])
 
-    browser.filter = search
-    total_images, total_pages = browser.num_images_pages()
-    image_paths, range_text = browser.load_images(page)
+    def load():
+        counts = browser.num_images_pages(search)
+        rows, next_cursor = browser.load_page(page, cursor, search)
+        if collapse:
+            groups = browser.collapse_page(rows, radius)
+        else:
+            groups = [(row, 0) for row in rows]
+        return counts, rows, groups, next_cursor
+
+    loop = asyncio.get_running_loop()
+    (total_images, total_pages), rows, groups, next_cursor = await loop.run_in_executor(None, load)
 
     items = []
-    for img_path in image_paths:
-        fp = str(img_path)
+    for (fullpath, _), duplicates in groups:
+        fp = str(Path(fullpath))
         items.append(BrowseImageItem(
             url=_path_to_url(fp, outputs_dir),
+            thumb_url=_thumb_url(fp),
             fullpath=fp,
             filename=Path(fp).name,
+            duplicates=duplicates,
         ))
 
     return BrowseImagesResponse(
@@ -62,19 +104,105 @@ async def browse_images(
         page=page,
         total_pages=total_pages,
         total_images=total_images,
-        range_text=range_text,
+        range_text=range_text(rows),
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/browser/similar", response_model=SimilarImagesResponse)
+async def similar_images(
+    path: str = Query(...),
+    radius: int = Query(6, ge=0, le=11),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Return images that look like the given one, closest first."""
+    browser = _get_browser()
+    outputs_dir = str(shared.path_manager.model_paths["temp_outputs_path"])
+
+    loop = asyncio.get_running_loop()
+    found = await loop.run_in_executor(None, browser.similar_images, path, radius, limit)
+
+    return SimilarImagesResponse(images=[
+        SimilarImageItem(
+            url=_path_to_url(fp, outputs_dir),
+            thumb_url=_thumb_url(fp),
+            fullpath=fp,
+            filename=Path(fp).name,
+            distance=distance,
+        )
+        for fp, _, distance in found
+    ])
+
+
+@router.get("/browser/semantic", response_model=SemanticSearchResponse)
+async def semantic_search(
+    q: str = Query(""),
+    path: str | None = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Find images by what they show, described in ``q`` or like the image at ``path``."""
+    browser = _get_browser()
+    search = get_search()
+    outputs_dir = str(shared.path_manager.model_paths["temp_outputs_path"])
+
+    def run():
+        image, image_id = None, None
+        if path:
+            row = browser.db.read_one("SELECT id FROM images WHERE fullpath = ?", (path,))
+            if row is None:
+                raise HTTPException(status_code=404, detail="Image not found in database")
+            image_id = row[0]
+            if not len(search.index) or image_id not in search.index.ids:
+                with Image.open(path) as im:
+                    image = im.convert("RGB")
+        # Ask for extra rows, images removed since indexing are skipped
+        found = search.search(text=q, image=image, image_id=image_id, k=limit * 2)
+        ids = [image_id for image_id, _ in found]
+        paths = dict(browser.db.read(
+            f"SELECT id, fullpath FROM images WHERE id IN ({', '.join('?' * len(ids))})", ids
+        )) if ids else {}
+        return [(paths[i], score) for i, score in found if i in paths][:limit]
+
+    loop = asyncio.get_running_loop()
+    found = await loop.run_in_executor(None, run)
+
+    return SemanticSearchResponse(
+        images=[
+            SemanticImageItem(
+                url=_path_to_url(fp, outputs_dir),
+                thumb_url=_thumb_url(fp),
+                fullpath=fp,
+                filename=Path(fp).name,
+                score=score,
+            )
+            for fp, score in found
+        ],
+        indexed=len(search.index),
     )
 
 
+@router.get("/browser/semantic/status", response_model=SemanticIndexStatus)
+async def semantic_status():
+    """Progress of the background CLIP indexer."""
+    return SemanticIndexStatus(**get_search().status())
+
+
+@router.post("/browser/semantic/index", response_model=SemanticIndexStatus)
+async def semantic_index():
+    """Start embedding the images that aren't in the semantic index yet."""
+    search = get_search()
+    search.start(_get_browser().db)
+    return SemanticIndexStatus(**search.status())
+
+
 @router.get("/browser/metadata", response_model=ImageMetadataResponse)
 async def get_metadata(fullpath: str = Query(...)):
     """Return metadata for a specific image by its full path."""
     browser = _get_browser()
 
-    result = browser.sql_conn.execute(
+    row = await browser.db.aread_one(
         "SELECT json FROM images WHERE fullpath = ?", (fullpath,)
     )
-    row = result.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Image not found in database")
 
@@ -92,7 +220,9 @@ async def get_metadata(fullpath: str = Query(...)):
 @router.get("/browser/metadata-by-url")
 async def get_metadata_by_url(url: str = Query(...)):
     """Return metadata for an image given its URL path (e.g., /api/outputs/date/file.png).
-    Reads directly from the PNG file rather than the database."""
+
+    Served from the metadata cache or the browser DB when they are up to
+    date with the file, the PNG is only read when neither is."""
     outputs_dir = str(shared.path_manager.model_paths["temp_outputs_path"])
 
     # Strip the /api/outputs/ prefix to get the relative path
@@ -112,14 +242,13 @@ async def get_metadata_by_url(url: str = Query(...)):
     if not resolved.is_file():
         raise HTTPException(status_code=404, detail="Image not found")
 
+    browser = _get_browser()
+    loop = asyncio.get_running_loop()
     try:
-        im = Image.open(resolved)
-        raw_str = im.info.get("parameters", "")
-        if raw_str:
-            raw = json.loads(raw_str)
-        else:
-            raw = {}
-    except Exception:
+        raw = await loop.run_in_executor(
+            None, lambda: read_parameters(resolved, browser.db, aliases=[filepath])
+        )
+    except OSError:
         raw = {}
 
     formatted = format_metadata(raw) if raw else {}
@@ -151,12 +280,253 @@ async def serve_image(path: str = Query(...)):
     browser = _get_browser()
 
     # Validate path exists in the database to prevent directory traversal
-    result = browser.sql_conn.execute(
+    row = await browser.db.aread_one(
         "SELECT fullpath FROM images WHERE fullpath = ?", (path,)
     )
-    if not result.fetchone():
+    if not row:
         raise HTTPException(status_code=404, detail="Image not found in database")
     if not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="Image file not found on disk")
 
     return FileResponse(path)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/browser/thumb")
+async def serve_thumbnail(
+    request: Request,
+    path: str = Query(...),
+    size: int = Query(thumbnails.DEFAULT_SIZE, ge=16),
+    format: str = Query("webp"),
+):
+    """Serve a small cached WebP/JPEG version of an image in the database."""
+    fmt = format.lower()
+    if fmt not in thumbnails.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown thumbnail format: {format}")
+
+    browser = _get_browser()
+    row = await browser.db.aread_one(
+        "SELECT fullpath FROM images WHERE fullpath = ?", (path,)
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Image not found in database")
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Image file not found on disk")
+
+    size = thumbnails.bucket(size)
+    key = thumbnails.thumb_key(path, size, fmt, stat=st)
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": "public, max-age=86400",
+    }
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        thumb = await asyncio.wrap_future(thumbnails.thumbnail(path, size, fmt, key=key))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not make thumbnail: {e}")
+    media_type = "image/jpeg" if thumbnails.FORMATS[fmt] == "JPEG" else "image/webp"
+    return FileResponse(thumb, media_type=media_type, headers=headers)
+
+
+def _parse_ids(ids: str | None) -> list[int] | None:
+    if not ids:
+        return None
+    try:
+        return [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of numbers")
+
+
+class _Jobs:
+    """The latest state of export and bulk jobs, by task id.
+
+    Only the newest state of a job is kept, so one nobody watches holds a
+    single entry. A finished job is dropped once a client has read its result,
+    or EXPIRE seconds after it finished.
+    """
+
+    EXPIRE = 600
+
+    def __init__(self):
+        self.states = {}  # task_id -> (version, flag, product, finished)
+        self.changed = threading.Condition()
+
+    def start(self) -> int:
+        task_id = worker.new_task_id()
+        with self.changed:
+            now = time.time()
+            for old in [t for t, state in self.states.items() if state[3] and now - state[3] > self.EXPIRE]:
+                del self.states[old]
+            self.states[task_id] = (0, "preview", (0, "Starting", None), None)
+        return task_id
+
+    def update(self, task_id: int, flag: str, product):
+        with self.changed:
+            version = self.states[task_id][0] + 1 if task_id in self.states else 1
+            finished = None if flag == "preview" else time.time()
+            self.states[task_id] = (version, flag, product, finished)
+            self.changed.notify_all()
+
+    def wait(self, task_id: int, seen: int, timeout: float = 10):
+        """The state of a task once it is newer than version seen, or after
+        timeout. None for unknown tasks."""
+        with self.changed:
+            self.changed.wait_for(
+                lambda: task_id not in self.states or self.states[task_id][0] > seen,
+                timeout,
+            )
+            state = self.states.get(task_id)
+            if state is not None and state[3] is not None:
+                del self.states[task_id]
+            return state
+
+
+_jobs = _Jobs()
+
+
+def _progress(task_id: int, verb: str):
+    def report(done, total):
+        # Every file for small jobs, every percent for large ones
+        if total < 100 or done % (total // 100) == 0 or done == total:
+            _jobs.update(
+                task_id,
+                "preview",
+                (int(100 * done / max(total, 1)), f"{verb} {done}/{total}", None),
+            )
+    return report
+
+
+@router.get("/browser/export.zip")
+async def export_zip(
+    search: str = Query(""),
+    ids: str | None = Query(None, description="Comma separated image ids"),
+    progress: bool = Query(False),
+):
+    """Stream a ZIP of the selected images as it is written.
+
+    With ``progress`` the ``X-Task-Id`` header names a task that reports on
+    /ws/browser/bulk/{task_id}.
+    """
+    browser = _get_browser()
+    loop = asyncio.get_running_loop()
+    rows = await loop.run_in_executor(None, browser.select_images, search, _parse_ids(ids))
+    if not rows:
+        raise HTTPException(status_code=404, detail="No images selected")
+
+    headers = {"Content-Disposition": 'attachment; filename="images.zip"'}
+    report = None
+    if progress:
+        task_id = _jobs.start()
+        headers["X-Task-Id"] = str(task_id)
+        zip_report = _progress(task_id, "Zipped")
+
+        def report(done, total):
+            zip_report(done, total)
+            if done == total:
+                _jobs.update(task_id, "results", {"done": total, "skipped": 0})
+
+    return StreamingResponse(
+        browser.zip_images(rows, progress=report),
+        media_type="application/zip",
+        headers=headers,
+    )
+
+
+@router.post("/browser/bulk", response_model=BulkResponse)
+async def bulk_images(req: BulkRequest):
+    """Copy, move or delete the selected images in the background.
+
+    Progress is reported on /ws/browser/bulk/{task_id}.
+    """
+    if req.action not in ("copy", "move", "delete"):
+        raise HTTPException(status_code=400, detail=f"Unknown action: {req.action}")
+    if not req.ids and not (req.search or "").strip():
+        raise HTTPException(status_code=400, detail="Select images by ids or search")
+
+    destination = None
+    if req.action != "delete":
+        archives = [
+            str(Path(folder).resolve())
+            for folder in shared.settings.default_settings.get("archive_folders", []) or []
+        ]
+        if not archives:
+            raise HTTPException(status_code=400, detail="No archive folders are set up")
+        destination = str(Path(req.destination).resolve()) if req.destination else archives[0]
+        if destination not in archives:
+            raise HTTPException(status_code=403, detail="Destination is not an archive folder")
+
+    browser = _get_browser()
+    loop = asyncio.get_running_loop()
+    rows = await loop.run_in_executor(None, browser.select_images, req.search, req.ids)
+    task_id = _jobs.start()
+    verb = {"copy": "Copied", "move": "Moved", "delete": "Deleted"}[req.action]
+
+    def run():
+        try:
+            done, skipped = browser.bulk(
+                req.action, rows, destination, progress=_progress(task_id, verb)
+            )
+            _jobs.update(task_id, "results", {"done": done, "skipped": skipped})
+        except Exception as e:
+            _jobs.update(task_id, "error", str(e))
+
+    loop.run_in_executor(None, run)
+    return BulkResponse(task_id=task_id, count=len(rows))
+
+
+@router.websocket("/ws/browser/bulk/{task_id}")
+async def ws_bulk(websocket: WebSocket, task_id: int):
+    """
+    Stream the progress of an export or bulk operation.
+
+    Messages sent to the client:
+      - {"type": "progress", "percent": int, "status": str}
+      - {"type": "complete", "done": int, "skipped": int}
+      - {"type": "error", "error": str}
+    """
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+
+    try:
+        seen = -1
+        while True:
+            state = await loop.run_in_executor(None, _jobs.wait, task_id, seen)
+            if state is None:
+                await websocket.send_json({"type": "error", "error": "Unknown task"})
+                await websocket.close()
+                break
+            version, flag, product, _ = state
+            if version == seen:
+                continue
+            seen = version
+            if flag == "preview":
+                percent, status, _ = product
+                await websocket.send_json({"type": "progress", "percent": percent, "status": status})
+            elif flag == "results":
+                await websocket.send_json({"type": "complete", **product})
+                await websocket.close()
+                break
+            elif flag == "error":
+                await websocket.send_json({"type": "error", "error": product})
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
@@ -251,14 +251,18 @@ async def ws_chat(websocket: WebSocket, task_id: int):
     """
     Stream chat responses for a given task_id.
 
+    The full history is only sent at the start and at the end, tokens in
+    between arrive as numbered deltas for the last assistant message.
+
     Messages sent to the client:
-      - {"type": "stream", "history": [...]}   -- partial assistant response
-      - {"type": "complete", "history": [...]}  -- final complete history
+      - {"type": "stream", "history": [...]}        -- history + assistant placeholder
+      - {"type": "delta", "seq": int, "text": str}  -- text to append to the assistant response
+      - {"type": "complete", "history": [...]}      -- final complete history
       - {"type": "error", "message": str}
     """
     await websocket.accept()
     loop = asyncio.get_running_loop()
-    last_history = []
+    base_history = []
 
     try:
         while True:
@@ -267,20 +271,28 @@ async def ws_chat(websocket: WebSocket, task_id: int):
             )
 
             if flag == "preview":
-                # The llama pipeline sends the full history array as the preview
-                # product (history + partial assistant response appended)
-                last_history = product
+                # The llama pipeline sends the full history with a placeholder
+                # (or status) assistant message appended.
+                base_history = product[:-1]
                 await websocket.send_json({
                     "type": "stream",
                     "history": product,
                 })
 
+            elif flag == "delta":
+                seq, text = product
+                await websocket.send_json({
+                    "type": "delta",
+                    "seq": seq,
+                    "text": text,
+                })
+
             elif flag == "results":
                 # The pipeline returns the final assistant text as the product.
-                # Append it to the history we've been tracking.
                 if isinstance(product, str):
-                    last_history.append({"role": "assistant", "content": product})
-                    final_history = last_history
+                    final_history = base_history + [
+                        {"role": "assistant", "content": product}
+                    ]
                 else:
                     final_history = product
 
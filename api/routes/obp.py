@@ -1,9 +1,13 @@
+import asyncio
+import functools
+import random
+
 from fastapi import APIRouter, HTTPException
 
-from random_prompt.build_dynamic_prompt import build_dynamic_prompt
+from random_prompt.build_dynamic_prompt import build_dynamic_prompt, build_dynamic_prompts
 from random_prompt.one_button_presets import OneButtonPresets
 from random_prompt.csv_reader import load_config_csv
-from api.schemas import OBPGenerateRequest, OBPPresetSave
+from api.schemas import OBPBatchRequest, OBPGenerateRequest, OBPPresetSave
 
 router = APIRouter()
 
@@ -232,10 +236,9 @@ async def get_obp_options():
     }
 
 
-@router.post("/obp/generate")
-async def generate_prompt(req: OBPGenerateRequest):
-    """Generate a random prompt using One Button Prompt."""
-    prompt = build_dynamic_prompt(
+def _prompt_options(req: OBPGenerateRequest):
+    """build_dynamic_prompt arguments for a generate request."""
+    return dict(
         insanitylevel=req.insanitylevel,
         forcesubject=req.subject,
         artists=req.artist,
@@ -263,9 +266,26 @@ async def generate_prompt(req: OBPGenerateRequest):
         OBP_preset=req.obp_preset,
         prompt_enhancer=req.promptenhance,
     )
+
+
+@router.post("/obp/generate")
+async def generate_prompt(req: OBPGenerateRequest):
+    """Generate a random prompt using One Button Prompt."""
+    prompt = build_dynamic_prompt(**_prompt_options(req))
     return {"prompt": prompt}
 
 
+@router.post("/obp/generate-batch")
+async def generate_prompts(req: OBPBatchRequest):
+    """Generate n prompts, the same ones again for the same seed."""
+    seed = req.seed if req.seed >= 0 else random.randrange(2**32)
+    loop = asyncio.get_running_loop()
+    prompts = await loop.run_in_executor(
+        None, functools.partial(build_dynamic_prompts, req.n, seed, **_prompt_options(req))
+    )
+    return {"seed": seed, "prompts": prompts}
+
+
 @router.get("/obp/presets")
 async def get_presets():
     """Return all OBP presets."""
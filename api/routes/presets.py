@@ -1,13 +1,13 @@
 """Preset image endpoints — list preset PNGs and read their embedded metadata."""
 
-import json
+import asyncio
 from pathlib import Path
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import FileResponse
-from PIL import Image
 
 import shared
+from modules.metadata_cache import preset_manifest
 
 router = APIRouter()
 
@@ -19,27 +19,8 @@ async def list_presets():
     if not preset_path or not Path(preset_path).is_dir():
         return {"presets": []}
 
-    presets = []
-    for png in sorted(Path(preset_path).rglob("*.png")):
-        name = png.with_suffix("").name
-        if name.startswith("Place_preset") or name.startswith("."):
-            continue
-
-        metadata = None
-        try:
-            im = Image.open(png)
-            raw = im.info.get("parameters", "")
-            if raw:
-                metadata = json.loads(raw)
-        except Exception as e:
-            print(f"WARNING: Failed to read preset metadata from {png.name}: {e}")
-
-        presets.append({
-            "name": name,
-            "filename": png.name,
-            "metadata": metadata,
-        })
-
+    loop = asyncio.get_running_loop()
+    presets = await loop.run_in_executor(None, preset_manifest.get, str(preset_path))
     return {"presets": presets}
 
 
@@ -0,0 +1,28 @@
+"""Prompt token counts — CLIP token totals and 75 token chunk boundaries."""
+
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+
+from api.schemas import PromptTokensRequest, PromptTokensResponse
+from modules.prompt_tokens import CHUNK_SIZE, counter
+
+router = APIRouter()
+
+# Prompts counted in one request
+MAX_BATCH = 256
+
+
+@router.post("/prompt/tokens", response_model=PromptTokensResponse)
+async def prompt_tokens(req: PromptTokensRequest):
+    """Count the tokens of a batch of prompts and find their chunk boundaries.
+
+    Runs off the event loop, the first call loads the tokenizer.
+    """
+    if len(req.prompts) > MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH} prompts per request")
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, counter.count_many, req.prompts)
+    if results and results[0] is None:
+        raise HTTPException(status_code=503, detail="CLIP tokenizer not available")
+    return {"chunk_size": CHUNK_SIZE, "results": results}
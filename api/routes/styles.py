@@ -3,13 +3,23 @@
 from fastapi import APIRouter
 
 from api.schemas import StyleApplyRequest, StyleApplyResponse
-from modules.sdxl_styles import apply_style
+from modules import sdxl_styles
 
 router = APIRouter()
 
 
 @router.post("/styles/apply", response_model=StyleApplyResponse)
 async def apply_styles(req: StyleApplyRequest):
-    """Apply selected styles to prompt/negative prompt text."""
-    prompt, negative = apply_style(req.styles, req.prompt, req.negative_prompt, "")
-    return {"prompt": prompt, "negative_prompt": negative}
+    """Apply selected styles to prompt/negative prompt text.
+
+    The prompts list is styled along with prompt, with its results in the
+    prompts and negative_prompts lists.
+    """
+    results = sdxl_styles.apply_styles(req.styles, [req.prompt] + req.prompts, req.negative_prompt, "")
+    (prompt, negative), rest = results[0], results[1:]
+    return {
+        "prompt": prompt,
+        "negative_prompt": negative,
+        "prompts": [p for p, _ in rest],
+        "negative_prompts": [n for _, n in rest],
+    }
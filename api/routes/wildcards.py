@@ -2,7 +2,7 @@
 
 from fastapi import APIRouter
 
-import shared
+from modules.util import get_wildcard_files
 
 router = APIRouter()
 
@@ -10,4 +10,4 @@ router = APIRouter()
 @router.get("/wildcards")
 async def list_wildcards():
     """Return list of available wildcard names."""
-    return {"wildcards": list(shared.wildcards or [])}
+    return {"wildcards": get_wildcard_files()}
@@ -117,6 +117,11 @@ class OBPGenerateRequest(BaseModel):
     modeltype: str = "SDXL"
 
 
+class OBPBatchRequest(OBPGenerateRequest):
+    n: int = Field(default=8, ge=1, le=1000)
+    seed: int = -1
+
+
 class OBPPresetSave(BaseModel):
     name: str
     insanitylevel: int = 5
@@ -139,8 +144,10 @@ class OBPPresetSave(BaseModel):
 
 class BrowseImageItem(BaseModel):
     url: str
+    thumb_url: str = ""
     fullpath: str
     filename: str
+    duplicates: int = 0
 
 
 class BrowseImagesResponse(BaseModel):
@@ -149,6 +156,32 @@ class BrowseImagesResponse(BaseModel):
     total_pages: int
     total_images: int
     range_text: str
+    next_cursor: str | None = None
+
+
+class SimilarImageItem(BrowseImageItem):
+    distance: int
+
+
+class SimilarImagesResponse(BaseModel):
+    images: list[SimilarImageItem]
+
+
+class SemanticImageItem(BrowseImageItem):
+    score: float
+
+
+class SemanticSearchResponse(BaseModel):
+    images: list[SemanticImageItem]
+    indexed: int
+
+
+class SemanticIndexStatus(BaseModel):
+    running: bool
+    done: int
+    total: int
+    indexed: int
+    error: str | None = None
 
 
 class ImageMetadataResponse(BaseModel):
@@ -163,6 +196,18 @@ class UpdateDBResponse(BaseModel):
     message: str
 
 
+class BulkRequest(BaseModel):
+    action: str = Field(..., description="copy, move or delete")
+    ids: list[int] | None = None
+    search: str | None = None
+    destination: str | None = Field(None, description="Archive folder for copy and move")
+
+
+class BulkResponse(BaseModel):
+    task_id: int
+    count: int
+
+
 class EvolveMutateRequest(BaseModel):
     prompt: str
     button: int = Field(ge=1, le=9)
@@ -175,6 +220,21 @@ class EvolveMutateResponse(BaseModel):
     mode: str
 
 
+class EvolvePopulationRequest(BaseModel):
+    prompt: str
+    mode: str = "Tokens"
+    strength: int = Field(default=10, ge=0, le=100)
+    n: int = Field(default=8, ge=1, le=256)
+    generations: int = Field(default=1, ge=1, le=50)
+    seed: int = -1
+
+
+class EvolvePopulationResponse(BaseModel):
+    seed: int
+    generations: list[list[str]]
+    prompt: str
+
+
 class LlamaPresetInfo(BaseModel):
     name: str
     file: str
@@ -266,8 +326,26 @@ class StyleApplyRequest(BaseModel):
     styles: list[str]
     prompt: str = ""
     negative_prompt: str = ""
+    prompts: list[str] = Field(default_factory=list, description="More prompts to style the same way")
 
 
 class StyleApplyResponse(BaseModel):
     prompt: str
     negative_prompt: str
+    prompts: list[str] = Field(default_factory=list)
+    negative_prompts: list[str] = Field(default_factory=list)
+
+
+class PromptTokensRequest(BaseModel):
+    prompts: list[str]
+
+
+class PromptTokenCount(BaseModel):
+    tokens: int
+    chunks: int
+    boundaries: list[int] = Field(description="Offsets of the words that start a new chunk")
+
+
+class PromptTokensResponse(BaseModel):
+    chunk_size: int
+    results: list[PromptTokenCount]
@@ -31,6 +31,7 @@ from api.routes.wildcards import router as wildcards_router
 from api.routes.interrogate import router as interrogate_router
 from api.routes.hints import router as hints_router
 from api.routes.styles import router as styles_router
+from api.routes.prompt import router as prompt_router
 from modules.imagebrowser import ImageBrowser
 
 app = FastAPI(
@@ -68,6 +69,7 @@ app.include_router(wildcards_router, prefix="/api")
 app.include_router(interrogate_router, prefix="/api")
 app.include_router(hints_router, prefix="/api")
 app.include_router(styles_router, prefix="/api")
+app.include_router(prompt_router, prefix="/api")
 
 # Ensure browser singleton is available for the API
 if "browser" not in shared.shared_cache:
@@ -6,13 +6,20 @@ import type {
   SettingsData,
   ControlNetPreset,
   OBPGenerateRequest,
+  OBPBatchRequest,
   OBPOptions,
   OBPPreset,
   BrowseImagesResponse,
+  SimilarImageItem,
   ImageMetadata,
   UpdateDBResponse,
+  BulkRequest,
+  BulkResponse,
   EvolveMutateRequest,
   EvolveMutateResponse,
+  EvolvePopulationRequest,
+  EvolvePopulationResponse,
+  PromptTokensResponse,
   LlamaPreset,
   AssistantListItem,
   AssistantInfo,
@@ -89,6 +96,13 @@ export const api = {
     })
   },
 
+  generateOBPPrompts(data: OBPBatchRequest): Promise<{ seed: number; prompts: string[] }> {
+    return request('/obp/generate-batch', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    })
+  },
+
   saveOBPPreset(data: { name: string } & OBPPreset): Promise<{ status: string; preset_names: string[] }> {
     return request('/obp/presets', {
       method: 'POST',
@@ -96,11 +110,17 @@ export const api = {
     })
   },
 
-  getBrowserImages(page: number = 1, search: string = ''): Promise<BrowseImagesResponse> {
+  getBrowserImages(page: number = 1, search: string = '', cursor?: string): Promise<BrowseImagesResponse> {
     const params = new URLSearchParams({ page: String(page), search })
+    if (cursor) params.set('cursor', cursor)
     return request(`/browser/images?${params}`)
   },
 
+  getSimilarImages(fullpath: string, radius: number = 6): Promise<{ images: SimilarImageItem[] }> {
+    const params = new URLSearchParams({ path: fullpath, radius: String(radius) })
+    return request(`/browser/similar?${params}`)
+  },
+
   getImageMetadata(fullpath: string): Promise<ImageMetadata> {
     const params = new URLSearchParams({ fullpath })
     return request(`/browser/metadata?${params}`)
@@ -115,6 +135,19 @@ export const api = {
     return request('/browser/update', { method: 'POST' })
   },
 
+  bulkImages(data: BulkRequest): Promise<BulkResponse> {
+    return request('/browser/bulk', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    })
+  },
+
+  exportZipUrl(search: string = '', ids?: number[]): string {
+    const params = new URLSearchParams({ search })
+    if (ids?.length) params.set('ids', ids.join(','))
+    return `${BASE}/browser/export.zip?${params}`
+  },
+
   // Evolve
   evolveMutate(data: EvolveMutateRequest): Promise<EvolveMutateResponse> {
     return request('/evolve/mutate', {
@@ -123,6 +156,21 @@ export const api = {
     })
   },
 
+  evolvePopulation(data: EvolvePopulationRequest): Promise<EvolvePopulationResponse> {
+    return request('/evolve/population', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    })
+  },
+
+  // Prompt tokens
+  countPromptTokens(prompts: string[]): Promise<PromptTokensResponse> {
+    return request('/prompt/tokens', {
+      method: 'POST',
+      body: JSON.stringify({ prompts }),
+    })
+  },
+
   // Llama
   getLlamaPresets(): Promise<LlamaPreset[]> {
     return request('/llama/presets')
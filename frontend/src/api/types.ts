@@ -118,6 +118,11 @@ export interface OBPGenerateRequest {
   modeltype: string
 }
 
+export interface OBPBatchRequest extends OBPGenerateRequest {
+  n: number
+  seed?: number
+}
+
 export interface OBPPreset {
   insanitylevel: number
   subject: string
@@ -153,8 +158,14 @@ export interface OBPOptions {
 
 export interface BrowseImageItem {
   url: string
+  thumb_url: string
   fullpath: string
   filename: string
+  duplicates: number
+}
+
+export interface SimilarImageItem extends BrowseImageItem {
+  distance: number
 }
 
 export interface BrowseImagesResponse {
@@ -163,6 +174,7 @@ export interface BrowseImagesResponse {
   total_pages: number
   total_images: number
   range_text: string
+  next_cursor: string | null
 }
 
 export interface ImageMetadata {
@@ -177,6 +189,18 @@ export interface UpdateDBResponse {
   message: string
 }
 
+export interface BulkRequest {
+  action: 'copy' | 'move' | 'delete'
+  ids?: number[]
+  search?: string
+  destination?: string
+}
+
+export interface BulkResponse {
+  task_id: number
+  count: number
+}
+
 // ---------------------------------------------------------------------------
 // Evolve
 // ---------------------------------------------------------------------------
@@ -193,6 +217,37 @@ export interface EvolveMutateResponse {
   mode: string
 }
 
+export interface EvolvePopulationRequest {
+  prompt: string
+  mode?: string
+  strength?: number
+  n?: number
+  generations?: number
+  seed?: number
+}
+
+export interface EvolvePopulationResponse {
+  seed: number
+  generations: string[][]
+  prompt: string
+}
+
+// ---------------------------------------------------------------------------
+// Prompt tokens
+// ---------------------------------------------------------------------------
+
+export interface PromptTokenCount {
+  tokens: number
+  chunks: number
+  /** Offsets of the words that start a new chunk */
+  boundaries: number[]
+}
+
+export interface PromptTokensResponse {
+  chunk_size: number
+  results: PromptTokenCount[]
+}
+
 // ---------------------------------------------------------------------------
 // Llama / Chat
 // ---------------------------------------------------------------------------
@@ -231,8 +286,10 @@ export interface ChatSendResponse {
 }
 
 export interface ChatStreamMessage {
-  type: 'stream' | 'complete' | 'error'
+  type: 'stream' | 'delta' | 'complete' | 'error'
   history?: ChatMessage[]
+  seq?: number
+  text?: string
   message?: string
 }
 
@@ -16,7 +16,7 @@ export function ImageBrowserView() {
         <div className="relative max-w-xs flex-1">
           <Search className="absolute left-2.5 top-1/2 -translate-y-1/2 h-4 w-4 text-muted-foreground" />
           <Input
-            placeholder="Search metadata..."
+            placeholder="Search prompts, or filter with model: seed: steps:>20 lora: size: date:"
             value={browser.search}
             onChange={(e) => browser.setSearch(e.target.value)}
             onKeyDown={(e) => e.key === "Enter" && browser.executeSearch()}
@@ -46,7 +46,7 @@ export function ImageGrid({ images, loading, selectedImage, onSelect }: ImageGri
             )}
           >
             <img
-              src={image.url}
+              src={image.thumb_url || image.url}
               alt={image.filename}
               loading="lazy"
               className="h-full w-full object-cover"
@@ -460,6 +460,27 @@ export function SettingsView({ settings, checkpoints, loras }: SettingsViewProps
                 onChange={(v) => set('archive_folders', textToList(v))}
                 hint="One folder per line"
               />
+              <CheckField
+                label="Semantic Search (index images with CLIP after Update DB)"
+                value={local.semantic_search as boolean ?? false}
+                onChange={(v) => set('semantic_search', v)}
+              />
+              <FieldRow>
+                <NumberField
+                  label="Approximate Index Above (images)"
+                  value={local.semantic_ivf_threshold as number ?? 100000}
+                  onChange={(v) => set('semantic_ivf_threshold', v)}
+                  min={1000}
+                  step={1000}
+                />
+                <NumberField
+                  label="Lists Searched"
+                  value={local.semantic_nprobe as number ?? 16}
+                  onChange={(v) => set('semantic_nprobe', v)}
+                  min={1}
+                  step={1}
+                />
+              </FieldRow>
             </div>
 
             <div className="glass-card rounded-xl p-4 space-y-4">
@@ -530,11 +551,32 @@ export function SettingsView({ settings, checkpoints, loras }: SettingsViewProps
                   step={1}
                 />
               </FieldRow>
+              <FieldRow>
+                <NumberField
+                  label="Parallel Slots"
+                  value={local.llm_n_parallel as number}
+                  onChange={(v) => set('llm_n_parallel', v)}
+                  min={1}
+                  step={1}
+                />
+                <NumberField
+                  label="Unload After Idle (s)"
+                  value={local.llm_idle_timeout as number}
+                  onChange={(v) => set('llm_idle_timeout', v)}
+                  min={0}
+                  step={10}
+                />
+              </FieldRow>
               <CheckField
                 label="Enable Image Generation"
                 value={local.enable_llm_tools as boolean ?? false}
                 onChange={(v) => set('enable_llm_tools', v)}
               />
+              <CheckField
+                label="Unload LLM Before Generating Images"
+                value={local.llm_unload_for_images as boolean ?? false}
+                onChange={(v) => set('llm_unload_for_images', v)}
+              />
               <NumberField
                 label="Max Tokens (Hyperprompting)"
                 value={local.llm_hp_max_tokens as number}
@@ -62,11 +62,24 @@ export function useChat() {
           history: newHistory,
         })
 
+        // Deltas are appended to the last (assistant) message, the first
+        // one replaces the thinking placeholder.
+        let lastSeq = 0
         wsRef.current = connectChatWebSocket(
           task_id,
           (msg: ChatStreamMessage) => {
             if (msg.type === 'stream' && msg.history) {
               setHistory(msg.history)
+            } else if (msg.type === 'delta' && msg.seq !== undefined && msg.text) {
+              if (msg.seq !== lastSeq + 1) return
+              lastSeq = msg.seq
+              const text = msg.text
+              const first = msg.seq === 1
+              setHistory((prev) => {
+                if (prev.length === 0) return prev
+                const content = first ? '' : prev[prev.length - 1].content
+                return [...prev.slice(0, -1), { role: 'assistant', content: content + text }]
+              })
             } else if (msg.type === 'complete' && msg.history) {
               setHistory(msg.history)
               setIsStreaming(false)
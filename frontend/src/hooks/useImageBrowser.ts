@@ -45,10 +45,17 @@ export function useImageBrowser(): UseImageBrowserReturn {
   const [updating, setUpdating] = useState(false)
   const [updateMessage, setUpdateMessage] = useState<string | null>(null)
 
+  // Cursor for each page we know the start of, so stepping through pages
+  // seeks from the previous page instead of counting from the first image.
+  const cursorsRef = useRef<Map<number, string>>(new Map())
+
   const fetchImages = useCallback(async (p: number, s: string) => {
     setLoading(true)
     try {
-      const data = await api.getBrowserImages(p, s)
+      const data = await api.getBrowserImages(p, s, cursorsRef.current.get(p))
+      if (data.next_cursor) {
+        cursorsRef.current.set(p + 1, data.next_cursor)
+      }
       setImages(data.images)
       setTotalPages(data.total_pages)
       setTotalImages(data.total_images)
@@ -75,6 +82,7 @@ export function useImageBrowser(): UseImageBrowserReturn {
   }, [])
 
   const executeSearch = useCallback(() => {
+    cursorsRef.current.clear()
     setPageState(1)
     setActiveSearch(search)
     setSelectedImage(null)
@@ -116,6 +124,7 @@ export function useImageBrowser(): UseImageBrowserReturn {
       const result = await api.updateBrowserDB()
       setUpdateMessage(result.message)
       // Refresh the current view
+      cursorsRef.current.clear()
       setPageState(1)
       setActiveSearch('')
       setSearch('')
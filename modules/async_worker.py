@@ -1,4 +1,5 @@
 import threading
+import collections
 import gc
 import torch
 import math
@@ -12,17 +13,47 @@ import os
 import shared
 import random
 
-from modules.prompt_processing import process_metadata, process_prompt, parse_loras
+from modules.prompt_processing import process_metadata, process_prompt, parse_loras, prefetch_expansions, clear_expansions
 from modules.shift_attention import shift_attention
 
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from modules.util import generate_temp_filename, TimeIt, get_checkpoint_hashes, get_lora_hashes
 import modules.pipelines
+from modules import thumbnails
+from modules.perceptual_hash import image_hashes
 from shared import settings
 
+class TaskOutputs:
+    # Results queued per task_id, so waiting for one task doesn't scan the
+    # results of all the others.
+    def __init__(self):
+        self.queues = {}
+        self.ready = threading.Condition()
+
+    def append(self, result):
+        task_id, flag, product = result
+        with self.ready:
+            self.queues.setdefault(task_id, collections.deque()).append((flag, product))
+            self.ready.notify_all()
+
+    def pop(self, task_id):
+        with self.ready:
+            while not self.queues.get(task_id):
+                self.ready.wait()
+            queue = self.queues[task_id]
+            result = queue.popleft()
+            if not queue:
+                del self.queues[task_id]
+            return result
+
+    def __len__(self):
+        with self.ready:
+            return sum(len(q) for q in self.queues.values())
+
+
 buffer = []
-outputs = []
+outputs = TaskOutputs()
 current_task = 0
 
 interrupt_ruined_processing = False
@@ -318,12 +349,17 @@ def _process(gen_data):
                     "file_path": str(Path(local_temp_filename).relative_to(folder))
                 }
                 if "browser" in shared.shared_cache:
+                    # Hash the image we still have in memory rather than
+                    # reading the file back
+                    hashes = image_hashes(x) if isinstance(x, Image.Image) else None
                     shared.shared_cache["browser"].add_image(
                         local_temp_filename,
                         Path(local_temp_filename).relative_to(folder),
                         metadata,
-                        commit=True
+                        commit=True,
+                        hashes=hashes,
                     )
+                thumbnails.pregenerate(local_temp_filename)
             except:
                 pass
 
@@ -375,6 +411,15 @@ def worker():
             reset_preview()
             gen_data["index"] = (0, (gen_data["image_total"]))
             if isinstance(gen_data["prompt"], list):
+                try:
+                    prefetch_expansions(
+                        gen_data.get("style_selection"),
+                        gen_data["prompt"],
+                        gen_data,
+                        gen_data.get("image_number", 1),
+                    )
+                except Exception as e:
+                    print(f"WARNING: Prompt expansion prefetch failed: {e}")
                 tmp_data = gen_data.copy()
                 for prompt in gen_data["prompt"]:
                     tmp_data["prompt"] = prompt
@@ -425,16 +470,19 @@ def worker():
 
 
     def handler(gen_data):
-        match gen_data["task_type"]:
-            case "process":
-                process(gen_data)
-            case "api_process":
-                gen_data["silent"] = True
-                process(gen_data)
-            case "llama":
-                txt2txt_process(gen_data)
-            case _:
-                print(f"WARN: Unknown task_type: {gen_data['task_type']}")
+        try:
+            match gen_data["task_type"]:
+                case "process":
+                    process(gen_data)
+                case "api_process":
+                    gen_data["silent"] = True
+                    process(gen_data)
+                case "llama":
+                    txt2txt_process(gen_data)
+                case _:
+                    print(f"WARN: Unknown task_type: {gen_data['task_type']}")
+        finally:
+            clear_expansions()
 
     while True:
         time.sleep(0.01)
@@ -456,6 +504,14 @@ def add_task(gen_data):
     buffer.append(gen_data.copy())
     return task_id
 
+# Task id for work that reports through add_result() without going through
+# the worker queue, like bulk file operations
+def new_task_id():
+    global current_task
+
+    current_task += 1
+    return current_task
+
 # Pipelines use this to add results
 def add_result(task_id, flag, product):
     global outputs
@@ -466,19 +522,7 @@ def add_result(task_id, flag, product):
 def task_result(task_id):
     global outputs
 
-    while True:
-        if not outputs:
-            time.sleep(0.1)
-            continue
-
-        matches = [res for res in outputs if res[0] == task_id] 
-
-        if matches:
-            id, flag, product = matches.pop(0)
-            outputs.remove([id, flag, product])
-            break
-
-    return (flag, product)
+    return outputs.pop(task_id)
 
 
 threading.Thread(target=worker, daemon=True).start()
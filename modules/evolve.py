@@ -0,0 +1,119 @@
+import re
+import threading
+
+import numpy as np
+
+from modules import prompt_tokens
+from random_prompt.build_dynamic_prompt import createpromptvariant
+from random_prompt.rng import seeded
+
+WORDS_FILE = "wildcards_official/words.txt"
+
+class EvolveEngine:
+    """Prompt mutations for Evolve.
+
+    The CLIP vocabulary and the word list are loaded once, and the mutation
+    masks and replacements for all variants of a prompt are drawn in one go.
+    """
+
+    def __init__(self, words_file=WORDS_FILE):
+        self.words_file = words_file
+        self.lock = threading.Lock()
+        self._vocab = None
+        self._words = None
+        self._word_set = None
+
+    @property
+    def vocab(self):
+        if self._vocab is None:
+            with self.lock:
+                if self._vocab is None:
+                    # Skip <|startoftext|> & <|endoftext|>, the last two
+                    self._vocab = list(prompt_tokens.counter.tokenizer.get_vocab().keys())[:-2]
+        return self._vocab
+
+    @property
+    def words(self):
+        if self._words is None:
+            with self.lock:
+                if self._words is None:
+                    with open(self.words_file, "r", encoding="utf-8") as f:
+                        words = f.read().lower().splitlines()
+                    self._word_set = frozenset(words)
+                    self._words = words
+        return self._words
+
+    def _mutate(self, parts, eligible, choices, strength, n, rng):
+        """n copies of parts with each eligible part replaced at strength %."""
+        eligible = np.flatnonzero(eligible)
+        hits = rng.random((n, len(eligible))) < strength / 100.0
+        picks = rng.integers(0, len(choices), size=(n, len(eligible)))
+        variants = []
+        for row_hits, row_picks in zip(hits, picks):
+            res = list(parts)
+            for i, pick in zip(eligible[row_hits], row_picks[row_hits]):
+                res[i] = choices[pick]
+            variants.append(res)
+        return variants
+
+    def mutate_tokens(self, prompt, strength, n, rng):
+        tokenizer = prompt_tokens.counter.tokenizer
+        tokens = tokenizer.tokenize(prompt)
+        eligible = np.ones(len(tokens), dtype=bool)
+        return [
+            tokenizer.convert_tokens_to_string(res).strip()
+            for res in self._mutate(tokens, eligible, self.vocab, strength, n, rng)
+        ]
+
+    def mutate_words(self, prompt, strength, n, rng):
+        words = self.words
+        parts = re.split(r"\b", prompt)
+        eligible = np.array(
+            [not p.isdigit() and p.lower() in self._word_set for p in parts], dtype=bool
+        )
+        return ["".join(res).strip() for res in self._mutate(parts, eligible, words, strength, n, rng)]
+
+    def obp_variants(self, prompt, strength, n, rng):
+        res = []
+        for seed in rng.integers(0, 2**32, size=n):
+            with seeded(int(seed)):
+                res.append(
+                    createpromptvariant(prompt, max(int(strength / 10), 3), advancedprompting=False)
+                )
+        return res
+
+    def available(self, mode):
+        """False if the mode needs the CLIP tokenizer and it can't be loaded."""
+        if mode in ("Words", "OBP Variant"):
+            return True
+        return prompt_tokens.counter.tokenizer is not None
+
+    def variants(self, prompt, mode, strength, n, rng=None):
+        """n mutations of a prompt, mode is Tokens, Words or OBP Variant."""
+        rng = rng if rng is not None else np.random.default_rng()
+        if mode == "Words":
+            return self.mutate_words(prompt, strength, n, rng)
+        if mode == "OBP Variant":
+            return self.obp_variants(prompt, strength, n, rng)
+        return self.mutate_tokens(prompt, strength, n, rng)
+
+    def population(self, prompt, mode, strength, n, generations=1, seed=None):
+        """n variants, evolved for a number of generations.
+
+        Every generation mutates a random pick of the one before it. Returns
+        all generations, the same ones for the same seed.
+        """
+        rng = np.random.default_rng(seed)
+        result = []
+        current = [prompt]
+        for _ in range(generations):
+            parents = [current[i] for i in rng.integers(0, len(current), size=n)]
+            children = []
+            for parent in dict.fromkeys(parents):
+                children += self.variants(parent, mode, strength, parents.count(parent), rng)
+            current = children
+            result.append(current)
+        return result
+
+
+engine = EvolveEngine()
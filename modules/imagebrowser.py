@@ -5,10 +5,26 @@ from PIL.PngImagePlugin import PngImageFile
 import json
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
+import shutil
 import sqlite3
 import time
+import zipfile
 from modules.path import PathManager # FIXME import from shared?
 from modules.util import TimeIt
+from modules import thumbnails
+from modules.semantic_search import get_search
+from modules.imagedb import (
+    ImageDatabase,
+    collapse,
+    copy_rows,
+    delete_rows,
+    encode_cursor,
+    find_similar,
+    image_row,
+    move_rows,
+    page_query,
+    parse_query,
+)
 from shared import settings
 import version
 
@@ -168,11 +184,40 @@ def connect_database(path="cache/images.db"):
         except Exception:
             pass
     conn.commit()
-    conn.cursor()
-    conn.execute('''CREATE TABLE IF NOT EXISTS images (fullpath text, path text, json text)''')
-    conn.commit()
 
-    return conn
+    # Schema, WAL mode and the reader pool are set up by ImageDatabase
+    return ImageDatabase(path, writer=conn)
+
+
+def range_text(image_paths) -> str:
+    if not image_paths:
+        return ""
+    path1 = str(Path(image_paths[0][1]))
+    path2 = str(Path(image_paths[-1][1]))
+    return f"{path1} ... {path2}"
+
+
+class ZipBuffer:
+    # Write only stream for ZipFile, the bytes are handed out as they come
+    def __init__(self):
+        self.data = bytearray()
+        self.offset = 0
+
+    def write(self, b):
+        self.data += b
+        self.offset += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.data)
+        self.data.clear()
+        return data
 
 
 class ImageBrowser:
@@ -180,85 +225,198 @@ class ImageBrowser:
         self.path_manager = PathManager()
         self.base_path = Path(self.path_manager.model_paths["temp_outputs_path"])
         self.current_display_paths = []  # Track currently displayed images
-        self.sql_conn = connect_database()
+        self.db = connect_database()
         self.images_per_page = int(settings.default_settings.get("images_per_page", 100))
         self.filter = ""
-
-    def num_images_pages(self):
-        result = self.sql_conn.execute("SELECT count(*) FROM images WHERE json LIKE ?", (f"%{self.filter}%",))
-        image_cnt = result.fetchone()[0]
+        self.counts = {}  # filter -> image count, cleared when images are added
+
+    def clear_counts(self, *args):
+        self.counts = {}
+
+    def num_images_pages(self, search: Optional[str] = None):
+        search = self.filter if search is None else search
+        counts = self.counts
+        if search not in counts:
+            where, params = parse_query(search)
+            counts[search] = self.db.read_one(
+                f"SELECT count(*) FROM images WHERE {where}", params
+            )[0]
+        image_cnt = counts[search]
         pages = int(image_cnt/self.images_per_page) + 1
         return image_cnt, pages
 
+    def load_page(self, page: int = 1, cursor: Optional[str] = None, search: Optional[str] = None):
+        """Rows (fullpath, path) of a page, and the cursor for the next one."""
+        search = self.filter if search is None else search
+        where, params = parse_query(search)
+        sql, params = page_query(
+            where,
+            params,
+            self.images_per_page,
+            cursor=cursor,
+            offset=(page-1)*self.images_per_page,
+        )
+        rows = self.db.read(sql, params)
+        next_cursor = None
+        if len(rows) == self.images_per_page:
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+        return [(fullpath, path) for _, fullpath, path in rows], next_cursor
+
     def load_images(self, page: int) -> Tuple[List[str], str]:
-        text = ""
         if page == None:
             page = 1
-        result = self.sql_conn.execute(
-            "SELECT fullpath, path FROM images WHERE json LIKE ? ORDER BY path DESC LIMIT ? OFFSET ?",
-            (
-                f"%{self.filter}%",
-                str(self.images_per_page),
-                str((page-1)*self.images_per_page),
-            )
-        )
-        image_paths = result.fetchall()
+        image_paths, _ = self.load_page(page)
         self.current_display_paths = image_paths  # Store current display order
-        if image_paths:
-            path1 = str(Path(image_paths[0][1]))
-            path2 = str(Path(image_paths[-1][1]))
-            text = f"{path1} ... {path2}"
-        else:
-            text = ""
+        text = range_text(image_paths)
 
         if image_paths:
             return list(Path(x[0]) for x in image_paths), text
         return [], text
 
-    def add_image(self, full_path, rel_path, metadata, commit=False):
-        if commit:
-            self.sql_conn.cursor()
-        self.sql_conn.execute(
-            "INSERT INTO images (fullpath, path, json) VALUES (?, ?, ?)",
-            (str(full_path), str(rel_path), json.dumps(metadata))
+    def collapse_page(self, rows, radius=4):
+        """Fold near duplicates in a page of (fullpath, path) rows.
+
+        Returns [((fullpath, path), duplicate_count)] in page order.
+        """
+        if not rows:
+            return []
+        fullpaths = [row[0] for row in rows]
+        hashes = {
+            fullpath: (dh, ph) for fullpath, dh, ph in self.db.read(
+                f"SELECT fullpath, dhash, phash FROM images WHERE fullpath IN ({', '.join('?' * len(fullpaths))})",
+                fullpaths,
+            )
+        }
+        by_path = dict((row[0], row) for row in rows)
+        groups = collapse(
+            [(fp,) + hashes.get(fp, (None, None)) for fp in fullpaths], radius
+        )
+        return [(by_path[fp], len(members)) for fp, members in groups]
+
+    def similar_images(self, fullpath, radius=6, limit=50):
+        """[(fullpath, path, distance)] of images that look like this one."""
+        row = self.db.read_one(
+            "SELECT dhash, phash FROM images WHERE fullpath = ?", (fullpath,)
+        )
+        if row is None or row[0] is None:
+            return []
+        with self.db.reader() as conn:
+            found = find_similar(conn, row, radius, limit, exclude=fullpath)
+        return [(fp, path, distance) for _, fp, path, distance in found]
+
+    def select_images(self, search: Optional[str] = None, ids: Optional[List[int]] = None):
+        """[(id, fullpath, path)] of the given ids, or of everything the search finds."""
+        if ids:
+            rows = []
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows += self.db.read(
+                    f"SELECT id, fullpath, path FROM images WHERE id IN ({', '.join('?' * len(part))})",
+                    part,
+                )
+            return sorted(rows, key=lambda row: row[2], reverse=True)
+        where, params = parse_query(search or "")
+        return self.db.read(
+            f"SELECT id, fullpath, path FROM images WHERE {where} ORDER BY path DESC, id DESC",
+            params,
         )
-        if commit:
-            self.sql_conn.commit()
+
+    def zip_images(self, rows, progress=None):
+        """Yield a ZIP of the images as it is written, one file at a time."""
+        buffer = ZipBuffer()
+        names = set()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+            for n, (_, fullpath, path) in enumerate(rows, 1):
+                name = Path(path).as_posix()
+                if name not in names:
+                    names.add(name)
+                    try:
+                        st = os.stat(fullpath)
+                        info = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[:6])
+                        with open(fullpath, "rb") as src, zf.open(info, "w", force_zip64=st.st_size > 2**31) as dest:
+                            while chunk := src.read(1 << 20):
+                                dest.write(chunk)
+                                yield buffer.take()
+                    except OSError as e:
+                        print(f"Skipping {fullpath}: {e}")
+                    yield buffer.take()
+                if progress is not None:
+                    progress(n, len(rows))
+        yield buffer.take()
+
+    def bulk(self, action, rows, destination=None, progress=None):
+        """Copy, move or delete images, then update the DB in one transaction."""
+        done, skipped, changes = 0, 0, []
+        for n, (image_id, fullpath, path) in enumerate(rows, 1):
+            try:
+                if action == "delete":
+                    if os.path.exists(fullpath):
+                        st = os.stat(fullpath)
+                        os.remove(fullpath)
+                        thumbnails.forget(fullpath, st)
+                    changes.append(image_id)
+                else:
+                    target = Path(destination) / path
+                    if target.exists():
+                        skipped += 1
+                        continue
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    if action == "move":
+                        st = os.stat(fullpath)
+                        shutil.move(fullpath, target)
+                        thumbnails.forget(fullpath, st)
+                    else:
+                        shutil.copy2(fullpath, target)
+                    changes.append((image_id, str(target)))
+                done += 1
+            except OSError as e:
+                print(f"Could not {action} {fullpath}: {e}")
+                skipped += 1
+            finally:
+                if progress is not None:
+                    progress(n, len(rows))
+
+        apply = {"copy": copy_rows, "move": move_rows, "delete": delete_rows}[action]
+        if changes:
+            self.db.write(apply, changes).result()
+        self.counts = {}
+        return done, skipped
+
+    def add_image(self, full_path, rel_path, metadata, commit=False, hashes=None):
+        # Queued for the writer thread, which commits it with any other
+        # images that arrive at the same time
+        future = self.db.insert_images([image_row(full_path, rel_path, metadata, hashes=hashes)])
+        future.add_done_callback(self.clear_counts)
+        return future
 
     def _scan_and_rebuild(self) -> Tuple[int, str]:
-        """Core DB rebuild logic. Returns (image_count, status_message)."""
+        """Sync the DB with the output folders. Returns (image_count, status_message)."""
         if not self.base_path.exists():
             return 0, f"Folder not found: {self.base_path}"
 
-        image_cnt = 0
-        self.sql_conn.cursor()
-        self.sql_conn.execute("DROP TABLE images")
-        self.sql_conn.commit()
-        self.sql_conn = connect_database()
-        self.sql_conn.cursor()
+        folders = [self.base_path] + settings.default_settings.get("archive_folders", [])
 
-        # Walk through directory and all subdirectories
+        # Only added, changed or removed files are touched
         print("Scanning folder to update DB:")
+        for folder in folders:
+            print(f"    {folder}")
         with TimeIt("Update DB"):
-            for folder in [self.base_path] + settings.default_settings.get("archive_folders", []):
-                print(f"    {folder}")
-                for root, _, files in os.walk(folder):
-                    for filename in files:
-                        if filename.lower().endswith((".png", ".gif")):
-                            full_path = Path(root) / filename
-                            rel_path = str(full_path.relative_to(folder))
-                            if filename.lower().endswith(".png"):
-                                metadata = get_png_metadata(str(full_path))
-                            else:
-                                metadata = {}
-                            metadata["file_path"] = rel_path
-
-                            self.add_image(str(full_path), str(rel_path), metadata)
-                            image_cnt += 1
-
-        self.sql_conn.commit()
-
-        folders = ", ".join(map(str, [self.base_path] + settings.default_settings.get("archive_folders", [])))
+            changes = self.db.sync_folders(folders)
+        with TimeIt("Hash images"):
+            hashed = self.db.backfill_hashes()
+        self.counts = {}
+        if hashed:
+            print(f"    {hashed} older images hashed")
+        if settings.default_settings.get("semantic_search", False):
+            # Embed the new images in the background
+            get_search().start(self.db)
+        print(
+            f"    {changes['added']} added, {changes['changed']} changed, "
+            f"{changes['removed']} removed"
+        )
+        image_cnt = changes["total"]
+
+        folders = ", ".join(map(str, folders))
         if image_cnt:
             return image_cnt, f"Found {image_cnt} images from {folders} and subdirectories"
         return 0, f"No images found in {folders} or subdirectories"
@@ -293,8 +451,8 @@ class ImageBrowser:
         """Get metadata for selected image."""
         try:
             selected_path = self.current_display_paths[evt.index][0]
-            result = self.sql_conn.execute("SELECT json FROM images WHERE fullpath = ?", (str(selected_path),))
-            data = json.loads(result.fetchone()[0])
+            row = self.db.read_one("SELECT json FROM images WHERE fullpath = ?", (str(selected_path),))
+            data = json.loads(row[0])
             return format_metadata_string(data)
         except Exception as e:
             return f"Error getting metadata: {e}"
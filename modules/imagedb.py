@@ -0,0 +1,921 @@
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from modules.png_text import read_png_text
+
+# Bump this when the layout of the images table changes. Version 1 is the
+# old single (fullpath, path, json) table.
+SCHEMA_VERSION = 2
+
+# Rows written per transaction while syncing
+SYNC_BATCH = 500
+
+# How long the writer waits for more writes before committing a group
+GROUP_COMMIT_WAIT = 0.05
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY,
+        fullpath TEXT NOT NULL UNIQUE,
+        path TEXT NOT NULL,
+        json TEXT,
+        prompt TEXT,
+        negative TEXT,
+        model TEXT,
+        model_hash TEXT,
+        seed INTEGER,
+        steps INTEGER,
+        cfg REAL,
+        sampler TEXT,
+        scheduler TEXT,
+        width INTEGER,
+        height INTEGER,
+        loras TEXT,
+        created REAL,
+        file_size INTEGER,
+        mtime REAL,
+        dhash INTEGER,
+        phash INTEGER,
+        dh0 INTEGER,
+        dh1 INTEGER,
+        dh2 INTEGER,
+        dh3 INTEGER
+    )""",
+    # Browser sort order, path DESC with the rowid as tie breaker
+    "CREATE INDEX IF NOT EXISTS images_path ON images (path)",
+    "CREATE INDEX IF NOT EXISTS images_model ON images (model COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS images_model_hash ON images (model_hash)",
+    "CREATE INDEX IF NOT EXISTS images_seed ON images (seed)",
+    "CREATE INDEX IF NOT EXISTS images_steps ON images (steps)",
+    "CREATE INDEX IF NOT EXISTS images_cfg ON images (cfg)",
+    "CREATE INDEX IF NOT EXISTS images_sampler ON images (sampler COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS images_scheduler ON images (scheduler COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS images_size ON images (width, height)",
+    "CREATE INDEX IF NOT EXISTS images_created ON images (created)",
+    # The dhash is split in four 16 bit parts for multi-index hashing: two
+    # hashes within distance r have at least one part within r // 4 bits of
+    # each other.
+    *[f"CREATE INDEX IF NOT EXISTS images_dh{i} ON images (dh{i})" for i in range(4)],
+    """CREATE TABLE IF NOT EXISTS image_loras (
+        image_id INTEGER NOT NULL,
+        name TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS image_loras_name ON image_loras (name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS image_loras_image ON image_loras (image_id)",
+    # Full text index over the prompts, kept in sync by the triggers below
+    """CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+        prompt, negative, content='images', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS images_ai AFTER INSERT ON images BEGIN
+        INSERT INTO images_fts (rowid, prompt, negative)
+            VALUES (new.id, new.prompt, new.negative);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS images_ad AFTER DELETE ON images BEGIN
+        INSERT INTO images_fts (images_fts, rowid, prompt, negative)
+            VALUES ('delete', old.id, old.prompt, old.negative);
+        DELETE FROM image_loras WHERE image_id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS images_au AFTER UPDATE ON images BEGIN
+        INSERT INTO images_fts (images_fts, rowid, prompt, negative)
+            VALUES ('delete', old.id, old.prompt, old.negative);
+        INSERT INTO images_fts (rowid, prompt, negative)
+            VALUES (new.id, new.prompt, new.negative);
+    END""",
+]
+
+COLUMNS = [
+    "fullpath",
+    "path",
+    "json",
+    "prompt",
+    "negative",
+    "model",
+    "model_hash",
+    "seed",
+    "steps",
+    "cfg",
+    "sampler",
+    "scheduler",
+    "width",
+    "height",
+    "loras",
+    "created",
+    "file_size",
+    "mtime",
+    "dhash",
+    "phash",
+    "dh0",
+    "dh1",
+    "dh2",
+    "dh3",
+]
+
+# Largest Hamming distance find_similar() supports
+MAX_RADIUS = 11
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def lora_names(loras) -> List[str]:
+    """Get the LoRA file names from the metadata "loras" list."""
+    names = []
+    for lora in loras or []:
+        if isinstance(lora, (list, tuple)) and lora:
+            lora = lora[-1]
+        if isinstance(lora, dict):
+            lora = lora.get("name", "")
+        lora = str(lora)
+        # Entries look like "0.5 - name.safetensors"
+        if " - " in lora:
+            lora = lora.split(" - ", 1)[1]
+        lora = lora.strip()
+        if lora and lora != "None":
+            names.append(lora)
+    return names
+
+
+def image_columns(metadata: Dict) -> Dict:
+    """Split the PNG metadata into the typed columns of the images table."""
+    params = metadata.get("parameters", {})
+    if isinstance(params, str):
+        try:
+            params = json.loads(params)
+        except ValueError:
+            params = {}
+    if not isinstance(params, dict):
+        params = {}
+
+    return {
+        "prompt": str(params.get("Prompt", "") or ""),
+        "negative": str(params.get("Negative", "") or ""),
+        "model": params.get("base_model_name"),
+        "model_hash": params.get("base_model_hash"),
+        "seed": _to_int(params.get("seed")),
+        "steps": _to_int(params.get("steps")),
+        "cfg": _to_float(params.get("cfg")),
+        "sampler": params.get("sampler_name"),
+        "scheduler": params.get("scheduler"),
+        "width": _to_int(params.get("width")),
+        "height": _to_int(params.get("height")),
+        "loras": lora_names(params.get("loras")),
+    }
+
+
+def _signed(value):
+    # SQLite integers are signed 64 bit
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _unsigned(value):
+    return None if value is None else value & 0xFFFFFFFFFFFFFFFF
+
+
+def hash_parts(dhash) -> List[int]:
+    return [(dhash >> (48 - 16 * i)) & 0xFFFF for i in range(4)]
+
+
+def hash_columns(hashes) -> Dict:
+    """Columns for a (dhash, phash) pair, or empty ones if there is none."""
+    if hashes is None:
+        return {c: None for c in ("dhash", "phash", "dh0", "dh1", "dh2", "dh3")}
+    dhash, phash = hashes
+    row = {"dhash": _signed(dhash), "phash": _signed(phash)}
+    row.update({f"dh{i}": part for i, part in enumerate(hash_parts(dhash))})
+    return row
+
+
+def image_hashes(path):
+    """(dhash, phash) of an image file, None if it can't be read."""
+    try:
+        from modules.perceptual_hash import image_hashes
+        return image_hashes(path)
+    except Exception:
+        return None
+
+
+def image_row(full_path, rel_path, metadata: Dict, stat=None, hashes=None) -> Dict:
+    """Build a row for the images table, stat is (size, mtime) if known."""
+    if stat is None:
+        try:
+            st = os.stat(full_path)
+            stat = (st.st_size, st.st_mtime)
+        except OSError:
+            stat = (None, time.time())
+
+    row = image_columns(metadata)
+    row.update(
+        {
+            "fullpath": str(full_path),
+            "path": str(rel_path),
+            "json": json.dumps(metadata),
+            "created": stat[1],
+            "file_size": stat[0],
+            "mtime": stat[1],
+        }
+    )
+    row.update(hash_columns(hashes))
+    return row
+
+
+def insert_images(conn: sqlite3.Connection, rows: List[Dict]):
+    """Insert rows built by image_row(), or update the rows for their files.
+
+    An updated row keeps its id, cursors and the semantic index refer to it.
+    """
+    sql = "INSERT INTO images ({}) VALUES ({}) ON CONFLICT (fullpath) DO UPDATE SET {}".format(
+        ", ".join(COLUMNS),
+        ", ".join("?" * len(COLUMNS)),
+        ", ".join(f"{c} = excluded.{c}" for c in COLUMNS[1:]),
+    )
+    for row in rows:
+        values = dict(row, loras="\n".join(row["loras"]))
+        conn.execute(sql, [values[c] for c in COLUMNS])
+        image_id = conn.execute(
+            "SELECT id FROM images WHERE fullpath = ?", (values["fullpath"],)
+        ).fetchone()[0]
+        conn.execute("DELETE FROM image_loras WHERE image_id = ?", (image_id,))
+        conn.executemany(
+            "INSERT INTO image_loras (image_id, name) VALUES (?, ?)",
+            [(image_id, name) for name in row["loras"]],
+        )
+
+
+def _table_columns(conn, table) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def create_schema(conn: sqlite3.Connection):
+    """Create the tables, moving rows over from the old single table layout."""
+    old = _table_columns(conn, "images")
+    migrate = bool(old) and "id" not in old
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        print(
+            f"Image database is version {version}, newer than this version of "
+            f"the app ({SCHEMA_VERSION}). Delete it to have it rebuilt if the browser misbehaves."
+        )
+
+    with conn:
+        if migrate:
+            conn.execute("ALTER TABLE images RENAME TO images_v1")
+        for sql in SCHEMA:
+            conn.execute(sql)
+
+        if migrate:
+            # The rows come over without hashes, the hash backfill fills
+            # them in.
+            print("Migrating image database ...")
+            rows = []
+            for fullpath, path, data in conn.execute(
+                "SELECT fullpath, path, json FROM images_v1"
+            ):
+                try:
+                    metadata = json.loads(data)
+                except (TypeError, ValueError):
+                    metadata = {}
+                rows.append(image_row(fullpath, path, metadata))
+            insert_images(conn, rows)
+            conn.execute("DROP TABLE images_v1")
+
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def scan_folders(folders) -> Dict[str, Tuple[str, int, float]]:
+    """Find all images below the folders, {fullpath: (path, size, mtime)}."""
+    found = {}
+
+    def walk(top, root):
+        try:
+            entries = list(os.scandir(top))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path, root)
+                elif entry.name.lower().endswith((".png", ".gif")):
+                    st = entry.stat()
+                    found[str(entry.path)] = (
+                        os.path.relpath(entry.path, root),
+                        st.st_size,
+                        st.st_mtime,
+                    )
+            except OSError:
+                pass
+
+    for folder in folders:
+        walk(str(folder), str(folder))
+    return found
+
+
+def read_metadata(job):
+    """Metadata and hashes for one image, runs in the sync worker threads."""
+    full_path, rel_path = job
+    if full_path.lower().endswith(".png"):
+        metadata = read_png_text(full_path)
+    else:
+        metadata = {}
+    metadata["file_path"] = rel_path
+    return metadata, image_hashes(full_path)
+
+
+def _executor(workers):
+    # Threads, not processes: forking a process that already runs uvicorn,
+    # torch and the writer thread can deadlock on their locks. Reading the
+    # chunks waits on disk and PIL releases the GIL while it decodes.
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+
+def file_stats(conn: sqlite3.Connection) -> Dict[str, Tuple[int, float]]:
+    """{fullpath: (size, mtime)} of the rows in the images table."""
+    return {
+        fullpath: (size, mtime)
+        for fullpath, size, mtime in conn.execute(
+            "SELECT fullpath, file_size, mtime FROM images"
+        )
+    }
+
+
+def delete_paths(conn: sqlite3.Connection, paths: List[str]):
+    conn.executemany("DELETE FROM images WHERE fullpath = ?", [(p,) for p in paths])
+
+
+def read_image_rows(on_disk, paths, workers=None):
+    """Rows for the paths in on_disk, yielded SYNC_BATCH at a time.
+
+    The files are read in a worker pool, on the caller's side, so none of
+    it holds up the writer.
+    """
+    jobs = [(p, on_disk[p][0]) for p in paths]
+    workers = workers or os.cpu_count() or 4
+    with _executor(workers) as pool:
+        results = pool.map(read_metadata, jobs)
+        rows = []
+        for (full_path, rel_path), (metadata, hashes) in zip(jobs, results):
+            stat = on_disk[full_path][1:]
+            rows.append(image_row(full_path, rel_path, metadata, stat=stat, hashes=hashes))
+            if len(rows) >= SYNC_BATCH:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+
+def _sync(folders, in_db, write, workers=None) -> Dict[str, int]:
+    on_disk = scan_folders(folders)
+
+    removed = [p for p in in_db if p not in on_disk]
+    added = [p for p in on_disk if p not in in_db]
+    changed = [
+        p for p in on_disk
+        if p in in_db and in_db[p] != (on_disk[p][1], on_disk[p][2])
+    ]
+
+    for i in range(0, len(removed), SYNC_BATCH):
+        write(delete_paths, removed[i:i + SYNC_BATCH])
+    for rows in read_image_rows(on_disk, added + changed, workers):
+        write(insert_images, rows)
+
+    return {
+        "added": len(added),
+        "changed": len(changed),
+        "removed": len(removed),
+        "total": len(on_disk),
+    }
+
+
+def _write_now(conn):
+    def write(fn, *args):
+        with conn:
+            fn(conn, *args)
+    return write
+
+
+def sync_folders(conn: sqlite3.Connection, folders, workers=None) -> Dict[str, int]:
+    """Bring the images table in line with the files in the folders.
+
+    Only files that were added, or changed size or mtime, are read, and rows
+    for files that are gone are removed. Returns counts per kind of change.
+    """
+    return _sync(folders, file_stats(conn), _write_now(conn), workers)
+
+
+def move_rows(conn: sqlite3.Connection, moves: List[Tuple[int, str]]):
+    """Point rows at the new location of their files, [(id, fullpath)]."""
+    conn.executemany(
+        "UPDATE images SET fullpath = ? WHERE id = ?",
+        [(str(fullpath), image_id) for image_id, fullpath in moves],
+    )
+
+
+def copy_rows(conn: sqlite3.Connection, copies: List[Tuple[int, str]]):
+    """Add rows for copies of images, [(id of the original, new fullpath)]."""
+    columns = ", ".join(COLUMNS[1:])
+    for image_id, fullpath in copies:
+        conn.execute("DELETE FROM images WHERE fullpath = ?", (str(fullpath),))
+        cur = conn.execute(
+            f"INSERT INTO images (fullpath, {columns}) SELECT ?, {columns} FROM images WHERE id = ?",
+            (str(fullpath), image_id),
+        )
+        conn.execute(
+            "INSERT INTO image_loras (image_id, name) SELECT ?, name FROM image_loras WHERE image_id = ?",
+            (cur.lastrowid, image_id),
+        )
+
+
+def delete_rows(conn: sqlite3.Connection, ids: List[int]):
+    conn.executemany("DELETE FROM images WHERE id = ?", [(i,) for i in ids])
+
+
+def missing_hashes(conn: sqlite3.Connection) -> List[str]:
+    return [
+        row[0] for row in conn.execute(
+            "SELECT fullpath FROM images WHERE dhash IS NULL"
+        )
+    ]
+
+
+def update_hashes(conn: sqlite3.Connection, rows: List[List]):
+    conn.executemany(_UPDATE_HASHES, rows)
+
+
+def _backfill(paths, write, workers=None) -> int:
+    done = 0
+    if not paths:
+        return done
+    workers = workers or os.cpu_count() or 4
+    with _executor(workers) as pool:
+        rows = []
+        for path, hashes in zip(paths, pool.map(image_hashes, paths)):
+            if hashes is None:
+                continue
+            columns = hash_columns(hashes)
+            rows.append([columns[c] for c in ("dhash", "phash", "dh0", "dh1", "dh2", "dh3")] + [path])
+            if len(rows) >= SYNC_BATCH:
+                write(update_hashes, rows)
+                done += len(rows)
+                rows = []
+        if rows:
+            write(update_hashes, rows)
+            done += len(rows)
+    return done
+
+
+def backfill_hashes(conn: sqlite3.Connection, workers=None) -> int:
+    """Hash images added before hashes were stored. Returns how many got one."""
+    return _backfill(missing_hashes(conn), _write_now(conn), workers)
+
+
+_UPDATE_HASHES = (
+    "UPDATE images SET dhash = ?, phash = ?, dh0 = ?, dh1 = ?, dh2 = ?, dh3 = ? "
+    "WHERE fullpath = ?"
+)
+
+
+def _near(part, bits):
+    """All 16 bit values within `bits` flipped bits of part."""
+    values = {part}
+    for _ in range(bits):
+        values |= {v ^ (1 << b) for v in values for b in range(16)}
+    return sorted(values)
+
+
+def hash_distance(a, b):
+    if a is None or b is None:
+        return None
+    return (_unsigned(a) ^ _unsigned(b)).bit_count()
+
+
+def find_similar(conn, hashes, radius=6, limit=50, exclude=None) -> List[Tuple]:
+    """Images within `radius` bits of both hashes, closest first.
+
+    Returns [(id, fullpath, path, distance)]. Candidates come from the dhash
+    part indexes, so only a few rows are read however large the table is.
+    """
+    radius = max(0, min(int(radius), MAX_RADIUS))
+    dhash, phash = _unsigned(hashes[0]), _unsigned(hashes[1])
+    parts = hash_parts(dhash)
+    where, params = [], []
+    for i, part in enumerate(parts):
+        near = _near(part, radius // 4)
+        where.append(f"dh{i} IN ({', '.join('?' * len(near))})")
+        params += near
+
+    found = []
+    for image_id, fullpath, path, dh, ph in conn.execute(
+        f"SELECT id, fullpath, path, dhash, phash FROM images WHERE {' OR '.join(where)}",
+        params,
+    ):
+        if fullpath == exclude:
+            continue
+        d = hash_distance(dh, dhash)
+        p = hash_distance(ph, phash)
+        if d is not None and d <= radius and (p is None or p <= radius):
+            found.append((image_id, fullpath, path, d))
+    found.sort(key=lambda row: (row[3], row[2]))
+    return found[:limit]
+
+
+def collapse(rows, radius=4) -> List[Tuple]:
+    """Group near duplicates in a list of (key, dhash, phash) rows.
+
+    Keeps the order of the rows. Returns [(key, [keys of its duplicates])],
+    the first image of each group stands in for the rest.
+    """
+    groups = []
+    for key, dh, ph in rows:
+        for group in groups:
+            d = hash_distance(dh, group[1])
+            p = hash_distance(ph, group[2])
+            if d is not None and d <= radius and (p is None or p <= radius):
+                group[3].append(key)
+                break
+        else:
+            groups.append((key, dh, ph, []))
+    return [(key, members) for key, _, _, members in groups]
+
+
+_STOP = object()
+
+
+def configure_connection(conn: sqlite3.Connection):
+    # WAL lets the readers keep going while the writer commits
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 30000")
+
+
+class ImageDatabase:
+    """Thread safe access to the image database.
+
+    Reads get a connection of their own from a small pool. All writes go
+    through one writer thread, which runs whatever is queued within
+    GROUP_COMMIT_WAIT in a single transaction, each write in a savepoint so
+    a failing one doesn't take the others with it.
+    """
+
+    def __init__(self, path, readers=4, writer=None):
+        self.path = str(path)
+        self.max_readers = readers
+        self.readers = queue.LifoQueue()
+        self.reader_count = 0
+        self.reader_lock = threading.Lock()
+
+        if writer is None:
+            writer = sqlite3.connect(self.path, check_same_thread=False)
+        self.writer = writer
+        configure_connection(self.writer)
+        create_schema(self.writer)
+
+        self.jobs = queue.Queue()
+        self.writer_thread = threading.Thread(
+            target=self._write_loop, name="imagedb-writer", daemon=True
+        )
+        self.writer_thread.start()
+
+    def _connect_reader(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        try:
+            conn = self.readers.get_nowait()
+        except queue.Empty:
+            with self.reader_lock:
+                create = self.reader_count < self.max_readers
+                if create:
+                    self.reader_count += 1
+            conn = self._connect_reader() if create else self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    def read(self, sql, params=()) -> List[Tuple]:
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def read_one(self, sql, params=()):
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    async def aread(self, sql, params=()) -> List[Tuple]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read, sql, params)
+
+    async def aread_one(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_one, sql, params)
+
+    def write(self, fn, *args, group=True) -> concurrent.futures.Future:
+        """Run fn(conn, *args) on the writer thread.
+
+        Grouped writes are committed together with whatever else is queued.
+        Pass group=False for jobs that handle their own transactions, they
+        run on their own between groups.
+        """
+        future = concurrent.futures.Future()
+        self.jobs.put((fn, args, group, future))
+        return future
+
+    def insert_images(self, rows: List[Dict]) -> concurrent.futures.Future:
+        return self.write(insert_images, rows)
+
+    @contextmanager
+    def _batched_writes(self):
+        """A write(fn, *args) that queues grouped jobs without waiting on each.
+
+        At most a few batches are in flight, the rest wait in the caller, so
+        other writes like add_image get in between them.
+        """
+        pending = collections.deque()
+
+        def write(fn, *args):
+            pending.append(self.write(fn, *args))
+            while len(pending) > 2:
+                pending.popleft().result()
+
+        try:
+            yield write
+        finally:
+            while pending:
+                pending.popleft().result()
+
+    def sync_folders(self, folders, workers=None) -> Dict[str, int]:
+        """sync_folders() with the files read outside the writer thread."""
+        with self.reader() as conn:
+            in_db = file_stats(conn)
+        with self._batched_writes() as write:
+            return _sync(folders, in_db, write, workers)
+
+    def backfill_hashes(self, workers=None) -> int:
+        with self.reader() as conn:
+            paths = missing_hashes(conn)
+        with self._batched_writes() as write:
+            return _backfill(paths, write, workers)
+
+    def close(self):
+        self.jobs.put(_STOP)
+        self.writer_thread.join()
+        self.writer.close()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+
+    def _write_loop(self):
+        pending = None
+        while True:
+            job, pending = pending or self.jobs.get(), None
+            if job is _STOP:
+                return
+            if not job[2]:
+                self._run_alone(job)
+                continue
+
+            batch = [job]
+            deadline = time.monotonic() + GROUP_COMMIT_WAIT
+            while len(batch) < SYNC_BATCH:
+                try:
+                    job = self.jobs.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is _STOP or not job[2]:
+                    pending = job
+                    break
+                batch.append(job)
+            self._run_group(batch)
+
+    def _run_alone(self, job):
+        fn, args, _, future = job
+        try:
+            future.set_result(fn(self.writer, *args))
+        except Exception as e:
+            self.writer.rollback()
+            future.set_exception(e)
+
+    def _run_group(self, batch):
+        results = []
+        try:
+            self.writer.execute("BEGIN")
+            for fn, args, _, future in batch:
+                self.writer.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(self.writer, *args), None))
+                    self.writer.execute("RELEASE job")
+                except Exception as e:
+                    self.writer.execute("ROLLBACK TO job")
+                    self.writer.execute("RELEASE job")
+                    results.append((future, None, e))
+            self.writer.commit()
+        except Exception as e:
+            self.writer.rollback()
+            results = [(future, None, e) for _, _, _, future in batch]
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+# Query language for the browser search box.
+#
+#   cat "red hat"        prompt contains words (prefix match), or a phrase
+#   -dog                 prompt does not contain the word
+#   neg:blurry           negative prompt contains the word
+#   model:juggernaut     model name contains the text
+#   hash:3a4f            model hash starts with the text
+#   seed:1234 steps:>20 cfg:4..7 width:>=1024 height:<800
+#   sampler:euler scheduler:karras size:1024x1024
+#   lora:detail          an image using a LoRA whose name contains the text
+#   path:2025-01         relative path contains the text
+#   date:2025-01-31 after:2025-01-01 before:2025-02-01
+#
+# Any filter can be negated with a leading "-".
+
+_TOKEN = re.compile(r'(-?)(?:(\w+):)?("[^"]*"?|\S+)')
+_NUMERIC = {
+    "seed": "seed",
+    "steps": "steps",
+    "cfg": "cfg",
+    "width": "width",
+    "height": "height",
+}
+_TEXT = {
+    "sampler": "sampler",
+    "scheduler": "scheduler",
+}
+
+
+def _fts_term(column, text):
+    text = text.strip('"').strip()
+    if not re.search(r"\w", text):
+        return None
+    text = text.replace('"', '""')
+    if " " in text:
+        return f'{column} : "{text}"'
+    return f'{column} : "{text}"*'
+
+
+def _numeric(column, value):
+    number = _to_float if column == "cfg" else _to_int
+    match = re.fullmatch(r"(.+)\.\.(.+)", value)
+    if match:
+        low, high = number(match.group(1)), number(match.group(2))
+        if low is None or high is None:
+            return None
+        return f"{column} BETWEEN ? AND ?", [low, high]
+    match = re.fullmatch(r"(>=|<=|>|<|=)?(.+)", value)
+    op = match.group(1) or "="
+    val = number(match.group(2))
+    if val is None:
+        return None
+    return f"{column} {op} ?", [val]
+
+
+def _date(value, end=False):
+    try:
+        day = datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return None
+    if end:
+        day += datetime.timedelta(days=1)
+    return day.timestamp()
+
+
+def _filter(field, value):
+    """SQL condition and parameters for a single field:value filter."""
+    value = value.strip('"')
+    if field in _NUMERIC:
+        return _numeric(_NUMERIC[field], value)
+    if field in _TEXT:
+        return f"{_TEXT[field]} = ? COLLATE NOCASE", [value]
+    if field == "model":
+        return "model LIKE ?", [f"%{value}%"]
+    if field == "hash":
+        return "model_hash LIKE ?", [f"{value}%"]
+    if field == "path":
+        return "path LIKE ?", [f"%{value}%"]
+    if field == "lora":
+        return (
+            "id IN (SELECT image_id FROM image_loras WHERE name LIKE ?)",
+            [f"%{value}%"],
+        )
+    if field == "size":
+        match = re.fullmatch(r"(\d+)[xX*](\d+)", value)
+        if match is None:
+            return None
+        return "width = ? AND height = ?", [int(match.group(1)), int(match.group(2))]
+    if field in ["date", "after", "before"]:
+        start, end = _date(value), _date(value, end=True)
+        if start is None:
+            return None
+        if field == "date":
+            return "created >= ? AND created < ?", [start, end]
+        if field == "after":
+            return "created >= ?", [start]
+        return "created < ?", [start]
+    return None
+
+
+def parse_query(text: str) -> Tuple[str, List]:
+    """Turn a search string into an SQL WHERE clause and its parameters."""
+    where = []
+    params = []
+    match_terms = []
+
+    for negate, field, value in _TOKEN.findall(text or ""):
+        field = field.lower()
+        condition = None
+
+        if field in ["", "neg", "negative"] or _filter(field, value) is None:
+            column = "negative" if field in ["neg", "negative"] else "prompt"
+            if field not in ["", "neg", "negative"]:
+                value = f"{field}:{value}"  # Unknown field, search for it as text
+            term = _fts_term(column, value)
+            if term is None:
+                continue
+            if negate:
+                condition = (
+                    "id NOT IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)",
+                    [term],
+                )
+            else:
+                match_terms.append(term)
+                continue
+        else:
+            sql, values = _filter(field, value)
+            condition = (f"NOT ({sql})" if negate else f"({sql})", values)
+
+        where.append(condition[0])
+        params += condition[1]
+
+    if match_terms:
+        where.insert(0, "id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+        params.insert(0, " AND ".join(match_terms))
+
+    if not where:
+        return "1", []
+    return " AND ".join(where), params
+
+
+def encode_cursor(path, image_id) -> str:
+    """Opaque cursor for the row a page ended on."""
+    data = json.dumps([path, image_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        path, image_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(path), int(image_id)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def page_query(where: str, params: List, limit: int, cursor=None, offset=0):
+    """Select one page in browser order, after the cursor if there is one.
+
+    With a cursor SQLite seeks straight to the next row through the path
+    index, so deep pages cost the same as the first one.
+    """
+    params = list(params)
+    key = decode_cursor(cursor) if cursor else None
+    if key is not None:
+        where = f"({where}) AND (path, id) < (?, ?)"
+        params += list(key)
+        offset = 0
+    sql = (
+        f"SELECT id, fullpath, path FROM images WHERE {where} "
+        "ORDER BY path DESC, id DESC LIMIT ? OFFSET ?"
+    )
+    return sql, params + [limit, offset]
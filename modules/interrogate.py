@@ -26,6 +26,9 @@ def brainblip_look(image, prompt, gr):
 
     return caption
 
+# Also used for the image browser's semantic search
+CLIP_MODEL = "ViT-L-14/openai"
+
 def clip_look(image, prompt, gr):
     text = "Lets interrogate"
 
@@ -35,7 +38,7 @@ def clip_look(image, prompt, gr):
 
     conf = Config(
         device=torch.device("cuda"),
-        clip_model_name="ViT-L-14/openai",
+        clip_model_name=CLIP_MODEL,
         cache_path=path_manager.model_paths["clip_path"],
     )
     conf.apply_low_vram_defaults()
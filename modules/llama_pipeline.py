@@ -10,10 +10,22 @@ from modules.util import TimeIt
 from pathlib import Path
 from modules.util import url_to_filename, load_file_from_url
 from shared import path_manager, settings, local_url
+import hashlib
 import json
+import os
+import threading
+import time
+import psutil
+import torch
 import xmltodict
 import modules.async_worker as worker
 
+# Seconds to collect streamed tokens before sending them on
+STREAM_INTERVAL = 0.05
+
+# Free VRAM, in GiB, an image generation wants while the llm is loaded
+IMAGE_VRAM = 8
+
 def llama_names():
         import os
         names = []
@@ -57,16 +69,13 @@ def run_llama(system_file, prompt):
                 print(f"LLAMA ERROR: Could not open file {system_file}")
                 return prompt
 
-        llama = pipeline()
-        llama.load_base_model()
-
         with TimeIt(""):
             print(f"# System:\n{system_prompt.strip()}\n")
             print(f"# User:\n{prompt.strip()}\n")
             print(f"# {name}: (Thinking...)")
             try:
-
-                ret = llama.llm.handle_completions(
+                ret = llama_server.completion(
+                    system_prompt,
                     {
                         "max_tokens": settings.default_settings.get("llm_hp_maxtokens", 256),
                         "prompt": system_prompt + "\n\n" + prompt,
@@ -79,52 +88,235 @@ def run_llama(system_file, prompt):
 
             print(f"{res.strip()}\n")
 
-        del llama.llm
-        llama.llm = None
-
         return res
 
-class pipeline:
-    pipeline_type = ["llama"]
 
-    llm = None
-    embeddings = None
-    embeddings_hash = ""
+class LlamaServer:
+    """One llama.cpp server shared by rewrite, chat and hyperprompt callers.
+
+    The model stays loaded between requests and is only dropped after it has
+    been idle for a while, or, if llm_memory_limit is set, when the system
+    runs low on memory. Each system prompt is pinned to a server slot so
+    llama.cpp can reuse its KV cache for the shared prefix on the next
+    request.
+    """
+
+    def __init__(self):
+        self.llm = None
+        self.localfile = None
+        self.slots = {}
+        self.busy = 0
+        self.last_used = 0.0
+        self.lock = threading.RLock()
+        # Notified when the last in-flight request finishes
+        self.idle = threading.Condition(self.lock)
+        self.queue = None
+        self.watchdog = None
+
+    def setting(self, name, default):
+        value = settings.default_settings.get(name, None)
+        return default if value in [None, ""] else value
+
+    def n_parallel(self):
+        return max(1, int(self.setting("llm_n_parallel", 1)))
+
+    def load(self):
+        localfile = settings.default_settings.get("llama_localfile", "Qwen2.5-7B-Instruct-abliterated-v2.Q4_K_M.gguf")
 
-    def parse_gen_data(self, gen_data):
-        return gen_data
+        with self.lock:
+            self.last_used = time.time()
+            while True:
+                if self.llm is not None and self.localfile == localfile:
+                    return self.llm
+                if self.busy == 0:
+                    break
+                # Switch models once the requests on the old one are done
+                self.idle.wait()
+            self.unload()
+
+            llm_path = path_manager.get_folder_file_path(
+                "llm",
+                localfile,
+                default = Path(path_manager.model_paths["llm_path"]) / localfile
+            )
 
-    def load_base_model(self):
-        localfile = settings.default_settings.get("llama_localfile", "Qwen2.5-7B-Instruct-abliterated-v2.Q4_K_M.gguf")
-        llm_path = path_manager.get_folder_file_path(
-            "llm",
-            localfile,
-            default = Path(path_manager.model_paths["llm_path"]) / localfile
+            # Threads from the host, physical cores for generation and all
+            # logical cores for prompt processing.
+            logical = os.cpu_count() or 4
+            physical = psutil.cpu_count(logical=False) or max(1, logical // 2)
+            n_parallel = self.n_parallel()
+
+            with TimeIt("Load LLM"):
+                print(f"Loading {localfile}")
+
+                params = xlc.CommonParams()
+                params.prompt = ""
+                params.model.path = str(llm_path)
+                params.n_predict = int(self.setting("llm_n_predict", -1))
+                # The context is split between the slots, each gets llm_n_ctx
+                params.n_ctx = int(self.setting("llm_n_ctx", 2048)) * n_parallel
+                params.n_gpu_layers = int(self.setting("llm_n_gpu_layers", -1))
+                params.ctx_shift = True
+                params.n_parallel = n_parallel
+                params.cont_batching = True
+                params.cpuparams.n_threads = int(self.setting("llm_n_threads", physical))
+                params.cpuparams_batch.n_threads = int(self.setting("llm_n_threads_batch", logical))
+                params.endpoint_metrics = False
+                params.use_jinja = True
+
+                self.llm = xlc.Server(params) # FIXME hide output?
+
+            self.localfile = localfile
+            self.slots = {}
+            # Requests beyond the number of slots wait here
+            self.queue = threading.Semaphore(n_parallel)
+            self.start_watchdog()
+            return self.llm
+
+    def unload(self):
+        with self.lock:
+            if self.llm is None:
+                return
+            print("Unloading LLM")
+            del self.llm
+            self.llm = None
+            self.localfile = None
+            self.slots = {}
+
+    def slot_for(self, system_prompt):
+        # Keep the most recently used system prompts on their own slot
+        key = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        with self.lock:
+            if key in self.slots:
+                self.slots[key] = self.slots.pop(key)
+            else:
+                if len(self.slots) >= self.n_parallel():
+                    slot = self.slots.pop(next(iter(self.slots)))
+                else:
+                    slot = len(self.slots)
+                self.slots[key] = slot
+            return self.slots[key]
+
+    def request(self, system_prompt, data, handler):
+        with self.lock:
+            llm = self.load()
+            queue = self.queue
+            data = dict(data, id_slot=self.slot_for(system_prompt), cache_prompt=True)
+            self.busy += 1
+
+        try:
+            with queue:
+                return handler(llm, data)
+        finally:
+            with self.lock:
+                self.busy -= 1
+                self.last_used = time.time()
+                if self.busy == 0:
+                    self.idle.notify_all()
+
+    def completion(self, system_prompt, data):
+        return self.request(
+            system_prompt,
+            data,
+            lambda llm, d: llm.handle_completions(d),
         )
-        with TimeIt("Load LLM"):
-            print(f"Loading {localfile}")
-
-            params = xlc.CommonParams()
-            params.prompt = ""
-            params.model.path = str(llm_path)
-            params.n_predict = int(settings.default_settings.get("llm_n_predict", -1))
-            params.n_ctx = int(settings.default_settings.get("llm_n_ctx", 2048))
-            params.n_gpu_layers = int(settings.default_settings.get("llm_n_gpu_layers", -1))
-            params.ctx_shift = True
-            params.cpuparams.n_threads = 4
-            params.cpuparams_batch.n_threads = 2
-            params.endpoint_metrics = False
-            params.use_jinja = True
-
-            self.llm = xlc.Server(params) # FIXME hide output?
 
-        self.embeddings = None
+    def chat_completion(self, system_prompt, data, callback):
+        return self.request(
+            system_prompt,
+            data,
+            lambda llm, d: llm.handle_chat_completions(d, callback),
+        )
 
-    def index_source(self, source):
-        if self.embeddings == None:
-            self.embeddings = Embeddings(content=True)
-            self.embeddings.initindex(reindex=True)
+    def memory_pressure(self):
+        # Off unless llm_memory_limit, a percentage of system memory, is set
+        limit = float(self.setting("llm_memory_limit", 0))
+        return limit > 0 and psutil.virtual_memory().percent >= limit
+
+    def vram_pressure(self):
+        # Only a model with layers on the GPU takes VRAM from the image model
+        if self.llm is None or int(self.setting("llm_n_gpu_layers", -1)) == 0:
+            return False
+        if not torch.cuda.is_available():
+            return False
+        free, _ = torch.cuda.mem_get_info()
+        return free < float(self.setting("llm_image_vram", IMAGE_VRAM)) * 1024**3
+
+    def release_if_pressure(self):
+        # Called before something else needs the memory, e.g. an image tool call
+        with self.lock:
+            if self.busy == 0 and (
+                self.setting("llm_unload_for_images", False)
+                or self.vram_pressure()
+                or self.memory_pressure()
+            ):
+                self.unload()
+
+    def watch(self):
+        while True:
+            time.sleep(10)
+            with self.lock:
+                if self.llm is None:
+                    self.watchdog = None
+                    return
+                if self.busy > 0:
+                    continue
+                timeout = float(self.setting("llm_idle_timeout", 600))
+                if time.time() - self.last_used > timeout:
+                    print("LLM idle.")
+                    self.unload()
+                elif self.memory_pressure():
+                    print("LLM unloading, low on memory.")
+                    self.unload()
+
+    def start_watchdog(self):
+        if self.watchdog is None:
+            self.watchdog = threading.Thread(target=self.watch, daemon=True)
+            self.watchdog.start()
+
+
+llama_server = LlamaServer()
+
+class EmbeddingIndex:
+    """Persistent txtai index for one assistant, stored under cache/embeds/.
+
+    Chunks are keyed by the hash of their text, so only new or changed chunks
+    are embedded when the sources change. Indexes are loaded from disk on
+    first use and memory-mapped when the backend allows it.
+    """
+
+    path = Path("cache/embeds/index")
+    loaded = {}
+    max_loaded = 4
+
+    def __init__(self, name):
+        self.name = name
+        self.dir = self.path / name
+        self.manifest = self.path / f"{name}.json"
+        self.embeddings = None
+        self.sources = None
+        self.ids = set()
+        if self.manifest.exists():
+            try:
+                with open(self.manifest, "r", encoding="utf-8") as f:
+                    self.ids = set(json.load(f))
+            except Exception as e:
+                print(f"WARNING: Could not read {self.manifest}: {e}")
 
+    @classmethod
+    def get(cls, name):
+        # Keep a few recently used indexes in memory for quick switching
+        if name in cls.loaded:
+            index = cls.loaded.pop(name)
+        else:
+            index = cls(name)
+            while len(cls.loaded) >= cls.max_loaded:
+                cls.loaded.pop(next(iter(cls.loaded)))
+        cls.loaded[name] = index
+        return index
+
+    @staticmethod
+    def chunks(source):
         match source[0]:
 
             case "url":
@@ -148,13 +340,82 @@ class pipeline:
                 data = source[1]
 
             case _:
-                print("WARNING: Unknown embedding type {source[0]}")
-                return
+                print(f"WARNING: Unknown embedding type {source[0]}")
+                return []
+
+        if isinstance(data, str):
+            data = [data]
+        return [x for x in data if x and x.strip()]
+
+    def load(self, mmap=True):
+        if self.embeddings is not None or not self.ids:
+            return self.embeddings
+        embeddings = Embeddings()
+        if not embeddings.exists(str(self.dir)):
+            self.ids = set()
+            return None
+        try:
+            embeddings.load(str(self.dir), config={"faiss": {"mmap": True}} if mmap else None)
+        except Exception:
+            # Not every faiss index type can be memory-mapped
+            embeddings.load(str(self.dir))
+        self.embeddings = embeddings
+        return self.embeddings
+
+    def sync(self, sources):
+        if self.sources == str(sources):
+            return self.embeddings
+
+        chunks = {}
+        for source in sources:
+            for text in self.chunks(source):
+                chunks[hashlib.sha256(text.encode("utf-8")).hexdigest()] = text
+
+        new = [(k, v, None) for k, v in chunks.items() if k not in self.ids]
+        removed = [k for k in self.ids if k not in chunks]
+
+        if not chunks:
+            self.embeddings = None
+            self.ids = set()
+        elif new or removed:
+            with TimeIt("Update embeddings"):
+                # Updates need the index in memory, not memory-mapped
+                self.embeddings = None
+                embeddings = Embeddings(content=True)
+                if self.ids and embeddings.exists(str(self.dir)):
+                    embeddings.load(str(self.dir))
+                    if removed:
+                        embeddings.delete(removed)
+                else:
+                    new = [(k, v, None) for k, v in chunks.items()]
+                print(f"Embedding {len(new)} chunks for {self.name}")
+                if new:
+                    embeddings.upsert(new)
+                self.path.mkdir(parents=True, exist_ok=True)
+                embeddings.save(str(self.dir))
+                self.ids = set(chunks)
+                with open(self.manifest, "w", encoding="utf-8") as f:
+                    json.dump(sorted(self.ids), f)
+                self.embeddings = embeddings
+        else:
+            self.load()
 
-        if data:
-            self.embeddings.upsert(data)
+        self.sources = str(sources)
+        return self.embeddings
 
 
+class pipeline:
+    pipeline_type = ["llama"]
+
+    embeddings = None
+
+    def parse_gen_data(self, gen_data):
+        return gen_data
+
+    def load_base_model(self):
+        llama_server.load()
+        self.embeddings = None
+
     def process(self, gen_data):
         if Llama == None:
             return "Error: There is no Llama"
@@ -165,19 +426,16 @@ class pipeline:
             gen_data["history"] + [{"role": "assistant", "content": "🤔"}]
         )
 
-        if self.llm == None:
-            self.load_base_model()
+        llama_server.load()
 
-        # load embeds?
-        # FIXME should dump the entire gen_data["embed"] to index_source() and have it sort it out
+        # Each assistant has its own index on disk, named by its system prompt
+        # and sources, so assistants that only share one of them don't
+        # rebuild each other's index
         embed = json.loads(gen_data['embed'])
-        if self.embeddings_hash != str(embed):
-            self.embeddings_hash = str(embed)
-            self.embeddings = None
         if embed:
-            if not self.embeddings: # If chatbot has embeddings to index, check that we have them.
-                for source in embed:
-                    self.index_source(source)
+            ident = json.dumps([gen_data["system"], embed])
+            name = hashlib.sha256(ident.encode("utf-8")).hexdigest()[:16]
+            self.embeddings = EmbeddingIndex.get(name).sync(embed)
         else:
             self.embeddings = None
 
@@ -242,6 +500,25 @@ class pipeline:
                 }
             }
 
+            # Tokens are sent as numbered deltas, collected for a short while
+            # so we don't queue one result per token.
+            stream = {
+                "seq": 0,
+                "pending": "",
+                "last": time.time(),
+            }
+
+            def flush():
+                if stream["pending"]:
+                    stream["seq"] += 1
+                    worker.add_result(
+                        gen_data["task_id"],
+                        "delta",
+                        (stream["seq"], stream["pending"])
+                    )
+                    stream["pending"] = ""
+                stream["last"] = time.time()
+
             def callback(chunk):
                 if len(chunk.get('choices', [])) == 0:
                     return
@@ -257,11 +534,9 @@ class pipeline:
                     if text is not None:
                         #print(text, end="")
                         result['text'] += text
-                        worker.add_result(
-                            gen_data["task_id"],
-                            "preview",
-                            gen_data["history"] + [{"role": "assistant", "content": result['text']}]
-                        )
+                        stream["pending"] += text
+                        if time.time() - stream["last"] >= STREAM_INTERVAL:
+                            flush()
 
                 if 'tool_calls' in delta:
                     tool_call = delta['tool_calls'][0]['function'] # Simply assume we only have a single tool call
@@ -269,7 +544,8 @@ class pipeline:
                         result['tool']['function'] = tool_call['name']
                     result['tool']['arguments'] += tool_call['arguments']
 
-            self.llm.handle_chat_completions(
+            llama_server.chat_completion(
+                gen_data["system"],
                 {
                     "stream": True,
                     "messages": chat,
@@ -277,6 +553,7 @@ class pipeline:
                 },
                 lambda d: callback(d),
             )
+            flush()
 
             text = result['text']
 
@@ -313,10 +590,8 @@ class pipeline:
                         'image_number': 1,
                     }
 
-                    # unload llm model from memory?
-                    # TODO: make this selectable for people with more ram/vram that is socialy acceptable
-                    del self.llm
-                    self.llm = None
+                    # Only drop the llm if the image model needs the memory
+                    llama_server.release_if_pressure()
 
                     info_txt = "(Generating image...)"
                     tmp_text = text + "\n" + info_txt
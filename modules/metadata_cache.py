@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from modules.png_text import read_png_text
+
+# Parsed generation parameters of image files, keyed by path, size and mtime
+# so an overwritten file is read again.
+CACHE_SIZE = 2048
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _parse(text):
+    if not text:
+        return {}
+    try:
+        params = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    return params if isinstance(params, dict) else {}
+
+
+def _from_db(db, paths, st):
+    row = db.read_one(
+        f"SELECT json, file_size, mtime FROM images WHERE fullpath IN ({', '.join('?' * len(paths))})",
+        paths,
+    )
+    if row is None or row[1] != st.st_size or row[2] != st.st_mtime:
+        return None
+    try:
+        return _parse(json.loads(row[0]).get("parameters"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def read_parameters(path, db=None, aliases=()):
+    """The parameters JSON of an image as a dict, {} if it has none.
+
+    Comes from the LRU, then the browser DB if the row is up to date with
+    the file, and only then from the PNG text chunks. aliases are other
+    spellings of the path the DB may know the file by.
+    """
+    path = str(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    params = None
+    if db is not None:
+        params = _from_db(db, [path, *map(str, aliases)], st)
+    if params is None:
+        params = _parse(read_png_text(path).get("parameters"))
+
+    with _lock:
+        _cache[key] = params
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return params
+
+
+class PresetManifest:
+    """The preset listing, rebuilt only when the files in the folder change."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folder = None
+        self.signature = None
+        self.presets = []
+
+    def _scan(self, folder):
+        found = []
+
+        def walk(top):
+            try:
+                entries = list(os.scandir(top))
+            except OSError:
+                return
+            for entry in entries:
+                if entry.is_dir():
+                    walk(entry.path)
+                elif entry.name.lower().endswith(".png"):
+                    st = entry.stat()
+                    found.append((entry.path, st.st_size, st.st_mtime_ns))
+
+        walk(folder)
+        return sorted(found)
+
+    def get(self, folder):
+        files = self._scan(str(folder))
+        with self.lock:
+            if folder == self.folder and files == self.signature:
+                return self.presets
+
+        presets = []
+        for path, _, _ in files:
+            png = Path(path)
+            name = png.with_suffix("").name
+            if name.startswith("Place_preset") or name.startswith("."):
+                continue
+
+            metadata = None
+            try:
+                metadata = read_parameters(png) or None
+            except OSError as e:
+                print(f"WARNING: Failed to read preset metadata from {png.name}: {e}")
+
+            presets.append({
+                "name": name,
+                "filename": png.name,
+                "metadata": metadata,
+            })
+
+        with self.lock:
+            self.folder, self.signature, self.presets = folder, files, presets
+        return presets
+
+
+preset_manifest = PresetManifest()
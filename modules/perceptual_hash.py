@@ -0,0 +1,60 @@
+import numpy as np
+from PIL import Image
+
+# 64 bit difference and DCT hashes. Both work on stacks of grayscale
+# thumbnails so a batch of images is hashed in one go.
+
+HASH_BITS = 64
+_WEIGHTS = np.left_shift(np.uint64(1), np.arange(63, -1, -1, dtype=np.uint64))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] *= 1 / np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def _pack(bits):
+    """(..., 64) booleans -> (...) unsigned 64 bit ints."""
+    return (bits.astype(np.uint64) * _WEIGHTS).sum(axis=-1, dtype=np.uint64)
+
+
+def dhash(pixels):
+    """Difference hash of (..., 8, 9) grayscale arrays."""
+    pixels = np.asarray(pixels, dtype=np.float32)
+    bits = pixels[..., :, 1:] > pixels[..., :, :-1]
+    return _pack(bits.reshape(bits.shape[:-2] + (64,)))
+
+
+def phash(pixels):
+    """DCT hash of (..., 32, 32) grayscale arrays."""
+    pixels = np.asarray(pixels, dtype=np.float64)
+    dct = _DCT32 @ pixels @ _DCT32.T
+    low = dct[..., :8, :8].reshape(dct.shape[:-2] + (64,))
+    median = np.median(low[..., 1:], axis=-1, keepdims=True)  # Skip the DC term
+    return _pack(low > median)
+
+
+def prepare(image: Image.Image):
+    """Grayscale (8, 9) and (32, 32) arrays for the two hashes."""
+    gray = image.convert("L")
+    small = np.asarray(gray.resize((9, 8), Image.Resampling.BOX))
+    large = np.asarray(gray.resize((32, 32), Image.Resampling.BOX))
+    return small, large
+
+
+def image_hashes(image):
+    """(dhash, phash) of a PIL image or a path to one."""
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as im:
+            return image_hashes(im)
+    small, large = prepare(image)
+    return int(dhash(small)), int(phash(large))
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
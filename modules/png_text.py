@@ -0,0 +1,56 @@
+import struct
+import zlib
+from typing import Dict
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _decompress(data: bytes) -> bytes:
+    try:
+        return zlib.decompress(data)
+    except zlib.error:
+        return b""
+
+
+def read_png_text(path) -> Dict[str, str]:
+    """Read the tEXt, zTXt and iTXt chunks of a PNG without decoding pixels.
+
+    Only the chunks in front of the image data are read, the same ones PIL
+    puts in Image.info when opening a file. Returns {} for anything that
+    isn't a readable PNG.
+    """
+    text = {}
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) != PNG_SIGNATURE:
+                return {}
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                length, chunk_type = struct.unpack(">I4s", header)
+                if chunk_type in (b"IDAT", b"IEND"):
+                    break
+                if chunk_type not in (b"tEXt", b"zTXt", b"iTXt"):
+                    f.seek(length + 4, 1)  # Skip data and crc
+                    continue
+
+                data = f.read(length)
+                f.seek(4, 1)
+                key, _, value = data.partition(b"\0")
+                key = key.decode("latin-1")
+
+                if chunk_type == b"tEXt":
+                    text[key] = value.decode("latin-1")
+                elif chunk_type == b"zTXt":
+                    text[key] = _decompress(value[1:]).decode("latin-1")
+                else:
+                    compressed = value[:1] == b"\1"
+                    _, _, value = value[2:].partition(b"\0")  # Language tag
+                    _, _, value = value.partition(b"\0")  # Translated keyword
+                    if compressed:
+                        value = _decompress(value)
+                    text[key] = value.decode("utf-8", errors="replace")
+    except (OSError, struct.error):
+        return {}
+    return text
@@ -26,6 +26,7 @@ def safe_str(x):
 class FooocusExpansion:
     tokenizer = None
     model = None
+    logits_bias = None
 
     def __init__(self):
         self.load_model_and_tokenizer(fooocus_expansion_path)
@@ -40,80 +41,143 @@ class FooocusExpansion:
     def load_model_and_tokenizer(cls, model_path):
         if cls.tokenizer is None or cls.model is None:
             cls.tokenizer = AutoTokenizer.from_pretrained(model_path)
+            # GPT-2 has no pad token, pad on the left so batched rows all
+            # continue generating from the end of their own prompt.
+            cls.tokenizer.pad_token = cls.tokenizer.eos_token
+            cls.tokenizer.padding_side = "left"
             cls.model = AutoModelForCausalLM.from_pretrained(model_path)
             cls.model.to("cpu")
+        if cls.logits_bias is None:
+            cls.logits_bias = cls.build_logits_bias(cls.tokenizer, model_path)
 
-    def __call__(self, prompt, seed):
-        seed = int(seed) % SEED_LIMIT_NUMPY
-        set_seed(seed)
-        positive_words = (
-            open(os.path.join(fooocus_expansion_path, "positive.txt"), encoding="utf-8")
-            .read()
-            .splitlines()
-        )
-        positive_words = ["Ġ" + x.lower() for x in positive_words if x != ""]
-        self.logits_bias = (
-            torch.zeros((1, len(self.tokenizer.vocab)), dtype=torch.float32) + neg_inf
+    @staticmethod
+    def build_logits_bias(tokenizer, model_path):
+        with open(os.path.join(model_path, "positive.txt"), encoding="utf-8") as f:
+            positive_words = {"Ġ" + x.lower() for x in f.read().splitlines() if x != ""}
+        vocab = tokenizer.vocab
+        positive_ids = torch.tensor(
+            [vocab[k] for k in positive_words if k in vocab], dtype=torch.long
         )
-        debug_list = []
-        for k, v in self.tokenizer.vocab.items():
-            if k in positive_words:
-                self.logits_bias[0, v] = 0
-                debug_list.append(k[1:])
-        # print(f'Expansion: Vocab with {len(debug_list)} words.')
-
-        text = safe_str(prompt) + ","
-        tokenized_kwargs = self.tokenizer(text, return_tensors="pt")
+        logits_bias = torch.full((1, len(vocab)), neg_inf, dtype=torch.float32)
+        logits_bias[0, positive_ids] = 0
+        # print(f'Expansion: Vocab with {len(positive_ids)} words.')
+        return logits_bias
+
+    def __call__(self, prompt, seed):
+        return self.expand_batch([prompt], seed)[0]
+
+    def expand_batch(self, prompts, seed):
+        # One generate call samples the whole batch from a single random
+        # stream, so there is one seed for all rows. A row's result depends on
+        # the seed and on the other rows, only a batch of one gives the same
+        # result as __call__ with that seed.
+        set_seed(int(seed) % SEED_LIMIT_NUMPY)
+
+        texts = [safe_str(prompt) + "," for prompt in prompts]
+        tokenized_kwargs = self.tokenizer(texts, return_tensors="pt", padding=True)
         tokenized_kwargs.data["input_ids"] = tokenized_kwargs.data["input_ids"].to(
             self.patcher.load_device
         )
         tokenized_kwargs.data["attention_mask"] = tokenized_kwargs.data[
             "attention_mask"
         ].to(self.patcher.load_device)
-        current_token_length = int(tokenized_kwargs.data["input_ids"].shape[1])
-        max_token_length = 75 * int(math.ceil(float(current_token_length) / 75.0))
-        max_new_tokens = max_token_length - current_token_length
+
+        # Each row fills up to the end of its own 75 token chunk.
+        token_lengths = tokenized_kwargs.data["attention_mask"].sum(dim=1).tolist()
+        max_new_tokens = [
+            75 * int(math.ceil(float(length) / 75.0)) - int(length)
+            for length in token_lengths
+        ]
         features = self.model.generate(
             **tokenized_kwargs,
             top_k=100,
-            max_new_tokens=max_new_tokens,
+            max_new_tokens=max(max_new_tokens),
             do_sample=True,
+            pad_token_id=self.tokenizer.pad_token_id,
             logits_processor=LogitsProcessorList([self.logits_processor])
         )
 
-        response = self.tokenizer.batch_decode(features, skip_special_tokens=True)
-        result = safe_str(response[0])
-        return result
+        input_length = int(tokenized_kwargs.data["input_ids"].shape[1])
+        results = []
+        for row, new_tokens in zip(features, max_new_tokens):
+            response = self.tokenizer.decode(
+                row[: input_length + new_tokens], skip_special_tokens=True
+            )
+            results.append(safe_str(response))
+        return results
 
     def logits_processor(self, input_ids, scores):
-        assert scores.ndim == 2 and scores.shape[0] == 1
-        self.logits_bias = self.logits_bias.to(scores)
-
-        bias = self.logits_bias.clone()
-        bias[0, input_ids[0].to(bias.device).long()] = neg_inf
-        bias[0, 11] = 0
+        assert scores.ndim == 2
+        if (
+            self.logits_bias.device != scores.device
+            or self.logits_bias.dtype != scores.dtype
+        ):
+            FooocusExpansion.logits_bias = self.logits_bias.to(scores)
+
+        bias = self.logits_bias.repeat(scores.shape[0], 1)
+        bias.scatter_(1, input_ids.to(bias.device).long(), neg_inf)
+        bias[:, 11] = 0
         return scores + bias
 
 
 class PromptExpansion:
-    # Define the expected input types for the node
-    @staticmethod
-    @torch.no_grad()
-    def expand_prompt(text):
-        expansion = FooocusExpansion()
+    # The expansion model stays resident once it has been loaded
+    expansion = None
+    # Results from prefetch(), consumed by expand_prompt()
+    prefetched = {}
 
-        prompt = remove_empty_str([safe_str(text)], default="")[0]
+    @classmethod
+    def get_expansion(cls):
+        if cls.expansion is None:
+            cls.expansion = FooocusExpansion()
+        return cls.expansion
+
+    @staticmethod
+    def clean_prompt(text):
+        return remove_empty_str([safe_str(text)], default="")[0]
 
+    @staticmethod
+    def random_seed():
         max_seed = int(1024 * 1024 * 1024)
         seed = random.randint(1, max_seed)
         if seed < 0:
             seed = -seed
-        seed = seed % max_seed
+        return seed % max_seed
+
+    @classmethod
+    @torch.no_grad()
+    def expand_prompt(cls, text):
+        prompt = cls.clean_prompt(text)
 
-        expansion_text = expansion(prompt, seed)
-        final_prompt = expansion_text
+        if cls.prefetched.get(prompt):
+            return cls.prefetched[prompt].pop(0)
 
-        return final_prompt
+        return cls.get_expansion()(prompt, cls.random_seed())
+
+    @classmethod
+    @torch.no_grad()
+    def expand_prompts(cls, texts, seed=None):
+        """Expand a list of prompts in one batch, see expand_batch() for the seed."""
+        if not texts:
+            return []
+
+        prompts = [cls.clean_prompt(text) for text in texts]
+        if seed is None:
+            seed = cls.random_seed()
+
+        return cls.get_expansion().expand_batch(prompts, seed)
+
+    @classmethod
+    def clear_prefetched(cls):
+        cls.prefetched = {}
+
+    @classmethod
+    def prefetch(cls, texts, seed=None):
+        # Expand a whole prompt list in one go, later expand_prompt() calls
+        # with the same text pick up these results instead of generating.
+        cls.prefetched = {}
+        for text, result in zip(texts, cls.expand_prompts(texts, seed)):
+            cls.prefetched.setdefault(cls.clean_prompt(text), []).append(result)
 
 
 # Define a mapping of node class names to their respective classes
@@ -1,9 +1,9 @@
-import os
 import re
 import random
 import json
 
-from modules.sdxl_styles import apply_style, allstyles
+from modules import wildcards
+from modules.sdxl_styles import apply_style, allstyles, flufferizer_input, prompt_expansion
 from random_prompt.build_dynamic_prompt import (
     build_dynamic_prompt,
     build_dynamic_negative,
@@ -32,203 +32,146 @@ def get_promptlist(gen_data):
     return gen_data["prompt"].split("---")
 
 
-def process_wildcards(wildcard_text, directory="wildcards"):
-    # removed regex method
-    placeholders = []
-    splitup = wildcard_text.split("__")
-    for i in range(len(splitup)):
-        if i % 2 != 0:  # check if index is odd
-            placeholders.append(splitup[i])
-
-    placeholder_choices = {}  # Store random choices for each placeholder
-    official_directory = "wildcards_official"
-    directories = []
-    user_data = os.environ.get("RF_USER_DATA")
-    if user_data:
-        directories.append(os.path.join(user_data, directory))
-    directories.append(directory)
-    directories.append(official_directory)
-
-    for placeholder in placeholders:
-        # Skip onebuttonprompt wildcards for now; handled below
-        if placeholder.startswith("onebutton"):
-            continue
-
-        elif placeholder not in placeholder_choices:
-            found = False
-            for dir in directories:
-                for root, dirs, files in os.walk(dir):
-                    if f"{placeholder}.txt" in files:
-                        file_path = os.path.join(root, f"{placeholder}.txt")
-                        with open(file_path, encoding="utf-8") as f:
-                            words = [
-                                word.strip()
-                                for word in f.read().splitlines()
-                                if not word.startswith("#")
-                            ]
-                        placeholder_choices[placeholder] = words
-                        found = True
-                        break
-                if found == True:
-                    break
-
-            if not found:
-                print(
-                    f"Error: Could not find file {placeholder}.txt in {directory} or its subdirectories."
-                )
-                placeholder_choices[placeholder] = [f"{placeholder}"]
-
-    for placeholder in placeholders:
-        random_choice = ""
-
-        # Some one button prompt specials
-        if placeholder.startswith("onebutton"):
-            subjectoverride = ""
-            placeholdersplit = placeholder.split(":", 1)
-            if len(placeholdersplit) > 1:
-                subjectoverride = placeholdersplit[1]
-
-            if placeholder.startswith("onebuttonprompt"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    givensubject=subjectoverride,
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonsubject"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonhumanoid"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="human - all",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonmale"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="human - all",
-                    gender="male",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonfemale"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="human - all",
-                    gender="female",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonanimal"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="animal - all",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonobject"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="object",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonlandscape"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="landscape - all",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonconcept"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="concept - all",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebuttonartist"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    onlyartists=True,
-                    artists=subjectoverride or "all",
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
-            elif placeholder.startswith("onebutton1girl"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="human - all",
-                    gender="female",
-                    advancedprompting=False,
-                    base_model="Anime Model",
-                )
-            elif placeholder.startswith("onebutton1boy"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="human - all",
-                    gender="male",
-                    advancedprompting=False,
-                    base_model="Anime Model",
-                )
-            elif placeholder.startswith("onebuttonfurry"):
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=5,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    forcesubject="animal - all",
-                    advancedprompting=False,
-                    base_model="Anime Model",
-                )
-            # failover
-            else:
-                random_choice = build_dynamic_prompt(
-                    insanitylevel=3,
-                    imagetype="subject only mode",
-                    givensubject=subjectoverride,
-                    advancedprompting=False,
-                    base_model="SDXL",
-                )
+def onebutton_wildcard(placeholder):
+    """Prompt for the __onebutton...__ wildcards, __onebuttonprompt:subject__ sets the subject."""
+    random_choice = ""
+    subjectoverride = ""
+    placeholdersplit = placeholder.split(":", 1)
+    if len(placeholdersplit) > 1:
+        subjectoverride = placeholdersplit[1]
 
-        # Regular wildcards
-        else:
-            random_choice = random.choice(placeholder_choices[placeholder])
+    if placeholder.startswith("onebuttonprompt"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            givensubject=subjectoverride,
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonsubject"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonhumanoid"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="human - all",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonmale"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="human - all",
+            gender="male",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonfemale"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="human - all",
+            gender="female",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonanimal"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="animal - all",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonobject"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="object",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonlandscape"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="landscape - all",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonconcept"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="concept - all",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebuttonartist"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            onlyartists=True,
+            artists=subjectoverride or "all",
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+    elif placeholder.startswith("onebutton1girl"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="human - all",
+            gender="female",
+            advancedprompting=False,
+            base_model="Anime Model",
+        )
+    elif placeholder.startswith("onebutton1boy"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="human - all",
+            gender="male",
+            advancedprompting=False,
+            base_model="Anime Model",
+        )
+    elif placeholder.startswith("onebuttonfurry"):
+        random_choice = build_dynamic_prompt(
+            insanitylevel=5,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            forcesubject="animal - all",
+            advancedprompting=False,
+            base_model="Anime Model",
+        )
+    # failover
+    else:
+        random_choice = build_dynamic_prompt(
+            insanitylevel=3,
+            imagetype="subject only mode",
+            givensubject=subjectoverride,
+            advancedprompting=False,
+            base_model="SDXL",
+        )
+
+    return random_choice
 
-        try:
-            wildcard_text = re.sub(
-                rf"__{placeholder}__", random_choice, wildcard_text, count=1
-            )
-        except Exception as e:
-            print(f"ERROR: {e}")
-            print(f"    placeholder: {placeholder}")
-            print(f"  random_choice: {random_choice}")
 
-    return wildcard_text
+def process_wildcards(wildcard_text):
+    return wildcards.registry.resolve(wildcard_text, special=onebutton_wildcard)
 
 
 def process_prompt(style, prompt, negative, gen_data=[]):
@@ -257,11 +200,7 @@ def process_prompt(style, prompt, negative, gen_data=[]):
         )
 
     # styles
-    pattern = re.compile(r"<style:([^>]+)>")
-    styles = [] if style is None else style.copy()
-    for match in re.finditer(pattern, prompt):
-        styles += [f"Style: {match.group(1)}"]
-    prompt = re.sub(pattern, "", prompt)
+    styles, prompt = prompt_styles(style, prompt)
     if "lora_keywords" in gen_data:
         keywords = gen_data["lora_keywords"]
     else:
@@ -269,13 +208,7 @@ def process_prompt(style, prompt, negative, gen_data=[]):
     p_txt, n_txt = apply_style(styles, prompt, negative, keywords)
 
     # wildcards
-    wildcard_pattern = r"__([\w\-:]+)__"
-    wildcard_pattern_onebutton = r"__([\w]+:[^\s_]+(?:[^\s_]+|\s(?=[\w:]+))*)__"
-    while (
-        (match := re.search(wildcard_pattern, p_txt))
-        or (match := re.search(wildcard_pattern_onebutton, p_txt))
-    ) is not None:
-        p_txt = process_wildcards(p_txt)
+    p_txt = process_wildcards(p_txt)
 
     # apply auto negative prompt if enabled
     if "auto_negative" in gen_data and gen_data["auto_negative"] == True:
@@ -285,6 +218,38 @@ def process_prompt(style, prompt, negative, gen_data=[]):
     return p_txt, n_txt
 
 
+def prompt_styles(style, prompt):
+    # The selected styles plus the <style:...> tags in the prompt, and the
+    # prompt without the tags.
+    pattern = re.compile(r"<style:([^>]+)>")
+    styles = [] if style is None else style.copy()
+    for match in re.finditer(pattern, prompt):
+        styles += [f"Style: {match.group(1)}"]
+    return styles, re.sub(pattern, "", prompt)
+
+
+def prefetch_expansions(style, prompts, gen_data, count=1):
+    # Let the Flufferizer expand a whole prompt list in one generate call,
+    # process_prompt() then picks the results up image by image. The texts
+    # are styled the way process_prompt() styles them.
+    if gen_data.get("obp_assume_direct_control"):
+        return  # process_prompt() replaces the prompts with new OBP ones
+    texts = []
+    for prompt in prompts:
+        styles, prompt = prompt_styles(style, prompt)
+        text = flufferizer_input(styles, prompt)
+        if text is not None:
+            texts += [text] * max(count, 1)
+
+    if len(texts) > 1:
+        prompt_expansion.prefetch(texts)
+
+
+def clear_expansions():
+    # Prefetched expansions are only for the task that prefetched them
+    prompt_expansion.clear_prefetched()
+
+
 def parse_loras(prompt, negative):
     pattern = re.compile(r"<lora:([^>]+):(\d*\.*\d+)>")
     loras = []
@@ -295,6 +260,18 @@ def parse_loras(prompt, negative):
     return loras, re.sub(pattern, "", prompt), re.sub(pattern, "", negative)
 
 
+def prompt_switch_timeline(prompt, steps):
+    """The prompts of prompt_switch_per_step as [prompt, first step, last step]
+    runs, with the steps that have the same prompt next to each other merged."""
+    timeline = []
+    for i, text in enumerate(prompt_switch_per_step(prompt, steps)):
+        if timeline and timeline[-1][0] == text:
+            timeline[-1][2] = i
+        else:
+            timeline.append([text, i, i])
+    return timeline
+
+
 def prompt_switch_per_step(prompt, steps):
     # Find all occurrences of [option1|option2|...] in the input string
     # basic prompt editing:
@@ -0,0 +1,102 @@
+import re
+import threading
+from collections import OrderedDict
+
+CLIP_TOKENIZER = "openai/clip-vit-large-patch14"
+
+# CLIP reads a prompt 77 tokens at a time, 75 of them the prompt's own
+CHUNK_SIZE = 75
+
+# Words longer than this many tokens are split over two chunks, others move
+# to the next chunk whole, as the text encoder does it.
+LONG_WORD = 8
+
+# Token counts by word
+CACHE_SIZE = 8192
+
+# Emphasis, (word:1.2), isn't encoded as text
+WEIGHT_PATTERN = re.compile(r":-?\d*\.?\d+\)|[()]")
+
+
+class TokenCounter:
+    """The shared CLIP tokenizer, loaded on first use, and token counts.
+
+    CLIP never lets a token span whitespace, so prompts are counted word by
+    word and a changed prompt only tokenizes the words that are new.
+    """
+
+    def __init__(self, name=CLIP_TOKENIZER):
+        self.name = name
+        self.lock = threading.Lock()
+        self._tokenizer = None
+        self._loaded = False
+        self._words = OrderedDict()
+
+    @property
+    def tokenizer(self):
+        """The CLIPTokenizer, None if it can't be loaded."""
+        if not self._loaded:
+            with self.lock:
+                if not self._loaded:
+                    self._tokenizer = self._load()
+                    self._loaded = True
+        return self._tokenizer
+
+    def _load(self):
+        try:
+            from transformers import CLIPTokenizer
+        except ImportError:
+            print("No CLIP tokenizer, transformers is not installed.")
+            return None
+        # The local Hugging Face cache first, only download when it isn't there
+        try:
+            return CLIPTokenizer.from_pretrained(self.name, local_files_only=True)
+        except OSError:
+            pass
+        try:
+            return CLIPTokenizer.from_pretrained(self.name)
+        except Exception as e:
+            print(f"Could not load the {self.name} tokenizer: {e}")
+            return None
+
+    def word_tokens(self, word):
+        key = WEIGHT_PATTERN.sub("", word).lower()
+        with self.lock:
+            count = self._words.get(key)
+            if count is not None:
+                self._words.move_to_end(key)
+                return count
+        count = len(self.tokenizer.tokenize(key)) if key else 0
+        with self.lock:
+            self._words[key] = count
+            while len(self._words) > CACHE_SIZE:
+                self._words.popitem(last=False)
+        return count
+
+    def count(self, prompt):
+        """Tokens in a prompt and where its chunks start, None without a tokenizer.
+
+        Returns tokens, the number of chunks and boundaries, the offsets in
+        prompt of the words that start the second and later chunks.
+        """
+        if self.tokenizer is None:
+            return None
+        tokens = 0
+        used = 0
+        boundaries = []
+        for match in re.finditer(r"\S+", prompt):
+            n = self.word_tokens(match.group())
+            tokens += n
+            while used + n > CHUNK_SIZE:
+                if n > LONG_WORD:
+                    n -= CHUNK_SIZE - used
+                boundaries.append(match.start())
+                used = 0
+            used += n
+        return {"tokens": tokens, "chunks": len(boundaries) + 1, "boundaries": boundaries}
+
+    def count_many(self, prompts):
+        return [self.count(prompt) for prompt in prompts]
+
+
+counter = TokenCounter()
@@ -525,25 +525,52 @@ class pipeline:
 
     conditions = None
 
-    def textencode(self, id, text, clip_skip):
-        update = False
+    def clean_text(self, text):
         # Don't encode <lora> and things like that
         for pat in [r"<lora:[^>]*>", r"<facerestore>"]:
             text = re.sub(pat, "", text)
-        text = text.strip(", ")
+        return text.strip(", ")
+
+    def encode_text(self, text, clip_skip):
+        if clip_skip > 1:
+            self.xl_base_patched.clip = CLIPSetLastLayer().set_last_layer(
+                self.xl_base_patched.clip, clip_skip * -1
+            )[0]
+        return CLIPTextEncode().encode(
+            clip=self.xl_base_patched.clip, text=text
+        )[0]
+
+    def textencode(self, id, text, clip_skip):
+        update = False
+        text = self.clean_text(text)
         hash = f"{text} {clip_skip}"
         if hash != self.conditions[id]["text"]:
-            if clip_skip > 1:
-                self.xl_base_patched.clip = CLIPSetLastLayer().set_last_layer(
-                    self.xl_base_patched.clip, clip_skip * -1
-                )[0]
-            self.conditions[id]["cache"] = CLIPTextEncode().encode(
-                clip=self.xl_base_patched.clip, text=text
-            )[0]
+            self.conditions[id]["cache"] = self.encode_text(text, clip_skip)
         self.conditions[id]["text"] = hash
         update = True
         return update
 
+    def switch_conditions(self, prompt, steps, clip_skip):
+        # Conditioning for a [prompt|switching] prompt, with a timestep range
+        # for every run of steps with the same prompt. Each distinct prompt
+        # is encoded once, and the encodings are kept for the next image.
+        cache = self.conditions["switch"]["cache"] or {}
+        encoded = {}
+        switched_prompt = []
+        perc_per_step = round(100 / steps, 2)
+        for text, first, last in pp.prompt_switch_timeline(prompt, steps):
+            text = self.clean_text(text)
+            hash = f"{text} {clip_skip}"
+            if hash not in encoded:
+                encoded[hash] = cache[hash] if hash in cache else self.encode_text(text, clip_skip)
+            start_perc = round((perc_per_step * first) / 100, 2)
+            end_perc = round((perc_per_step * (last + 1)) / 100, 2)
+            if end_perc >= 0.99:
+                end_perc = 1
+            switched_prompt += set_timestep_range(encoded[hash], start_perc, end_perc)
+        self.conditions["switch"]["cache"] = encoded
+        return switched_prompt
+
     @torch.inference_mode()
     def process(
         self,
@@ -645,20 +672,8 @@ class pipeline:
                     print("ControlNet and [prompt|switching] do not work well together.")
                     print("ControlNet will only be applied to the first prompt.")
 
-                prompt_per_step = pp.prompt_switch_per_step(positive_prompt, gen_data["steps"])
-                perc_per_step = round(100 / gen_data["steps"], 2)
-                for i in range(len(prompt_per_step)):
-                    if self.textencode("switch", prompt_per_step[i], clip_skip):
-                        updated_conditions = True
-                    positive_switch = self.conditions["switch"]["cache"]
-                    start_perc = round((perc_per_step * i) / 100, 2)
-                    end_perc = round((perc_per_step * (i + 1)) / 100, 2)
-                    if end_perc >= 0.99:
-                        end_perc = 1
-                    positive_switch = set_timestep_range(
-                        positive_switch, start_perc, end_perc
-                    )
-                    switched_prompt += positive_switch
+                switched_prompt = self.switch_conditions(positive_prompt, gen_data["steps"], clip_skip)
+                updated_conditions = True
 
 
         # Controlnet / img2img
@@ -1,5 +1,7 @@
 import random
 import csv
+import threading
+from collections import OrderedDict
 from os.path import exists
 from csv import DictReader
 from pathlib import Path
@@ -12,7 +14,37 @@ STYLES_FILE = Path("settings/styles.csv")
 prompt_expansion = PromptExpansion()
 
 
-def load_styles():
+# Styles that switch something on instead of wrapping the prompt, by their
+# upper case name.
+SPECIAL_STYLES = {
+    "FLUFFERIZER": "Flufferizer",
+    "STYLE: FLUFFERIZER": "Flufferizer",
+    "HYPERPROMPT": "Hyperprompt",
+    "STYLE: HYPERPROMPT": "Hyperprompt",
+    "LORA KEYWORDS": "LoRA keywords",
+    "STYLE: LORA KEYWORDS": "LoRA keywords",
+    "FACE RESTORE": "Face restore",
+    "STYLE: FACE RESTORE": "Face restore",
+}
+
+# Styled prompts, by (styles, prompt). Only the template part is kept,
+# random picks, Artify and the Flufferizer are done on every call.
+MEMO_SIZE = 1024
+
+
+class StyleTemplate:
+    """A style with its prompt split around the {prompt} slots."""
+
+    __slots__ = ("name", "prompt", "negative_prompt", "parts")
+
+    def __init__(self, name, prompt, negative_prompt):
+        self.name = name
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.parts = None if prompt is None else (prompt + ", ").split("{prompt}")
+
+
+def _read_styles():
     default_styles = []
     styles = []
 
@@ -40,10 +72,13 @@ def load_styles():
             for row in styles:
                 csv_writer.writerow(row)
 
-
-    with STYLES_FILE.open("r") as f:
-        reader = DictReader(f)
-        styles = list(reader)
+    # The rows as DictReader would give them
+    header, rows = styles[0], styles[1:]
+    styles = [
+        dict(zip(header, row + [None] * (len(header) - len(row))))
+        for row in rows
+        if row
+    ]
 
     default_style = {"name": "None", "prompt": "{prompt}", "negative_prompt": ""}
     random_style = {
@@ -82,61 +117,104 @@ def load_styles():
     return {s["name"]: (s["prompt"], s["negative_prompt"]) for s in styles}
 
 
-def apply_style(style, prompt, negative_prompt, lora_keywords):
+def _styles_mtime():
+    try:
+        return STYLES_FILE.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def refresh_styles():
+    """Load and compile the styles again if styles.csv changed."""
+    global loaded_mtime, templates
+    if templates and _styles_mtime() == loaded_mtime:
+        return
+    with _lock:
+        if templates and _styles_mtime() == loaded_mtime:
+            return
+        loaded = _read_styles()
+        # Changed in place, other modules hold on to these. Old names go
+        # last so a reader never sees the dict without "None".
+        styles.update(loaded)
+        for name in [x for x in styles if x not in loaded]:
+            del styles[name]
+        allstyles[:] = [x for x in loaded if x.startswith("Style") and x != "Style: Pick Random"]
+        # Only read here, swapped whole for the same reason
+        templates = {name: StyleTemplate(name, p, n) for name, (p, n) in loaded.items()}
+        _memo.clear()
+        loaded_mtime = _styles_mtime()
+
+
+def load_styles():
+    refresh_styles()
+    return dict(styles)
+
+
+def _apply_templates(style, prompt):
+    key = (tuple(style), prompt)
+    with _lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+
+    # The styles this call started with, even if they are reloaded meanwhile
+    current = templates
     output_prompt = ""
     output_negative_prompt = ""
     temp_style_prompt = prompt
+    for s in style:
+        template = current.get(s, current["None"])
+        if template.parts is not None:
+            temp_style_prompt = temp_style_prompt.join(template.parts)
+        else:
+            temp_style_prompt = output_prompt.replace("{prompt}", temp_style_prompt)
+        if template.negative_prompt is not None:
+            output_negative_prompt += template.negative_prompt + ", "
+        output_prompt = temp_style_prompt.replace(", ,", ", ")
+
+    with _lock:
+        if current is not templates:
+            return output_prompt, output_negative_prompt
+        _memo[key] = (output_prompt, output_negative_prompt)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return output_prompt, output_negative_prompt
+
+
+def _style_text(style, prompt):
+    """Style a prompt up to the Flufferizer.
+
+    Returns the styled prompt, which is also the text the Flufferizer
+    expands, its negative prompt and whether the Flufferizer is selected.
+    Takes the special styles out of the style list.
+    """
     bFlufferizer = False
     bHyperprompt = False
-    artifylist = []
-    artifystylelist = []
-    index = 0
 
-    if not style:
-        return prompt, negative_prompt
+    refresh_styles()
 
     while "Style: Pick Random" in style:
         style[style.index("Style: Pick Random")] = random.choice(allstyles)
 
     for s in style.copy():
-        _s = s.upper().strip()
-        if _s in map(str.upper, ["Flufferizer", "Style: Flufferizer"]):
+        special = SPECIAL_STYLES.get(s.upper().strip())
+        if special == "Flufferizer":
             bFlufferizer = True
             del style[style.index(s)]
-
-        if _s in map(str.upper, ["Hyperprompt", "Style: Hyperprompt"]):
+        elif special == "Hyperprompt":
             bHyperprompt = True
             del style[style.index(s)]
-
-        if _s in map(str.upper, ["LoRA keywords", "Style: LoRA keywords"]):
-            style[style.index(s)] = "LoRA keywords" # Make sure it has the correct name
-
-        if _s in map(str.upper, ["Face restore", "Style: Face restore"]):
-            style[style.index(s)] = "Face restore"
+        elif special is not None:
+            style[style.index(s)] = special  # Make sure it has the correct name
 
     if bHyperprompt:
         prompt = build_dynamic_prompt.one_button_superprompt(prompt=prompt)
-        temp_style_prompt = prompt
         print("Hypered prompt: " + prompt)
 
-    while index < len(style):
-        if style[index].startswith("Artify"):
-            artifylist.append(style[index].replace("Artify: ", ""))
-            artifystylelist.append(style[index])
-        index += 1
-
-    style = [x for x in style if x not in artifystylelist]
-
-    for s in style:
-        p, n = styles.get(s, default_style)
-        if p is not None:
-            output_prompt = p + ", "
-        if n is not None:
-            output_negative_prompt += n + ", "
-
-        temp_style_prompt = output_prompt.replace("{prompt}", temp_style_prompt)
-        output_prompt = temp_style_prompt.replace(", ,", ", ")
+    artifylist = [s.replace("Artify: ", "") for s in style if s.startswith("Artify")]
+    style = [x for x in style if not x.startswith("Artify")]
 
+    output_prompt, output_negative_prompt = _apply_templates(style, prompt)
 
     # prep outputprompt for use in Flufferize and Artify
     if output_prompt == "":
@@ -145,6 +223,15 @@ def apply_style(style, prompt, negative_prompt, lora_keywords):
     for artist in artifylist:
         output_prompt = build_dynamic_prompt.artify_prompt(prompt=output_prompt, artists=artist)
 
+    return output_prompt, output_negative_prompt, bFlufferizer
+
+
+def apply_style(style, prompt, negative_prompt, lora_keywords):
+    if not style:
+        return prompt, negative_prompt
+
+    output_prompt, output_negative_prompt, bFlufferizer = _style_text(style, prompt)
+
     if bFlufferizer:
         output_prompt = prompt_expansion.expand_prompt(output_prompt)
 
@@ -155,7 +242,33 @@ def apply_style(style, prompt, negative_prompt, lora_keywords):
     return output_prompt, output_negative_prompt
 
 
-styles = load_styles()
+def apply_styles(style, prompts, negative_prompt, lora_keywords):
+    """apply_style for a list of prompts, a random style is picked for each."""
+    return [apply_style(list(style), prompt, negative_prompt, lora_keywords) for prompt in prompts]
+
+
+def flufferizer_input(style, prompt):
+    # Returns the text the Flufferizer would expand for this style selection,
+    # or None if it isn't selected or the styled prompt isn't deterministic.
+    # LoRA keywords go in after the expansion, they don't change the text.
+    names = [s.upper().strip() for s in style or []]
+    if not any(SPECIAL_STYLES.get(n) == "Flufferizer" for n in names):
+        return None
+    for n in names:
+        if n in ["HYPERPROMPT", "STYLE: HYPERPROMPT", "STYLE: PICK RANDOM"]:
+            return None
+        if n.startswith("ARTIFY"):
+            return None
+
+    output_prompt, _, _ = _style_text(list(style), prompt)
+    return output_prompt
+
+
+styles = {}
+allstyles = []
+templates = {}
+loaded_mtime = None
+_memo = OrderedDict()
+_lock = threading.RLock()
+refresh_styles()
 default_style = styles["None"]
-allstyles = [x for x in load_styles() if x.startswith("Style")]
-allstyles.remove("Style: Pick Random")
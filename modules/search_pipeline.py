@@ -1,13 +1,14 @@
 import modules.async_worker as worker
 
 import shared
-import glob
+import os
 from pathlib import Path
 import datetime
 import re
 import json
 
-from PIL import Image
+from modules.png_text import read_png_text
+from modules.util import TimeIt
 
 # Copy this file, add suitable code and add logic to modules/pipelines.py to select it
 
@@ -23,13 +24,10 @@ def search_for_words(searchfor, prompt):
             break
     return result
 
-def search(search_string, maxresults=10, callback=None):
-    images = []
+def parse_search(search_string, maxresults=10):
+    """Split off the options, returns (daystr, skip, maxresults, searchfor)."""
     skip = 0
-
-    folder=shared.path_manager.model_paths["temp_outputs_path"]
-    current_time = datetime.datetime.now()
-    daystr = current_time.strftime("%Y-%m-%d")
+    daystr = datetime.datetime.now().strftime("%Y-%m-%d")
 
     # Parse search arguments
     searchfor = re.sub(r"search: *", "", search_string, count=1, flags=re.IGNORECASE)
@@ -78,34 +76,121 @@ def search(search_string, maxresults=10, callback=None):
             searchfor = re.sub(matchstr, "", searchfor)
             chomp = True
 
-    searchfor = searchfor.strip()
-
-    # For all folder/daystr/*.(png|gif) ... match metadata
-    globs = ["*.png", "*.gif"]
-    pngs = set()
-    for g in globs:
-        for f in glob.glob(str(Path(folder) / daystr / g)):
-            pngs.add(f)
-    pngs = sorted(pngs)
-
-    found = 0
-    for file in pngs:
-        im = Image.open(file)
-        metadata = {"prompt": ""}
-        if im.info.get("parameters"):
-            metadata = json.loads(im.info["parameters"])
-
-            # Show image if metadata is missing. (like for gifs)
-        if searchfor == "" or "Prompt" not in metadata or search_for_words(searchfor, metadata["Prompt"]):
-            # Return finished image to preview
-            if callback is not None and found > skip:
-                callback(found - skip, 0, 0, maxresults, None) # Returning im here is a bit much...
-            images.append(file)
-            found += 1
-        if found >= (maxresults + skip):
+    return daystr, skip, maxresults, searchfor.strip()
+
+
+def day_folders(folder, daystr):
+    if daystr == "*":
+        try:
+            return sorted(entry.path for entry in os.scandir(folder) if entry.is_dir())
+        except OSError:
+            return []
+    return [str(Path(folder) / daystr)]
+
+
+def image_files(day):
+    try:
+        return sorted(
+            entry.path for entry in os.scandir(day)
+            if entry.name.lower().endswith((".png", ".gif"))
+        )
+    except OSError:
+        return []
+
+
+def _prefix(day):
+    # fullpath range covering everything in the folder, uses the unique index
+    low = day.rstrip(os.sep) + os.sep
+    return low, low[:-1] + chr(ord(os.sep) + 1)
+
+
+def matches(searchfor, prompt):
+    # Show image if metadata is missing. (like for gifs)
+    return searchfor == "" or not prompt or search_for_words(searchfor, prompt)
+
+
+def search_index(db, day, searchfor, limit, offset=0):
+    # The prompts come from the index, matched the same way as in files
+    low, high = _prefix(day)
+    found = []
+    with db.reader() as conn:
+        cur = conn.execute(
+            "SELECT fullpath, prompt FROM images WHERE fullpath >= ? AND fullpath < ? ORDER BY fullpath",
+            (low, high),
+        )
+        try:
+            for fullpath, prompt in cur:
+                if matches(searchfor, prompt):
+                    found.append(fullpath)
+                    if len(found) >= limit + offset:
+                        break
+        finally:
+            cur.close()
+    return found[offset:]
+
+
+def search_files(files, searchfor, limit, offset=0):
+    found = []
+    for file in files:
+        metadata = {}
+        parameters = read_png_text(file).get("parameters")
+        if parameters:
+            try:
+                metadata = json.loads(parameters)
+            except ValueError:
+                pass
+        if not isinstance(metadata, dict):
+            metadata = {}
+
+        if matches(searchfor, str(metadata.get("Prompt", "") or "")):
+            found.append(file)
+        if len(found) >= limit + offset:
             break
+    return found[offset:]
+
 
-    return images[skip:]
+def is_synced(db, day, files):
+    low, high = _prefix(day)
+    indexed = db.read_one(
+        "SELECT count(*) FROM images WHERE fullpath >= ? AND fullpath < ?",
+        (low, high),
+    )[0]
+    return indexed >= len(files)
+
+
+def search(search_string, maxresults=10, callback=None):
+    daystr, skip, maxresults, searchfor = parse_search(search_string, maxresults)
+    folder = shared.path_manager.model_paths["temp_outputs_path"]
+    browser = shared.shared_cache.get("browser")
+    db = browser.db if browser is not None else None
+
+    # Days the browser index is in step with are searched there, the rest
+    # (folders it hasn't synced yet) the old way, by reading every file.
+    images = []
+    with TimeIt("Search"):
+        days = [(day, image_files(day)) for day in day_folders(folder, daystr)]
+        synced = [db is not None and is_synced(db, day, files) for day, files in days]
+        if days and all(synced):
+            if daystr == "*":
+                images = search_index(db, str(folder), searchfor, maxresults, skip)
+            else:
+                images = search_index(db, days[0][0], searchfor, maxresults, skip)
+        else:
+            for (day, files), indexed in zip(days, synced):
+                need = maxresults + skip - len(images)
+                if need <= 0:
+                    break
+                if indexed:
+                    images += search_index(db, day, searchfor, need)
+                else:
+                    images += search_files(files, searchfor, need)
+            images = images[skip:]
+
+    if callback is not None:
+        for i, _ in enumerate(images):
+            callback(i + 1, 0, 0, maxresults, None) # Returning im here is a bit much...
+
+    return images
 
 
 class pipeline:
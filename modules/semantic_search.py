@@ -0,0 +1,397 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from shared import settings
+from modules.util import TimeIt
+
+# CLIP embeddings of the browser images, for searching by text or by example.
+#
+# cache/clip_index/
+#   vectors.f16   float16 rows, one normalised embedding per image
+#   ids.i64       the images.id of each row, written after its vector
+#   meta.json     model name and embedding size
+#   ivf.npz       coarse centroids, PQ codebooks and inverted lists
+#   codes.u8.npy  PQ codes of the rows the IVF index was trained with
+#
+# Rows are only ever appended, so an interrupted indexer picks up where it
+# stopped. Rows of images that left the DB are dropped when they make up
+# too much of the index.
+
+INDEX_PATH = Path("cache/clip_index")
+BATCH = 16
+SEARCH_CHUNK = 65536
+PQ_SUBVECTOR = 16  # Dimensions per product quantiser part
+TRAIN_SAMPLE = 65536
+STALE_FRACTION = 0.25
+
+# Seconds without use before the CLIP model is dropped from memory
+IDLE_TIMEOUT = 300
+
+
+def kmeans(x, k, iters=10, seed=0):
+    """Plain Lloyd k-means, returns the (k, d) centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        labels = assign(x, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        used = np.nonzero(counts)[0]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[used]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[used] = sums / counts[used, None]
+    return centroids.astype(np.float32)
+
+
+def assign(x, centroids, chunk=8192):
+    """Index of the nearest centroid for every row of x."""
+    c2 = (centroids * centroids).sum(axis=1)
+    labels = np.empty(len(x), dtype=np.int32)
+    for i in range(0, len(x), chunk):
+        part = x[i:i + chunk].astype(np.float32)
+        labels[i:i + chunk] = np.argmin(c2[None, :] - 2 * part @ centroids.T, axis=1)
+    return labels
+
+
+def top_k(scores, k):
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class VectorIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.dim = None
+        self.model = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.vectors = None
+        self.ivf = None
+        self.codes = None
+        self.load()
+
+    def _file(self, name):
+        return self.path / name
+
+    def load(self):
+        with self.lock:
+            meta = self._file("meta.json")
+            if not meta.exists():
+                return
+            try:
+                info = json.loads(meta.read_text())
+                dim, model = int(info["dim"]), info["model"]
+                ids_size = os.path.getsize(self._file("ids.i64"))
+                vectors_size = os.path.getsize(self._file("vectors.f16"))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Left by an interrupted build. An empty index without a
+                # model, so the next index run starts it over.
+                print(f"Semantic index is incomplete and will be rebuilt: {e}")
+                self.dim = self.model = None
+                self.ids = np.zeros(0, dtype=np.int64)
+                self.vectors = self.ivf = self.codes = None
+                return
+            self.dim, self.model = dim, model
+
+            # ids are written last, anything past them is a half written batch
+            n = min(ids_size // 8, vectors_size // (2 * self.dim))
+            if n:
+                self.ids = np.array(np.memmap(self._file("ids.i64"), dtype=np.int64, mode="r", shape=(n,)))
+                self.vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r", shape=(n, self.dim))
+            else:
+                self.ids = np.zeros(0, dtype=np.int64)
+                self.vectors = None
+
+            self.ivf = None
+            if self._file("ivf.npz").exists():
+                try:
+                    ivf = dict(np.load(self._file("ivf.npz")))
+                    if int(ivf["trained"]) <= n:
+                        self.codes = np.load(self._file("codes.u8.npy"), mmap_mode="r")
+                        self.ivf = ivf
+                except (OSError, ValueError, KeyError) as e:
+                    # Searched without it until the next training
+                    print(f"Could not load the semantic IVF index: {e}")
+
+    def reset(self, dim, model):
+        with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            for name in ("vectors.f16", "ids.i64", "ivf.npz", "codes.u8.npy"):
+                self._file(name).unlink(missing_ok=True)
+            self._file("vectors.f16").touch()
+            self._file("ids.i64").touch()
+            self._file("meta.json").write_text(json.dumps({"dim": dim, "model": model}))
+            self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float16)
+        with self.lock:
+            n = len(self.ids)
+            # Cut off anything a crash left behind before adding to the end
+            with open(self._file("vectors.f16"), "r+b") as f:
+                f.truncate(n * 2 * self.dim)
+                f.seek(0, 2)
+                f.write(vectors.tobytes())
+            with open(self._file("ids.i64"), "r+b") as f:
+                f.truncate(n * 8)
+                f.seek(0, 2)
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self.load()
+
+    def keep(self, live_ids):
+        """Rewrite the index with only the rows whose id is in live_ids."""
+        with self.lock:
+            if self.vectors is None:
+                return
+            mask = np.isin(self.ids, np.fromiter(live_ids, dtype=np.int64))
+            ids, vectors = self.ids[mask], np.array(self.vectors[mask])
+            self.reset(self.dim, self.model)
+            if len(ids):
+                self.append(ids, vectors)
+
+    def needs_training(self, threshold):
+        n = len(self.ids)
+        if n < threshold:
+            return False
+        return self.ivf is None or n > 2 * int(self.ivf["trained"])
+
+    def train(self):
+        """Build the IVF-PQ index over the current rows."""
+        with self.lock:
+            vectors, n = self.vectors, len(self.ids)
+        rng = np.random.default_rng(0)
+        sample = vectors[np.sort(rng.choice(n, min(n, TRAIN_SAMPLE), replace=False))].astype(np.float32)
+
+        nlist = int(np.clip(4 * np.sqrt(n), 16, 4096))
+        centroids = kmeans(sample[:64 * nlist], nlist)
+        residuals = sample - centroids[assign(sample, centroids)]
+        m = self.dim // PQ_SUBVECTOR
+        codebooks = np.stack([
+            kmeans(residuals[:, j * PQ_SUBVECTOR:(j + 1) * PQ_SUBVECTOR], 256, seed=j)
+            for j in range(m)
+        ])
+
+        # Encode every row, in chunks to keep memory flat
+        lists = np.empty(n, dtype=np.int32)
+        codes = np.lib.format.open_memmap(self._file("codes.u8.npy.tmp"), mode="w+", dtype=np.uint8, shape=(n, m))
+        for i in range(0, n, SEARCH_CHUNK):
+            part = vectors[i:i + SEARCH_CHUNK].astype(np.float32)
+            lists[i:i + len(part)] = assign(part, centroids)
+            res = part - centroids[lists[i:i + len(part)]]
+            for j in range(m):
+                codes[i:i + len(part), j] = assign(res[:, j * PQ_SUBVECTOR:(j + 1) * PQ_SUBVECTOR], codebooks[j])
+        codes.flush()
+        del codes
+
+        order = np.argsort(lists, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(lists[order], np.arange(len(centroids) + 1))
+        with self.lock:
+            os.replace(self._file("codes.u8.npy.tmp"), self._file("codes.u8.npy"))
+            np.savez(
+                self._file("ivf.npz"),
+                trained=n,
+                centroids=centroids,
+                codebooks=codebooks,
+                order=order,
+                offsets=offsets,
+            )
+            self.load()
+
+    def search(self, query, k=50, nprobe=16):
+        """[(id, score)] of the k rows most like the normalised query."""
+        query = np.asarray(query, dtype=np.float32)
+        with self.lock:
+            ids, vectors, ivf, codes = self.ids, self.vectors, self.ivf, self.codes
+        if vectors is None:
+            return []
+
+        if ivf is None:
+            scores = np.concatenate([
+                vectors[i:i + SEARCH_CHUNK].astype(np.float32) @ query
+                for i in range(0, len(ids), SEARCH_CHUNK)
+            ])
+            best = top_k(scores, k)
+            return [(int(ids[i]), float(scores[i])) for i in best]
+
+        # Approximate scores for rows in the closest lists, then exact scores
+        # for the best of those plus every row added since training.
+        trained = int(ivf["trained"])
+        coarse = ivf["centroids"] @ query
+        probe = top_k(coarse, nprobe)
+        rows = np.concatenate([
+            ivf["order"][ivf["offsets"][p]:ivf["offsets"][p + 1]] for p in probe
+        ])
+        candidates = np.arange(trained, len(ids))
+        if len(rows):
+            m = ivf["codebooks"].shape[0]
+            table = np.einsum(
+                "jcd,jd->jc",
+                ivf["codebooks"],
+                query[:m * PQ_SUBVECTOR].reshape(m, PQ_SUBVECTOR),
+            )
+            lists = np.repeat(probe, np.diff(ivf["offsets"])[probe])
+            approx = coarse[lists] + table[np.arange(m), codes[rows]].sum(axis=1)
+            rows = rows[top_k(approx, max(10 * k, 256))]
+            candidates = np.concatenate([np.sort(rows), candidates])
+
+        scores = vectors[candidates].astype(np.float32) @ query
+        best = top_k(scores, k)
+        return [(int(ids[candidates[i]]), float(scores[i])) for i in best]
+
+
+class ClipEncoder:
+    """The interrogator's CLIP model, on the CPU, for embeddings."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.model = None
+        self.timer = None
+
+    def load(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(IDLE_TIMEOUT, self.release)
+            self.timer.daemon = True
+            self.timer.start()
+            if self.model is not None:
+                return
+
+            import open_clip
+            from modules.interrogate import CLIP_MODEL
+
+            name, pretrained = CLIP_MODEL.split("/", 1)
+            with TimeIt("Load CLIP"):
+                model, _, preprocess = open_clip.create_model_and_transforms(
+                    name, pretrained=pretrained, device="cpu", jit=False
+                )
+            model.eval()
+            self.model = model
+            self.preprocess = preprocess
+            self.tokenizer = open_clip.get_tokenizer(name)
+            self.name = CLIP_MODEL
+
+    def release(self):
+        with self.lock:
+            self.model = None
+
+    def _normalise(self, features):
+        features = features.float().numpy()
+        return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+    def images(self, images):
+        import torch
+
+        with self.lock:
+            self.load()
+            batch = torch.stack([self.preprocess(im.convert("RGB")) for im in images])
+            with torch.inference_mode():
+                return self._normalise(self.model.encode_image(batch))
+
+    def text(self, text):
+        import torch
+
+        with self.lock:
+            self.load()
+            with torch.inference_mode():
+                return self._normalise(self.model.encode_text(self.tokenizer([text])))[0]
+
+
+class SemanticSearch:
+    def __init__(self, path=INDEX_PATH):
+        self.index = VectorIndex(path)
+        self.encoder = ClipEncoder()
+        self.thread = None
+        self.stop = threading.Event()
+        self.progress = {"running": False, "done": 0, "total": 0, "error": None}
+
+    def status(self):
+        return dict(self.progress, indexed=len(self.index))
+
+    def start(self, db):
+        """Embed the images in the browser DB that aren't indexed yet."""
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        self.stop.clear()
+        self.thread = threading.Thread(target=self._run, args=(db,), name="clip-indexer", daemon=True)
+        self.thread.start()
+        return True
+
+    def _run(self, db):
+        self.progress.update(running=True, done=0, total=0, error=None)
+        try:
+            self.encoder.load()
+            if self.index.model != self.encoder.name:
+                dim = int(self.encoder.text("").shape[-1])
+                self.index.reset(dim, self.encoder.name)
+
+            rows = db.read("SELECT id, fullpath FROM images")
+            live = {image_id for image_id, _ in rows}
+            indexed = set(self.index.ids.tolist())
+            if indexed and len(indexed - live) > STALE_FRACTION * len(indexed):
+                self.index.keep(live)
+                indexed = set(self.index.ids.tolist())
+
+            todo = [row for row in rows if row[0] not in indexed]
+            self.progress["total"] = len(todo)
+            with TimeIt("CLIP index"):
+                for i in range(0, len(todo), BATCH):
+                    if self.stop.is_set():
+                        break
+                    ids, images = [], []
+                    for image_id, fullpath in todo[i:i + BATCH]:
+                        try:
+                            with Image.open(fullpath) as im:
+                                im.draft("RGB", (448, 448))
+                                images.append(im.convert("RGB"))
+                            ids.append(image_id)
+                        except Exception:
+                            pass
+                    if images:
+                        self.index.append(ids, self.encoder.images(images))
+                    self.progress["done"] = min(i + BATCH, len(todo))
+
+            threshold = int(settings.default_settings.get("semantic_ivf_threshold", 100000) or 100000)
+            if not self.stop.is_set() and self.index.needs_training(threshold):
+                with TimeIt("Train IVF-PQ"):
+                    self.index.train()
+        except Exception as e:
+            print(f"Semantic indexer failed: {e}")
+            self.progress["error"] = str(e)
+        finally:
+            self.progress["running"] = False
+
+    def search(self, text=None, image=None, image_id=None, k=50):
+        """[(id, score)] for a text, a PIL image or an indexed image id."""
+        rows = np.nonzero(self.index.ids == image_id)[0] if image_id is not None else []
+        if len(rows):
+            query = self.index.vectors[rows[0]].astype(np.float32)
+        elif image is not None:
+            query = self.encoder.images([image])[0]
+        else:
+            query = self.encoder.text(text or "")
+        nprobe = int(settings.default_settings.get("semantic_nprobe", 16) or 16)
+        return self.index.search(query, k, nprobe)
+
+
+_search = None
+_search_lock = threading.Lock()
+
+
+def get_search() -> SemanticSearch:
+    global _search
+    with _search_lock:
+        if _search is None:
+            _search = SemanticSearch()
+        return _search
@@ -0,0 +1,158 @@
+import concurrent.futures
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+THUMB_PATH = Path("cache/thumbs")
+
+# Thumbnails are made in a few fixed sizes so the cache gets reused
+SIZES = [128, 256, 512]
+DEFAULT_SIZE = 256
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG"}
+QUALITY = 80
+
+# Size of the cache. Past it the least recently read thumbnails are removed,
+# checked every EVICT_EVERY new thumbnails.
+MAX_CACHE_BYTES = 1024**3
+EVICT_EVERY = 256
+
+# PIL lets go of the GIL while decoding, resizing and encoding, so threads
+# keep the cores busy without forking the whole app.
+_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, (os.cpu_count() or 2) // 2),
+    thread_name_prefix="thumbnails",
+)
+_pending = {}
+_lock = threading.Lock()
+_made = 0
+
+
+def bucket(size) -> int:
+    """Smallest thumbnail size that is at least as large as asked for."""
+    for s in SIZES:
+        if size <= s:
+            return s
+    return SIZES[-1]
+
+
+def thumb_key(path, size, fmt, stat=None) -> str:
+    """Cache key for a thumbnail, changes whenever the source file does.
+
+    Keyed by path, size and mtime rather than by content: hashing the image
+    would mean reading all of it for every thumbnail request, and an image
+    is only ever rewritten with a new mtime. Thumbnails of files that are
+    moved or deleted are removed by forget(), and evict() keeps the cache
+    within MAX_CACHE_BYTES.
+    """
+    st = stat or os.stat(path)
+    ident = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\0{size}\0{fmt}"
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+
+def thumb_path(key, fmt) -> Path:
+    ext = "jpg" if FORMATS[fmt] == "JPEG" else "webp"
+    return THUMB_PATH / key[:2] / f"{key}.{ext}"
+
+
+def make_thumbnail(path, dest, size, fmt):
+    with Image.open(path) as im:
+        im.draft("RGB", (size, size))  # Only does something for JPEG sources
+        im.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if FORMATS[fmt] == "JPEG" or im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGB" if FORMATS[fmt] == "JPEG" else "RGBA")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_suffix(dest.suffix + f".{threading.get_ident()}.tmp")
+        im.save(tmp, FORMATS[fmt], quality=QUALITY)
+    os.replace(tmp, dest)
+    return dest
+
+
+def _make_and_count(path, dest, size, fmt):
+    global _made
+    result = make_thumbnail(path, dest, size, fmt)
+    with _lock:
+        _made += 1
+        check = _made % EVICT_EVERY == 0
+    if check:
+        evict()
+    return result
+
+
+def forget(path, stat=None):
+    """Remove the cached thumbnails of an image that is deleted or moved away.
+
+    Pass the stat of the file from before it went, the keys depend on it.
+    """
+    try:
+        st = stat or os.stat(path)
+    except OSError:
+        return
+    for size in SIZES:
+        for fmt in FORMATS:
+            try:
+                thumb_path(thumb_key(path, size, fmt, st), fmt).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def evict(limit=MAX_CACHE_BYTES):
+    """Remove the least recently read thumbnails until the cache fits in limit."""
+    files = []
+    total = 0
+    for folder in THUMB_PATH.glob("*"):
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_atime, st.st_size, entry.path))
+            total += st.st_size
+    if total <= limit:
+        return
+    # Down to 90%, so the next few thumbnails don't start it again
+    files.sort()
+    for _, size, path in files:
+        if total <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def thumbnail(path, size=DEFAULT_SIZE, fmt="webp", key=None) -> concurrent.futures.Future:
+    """Future with the path of the cached thumbnail, made on the pool if needed.
+
+    Requests for a thumbnail that is already being made share its future.
+    """
+    size = bucket(size)
+    key = key or thumb_key(path, size, fmt)
+    dest = thumb_path(key, fmt)
+    if dest.exists():
+        future = concurrent.futures.Future()
+        future.set_result(dest)
+        return future
+
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pool.submit(_make_and_count, path, dest, size, fmt)
+            _pending[key] = future
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+    return future
+
+
+def pregenerate(path):
+    """Start making the default thumbnail of a newly saved image."""
+    try:
+        thumbnail(path)
+    except OSError:
+        pass
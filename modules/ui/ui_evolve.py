@@ -1,56 +1,8 @@
 import gradio as gr
-from shared import tokenizer
-import random
-import re
-from random_prompt.build_dynamic_prompt import createpromptvariant
+from modules.evolve import engine
 
 
 def add_evolve_tab(prompt, image_number, run_event):
-    def tokenize_and_randomize(prompt, strength):
-        all_tokens = list(tokenizer.get_vocab().keys())
-        tokens = tokenizer.tokenize(prompt)
-        res = []
-        for token in tokens:
-            if random.random() < float(strength / 100.0):
-                res += [
-                    all_tokens[random.randint(0, len(all_tokens) - 3)]
-                ]  # Skip <|startoftext> & <|endoftext|>
-            else:
-                res += [token]
-        return tokenizer.convert_tokens_to_string(res).strip()
-
-    def randomize_words(prompt, strength):
-        with open("wildcards_official/words.txt", "r", encoding="utf-8") as f:
-            word_list = f.read().lower().splitlines()
-        words = re.split(r"\b", prompt)
-        res = []
-        for word in words:
-            if (
-                not word.isdigit()
-                and word.lower() in word_list
-                and random.random() < float(strength / 100.0)
-            ):
-                res += [word_list[random.randint(0, len(word_list) - 1)]]
-            else:
-                res += [word]
-        return "".join(res).strip()
-
-    def four_evolved_prompts(prompt, mode, strength):
-        res = []
-        for i in range(4):
-            match mode:
-                case "Words":
-                    res.append(randomize_words(prompt, strength))
-                case "OBP Variant":
-                    res.append(
-                        createpromptvariant(
-                            prompt, max(int(strength / 10), 3), advancedprompting=False
-                        )
-                    )
-                case _:  # Use "Tokens" as default
-                    res.append(tokenize_and_randomize(prompt, strength))
-        return res
-
     def evolve(
         button,
         mode,
@@ -67,12 +19,12 @@ def add_evolve_tab(prompt, image_number, run_event):
                 gr.update(),
                 run_event,
             )
+        elif not engine.available(mode):
+            gr.Info("The CLIP tokenizer is not available")
+            result = (gr.update(), gr.update(), run_event)
         else:
-            res = (
-                four_evolved_prompts(in_txt, mode, strength)
-                + [in_txt]
-                + four_evolved_prompts(in_txt, mode, strength)
-            )
+            res = engine.variants(in_txt, mode, strength, 8)
+            res = res[:4] + [in_txt] + res[4:]
             result = (
                 gr.update(value="\n---\n".join(res)),
                 gr.update(value=1),
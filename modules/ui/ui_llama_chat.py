@@ -195,10 +195,18 @@ def create_chat():
 
             # Wait for result
             finished = False
+            streamed = None
             while not finished:
                 flag, product = worker.task_result(task_id)
                 if flag == "preview":
+                    streamed = product
                     yield product
+                elif flag == "delta" and streamed is not None:
+                    seq, text = product
+                    if seq == 1:
+                        streamed[-1] = {"role": "assistant", "content": ""}
+                    streamed[-1]["content"] += text
+                    yield streamed
                 elif flag == "results":
                     finished = True
 
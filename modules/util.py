@@ -7,18 +7,12 @@ from contextlib import contextmanager
 from typing import Optional
 from urllib.parse import urlparse
 from shared import path_manager, shared_cache
+from modules import wildcards
 import json
 
 
 def get_wildcard_files():
-    directories = ["wildcards", "wildcards_official"]
-    files = []
-
-    for directory in directories:
-        for file in Path(directory).rglob("*.txt"):
-            name = file.stem
-            if name not in files:
-                files.append(name)
+    files = wildcards.registry.names()
 
     onebutton = [
         "onebuttonprompt",
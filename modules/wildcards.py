@@ -0,0 +1,138 @@
+import os
+import random
+import re
+import threading
+
+# __name__ wildcards, and the __onebutton...:subject text__ form that may
+# contain spaces.
+WILDCARD_PATTERN = re.compile(
+    r"__([\w\-:]+|[\w]+:[^\s_]+(?:[^\s_]+|\s(?=[\w:]+))*)__"
+)
+
+# How deep wildcards that pick other wildcards get resolved
+MAX_DEPTH = 10
+
+
+def wildcard_directories(directory="wildcards"):
+    directories = []
+    user_data = os.environ.get("RF_USER_DATA")
+    if user_data:
+        directories.append(os.path.join(user_data, directory))
+    directories.append(directory)
+    directories.append("wildcards_official")
+    return directories
+
+
+def parse_wildcard_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [
+            word.strip()
+            for word in f.read().splitlines()
+            if not word.startswith("#")
+        ]
+
+
+class WildcardRegistry:
+    """Every wildcard txt file by name, with its lines.
+
+    A folder is only listed again when its mtime changes, which it does when
+    files are added, removed or renamed in it, and a file is only read again
+    when it changed itself.
+    """
+
+    def __init__(self, directory="wildcards"):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.folders = {}  # path -> (mtime, txt files, subfolders)
+        self.files = {}  # path -> ((mtime, size), lines)
+        self.index = {}
+        self.signature = None
+
+    def _scan(self, folder, order):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return
+        order.append(folder)
+        cached = self.folders.get(folder)
+        if cached is None or cached[0] != mtime:
+            txt, subfolders = [], []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subfolders.append(entry.path)
+                    elif entry.name.endswith(".txt"):
+                        txt.append(entry.name)
+            cached = (mtime, sorted(txt), sorted(subfolders))
+            self.folders[folder] = cached
+        for subfolder in cached[2]:
+            self._scan(subfolder, order)
+
+    def refresh(self):
+        """Pick up added and removed files, returns the name -> path index."""
+        with self.lock:
+            order = []
+            for root in wildcard_directories(self.directory):
+                self._scan(root, order)
+            for folder in self.folders.keys() - set(order):
+                del self.folders[folder]
+
+            signature = tuple((folder, self.folders[folder][0]) for folder in order)
+            if signature != self.signature:
+                # The first file with a name wins, the user's own come first
+                index = {}
+                for folder in order:
+                    for name in self.folders[folder][1]:
+                        index.setdefault(name[:-4], os.path.join(folder, name))
+                self.index = index
+                self.signature = signature
+            return self.index
+
+    def names(self):
+        return list(self.refresh())
+
+    def lines(self, name, index=None):
+        """The choices in a wildcard file, None if there is no such wildcard."""
+        path = (index or self.refresh()).get(name)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is None or cached[0] != key:
+                cached = (key, parse_wildcard_file(path))
+                self.files[path] = cached
+        return cached[1]
+
+    def resolve(self, text, special=None, depth=0, index=None):
+        """Replace every wildcard in text with a random line of its file.
+
+        Lines that have wildcards themselves are resolved before they go in,
+        so the text is only scanned once. special(name) handles the names
+        starting with "onebutton".
+        """
+        if depth >= MAX_DEPTH:
+            print(f"WARNING: Wildcards nested more than {MAX_DEPTH} deep, leaving them as is.")
+            return text
+        index = index or self.refresh()
+
+        def replace(match):
+            name = match.group(1)
+            if name.startswith("onebutton") and special is not None:
+                return special(name)
+            choices = self.lines(name, index)
+            if choices is None:
+                print(f"Error: Could not find file {name}.txt in {self.directory} or its subdirectories.")
+                return name
+            if not choices:
+                return ""
+            return self.resolve(random.choice(choices), special, depth + 1, index)
+
+        return WILDCARD_PATTERN.sub(replace, text)
+
+
+registry = WildcardRegistry()
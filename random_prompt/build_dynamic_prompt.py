@@ -1,13 +1,12 @@
-import random
 import re
 from random_prompt.csv_reader import (
     load_config_csv,
     csv_to_list,
     artist_category_csv_to_list,
     artist_category_by_category_csv_to_list,
-    load_negative_list,
-    load_all_artist_and_category,
     artist_descriptions_csv_to_list,
+    artist_tag_pairs,
+    negative_lexicon,
 )
 from random_prompt.random_functions import (
     common_dist,
@@ -22,8 +21,11 @@ from random_prompt.random_functions import (
 )
 
 from superprompter.superprompter import *
+# After the star import, superprompter brings in the random module too
+from random_prompt.rng import rng as random, seeded, prompt_seeds
 
 from random_prompt.one_button_presets import OneButtonPresets
+from random_prompt.sampler import draw
 OBPresets = OneButtonPresets()
 
 from modules.llama_pipeline import run_llama, llama_names
@@ -510,12 +512,12 @@ def build_dynamic_prompt(insanitylevel = 5, forcesubject = "all", artists = "all
     stylessuffix = [item.split('-subject-')[1] for item in styleslist]
     breakstylessuffix = [item.split(',') for item in stylessuffix]
     allstylessuffixlist = [value for sublist in breakstylessuffix for value in sublist]
-    allstylessuffixlist = list(set(allstylessuffixlist))
+    allstylessuffixlist = list(dict.fromkeys(allstylessuffixlist))
 
     artistsuffix = artist_descriptions_csv_to_list("artists_and_category")
     breakartiststylessuffix = [item.split(',') for item in artistsuffix]
     artiststylessuffixlist = [value for sublist in breakartiststylessuffix for value in sublist]
-    artiststylessuffixlist = list(set(artiststylessuffixlist))
+    artiststylessuffixlist = list(dict.fromkeys(artiststylessuffixlist))
     allstylessuffixlist += artiststylessuffixlist
 
 
@@ -3829,7 +3831,7 @@ def createpromptvariant(prompt = "", insanitylevel = 5, antivalues = "" , gender
     stylessuffix = [item.split('-subject-')[1] for item in styleslist]
     breakstylessuffix = [item.split(',') for item in stylessuffix]
     allstylessuffixlist = [value for sublist in breakstylessuffix for value in sublist]
-    allstylessuffixlist = list(set(allstylessuffixlist))
+    allstylessuffixlist = list(dict.fromkeys(allstylessuffixlist))
 
     # build artists list
     if artists == "wild":
@@ -4477,26 +4479,24 @@ def replacewildcard(completeprompt, insanitylevel, wildcard,listname, activatehy
             if(unique_dist(insanitylevel) and activatehybridorswap == True and len(listname)>2 and advancedprompting==True):
                 hybridorswaplist = ["hybrid", "swap"]
                 hybridorswap = random.choice(hybridorswaplist)
-                replacementvalue = random.choice(listname)
-                listname.remove(replacementvalue)
+                replacementvalue = draw(listname)
                 hybridorswapreplacementvalue = "[" + replacementvalue
                 
                 if(hybridorswap == "hybrid"):
-                        replacementvalue = random.choice(listname)
-                        listname.remove(replacementvalue)
+                        replacementvalue = draw(listname)
                         hybridorswapreplacementvalue += "|" + replacementvalue + "] "
                 if(hybridorswap == "swap"):
-                        replacementvalue = random.choice(listname)
-                        listname.remove(replacementvalue)
+                        replacementvalue = draw(listname)
                         hybridorswapreplacementvalue += ":" + replacementvalue + ":" + str(random.randint(1,20)) +  "] "
                 
                 completeprompt = completeprompt.replace(wildcard, hybridorswapreplacementvalue,1)
 
             #if list is not empty
             if(bool(listname)):
-                replacementvalue = random.choice(listname)
                 if(wildcard not in ["-heshe-", "-himher-","-hisher-"]):
-                    listname.remove(replacementvalue)
+                    replacementvalue = draw(listname)
+                else:
+                    replacementvalue = random.choice(listname)
 
 
                 
@@ -4527,9 +4527,8 @@ def replacewildcard(completeprompt, insanitylevel, wildcard,listname, activatehy
                 # leftovers will be removed in the cleaning step
                 while bool(artiststyle) and "-artiststyle-" in completeprompt:
                 
-                    chosenartiststyle = random.choice(artiststyle)
+                    chosenartiststyle = draw(artiststyle)
                     completeprompt = completeprompt.replace("-artiststyle-",chosenartiststyle ,1)
-                    artiststyle.remove(chosenartiststyle)
 
                 if("-artistmedium-" in completeprompt):
                     if(artistmediums[0].lower() not in completeprompt.lower()):
@@ -4540,9 +4539,8 @@ def replacewildcard(completeprompt, insanitylevel, wildcard,listname, activatehy
                 
                 while bool(artiststyle) and "-artiststyle-" in completeprompt:
                 
-                    chosenartiststyle = random.choice(artiststyle)
+                    chosenartiststyle = draw(artiststyle)
                     completeprompt = completeprompt.replace("-artiststyle-",chosenartiststyle ,1)
-                    artiststyle.remove(chosenartiststyle)
 
             
             
@@ -4615,6 +4613,29 @@ def replacewildcard(completeprompt, insanitylevel, wildcard,listname, activatehy
 
     return completeprompt
 
+def artists_to_tags(positive_prompt):
+    """Lowercase the prompt and swap every artist in it for their tags."""
+    # note, should we find a trick for some shorthands of artists??
+    artistshorthands = csv_to_list(csvfilename="artistshorthands",directory="./csvfiles/special_lists/",delimiter="?")
+    for shorthand in artistshorthands:
+        parts = shorthand.split(';')
+        if parts[0] in positive_prompt:
+            positive_prompt = positive_prompt.lower().replace(parts[0].lower(), parts[1].lower())
+
+    # Only the few artists that are in the prompt need a replace. The prompt
+    # is lowered after each one, except the last artist of the list, whose
+    # tags always went in as they are.
+    tag_pairs = artist_tag_pairs()
+    if(tag_pairs):
+        positive_prompt = positive_prompt.lower()
+    last = len(tag_pairs) - 1
+    for i, (artist_name, category) in enumerate(tag_pairs):
+        if(artist_name in positive_prompt):
+            positive_prompt = positive_prompt.replace(artist_name, category)
+            if(i < last):
+                positive_prompt = positive_prompt.lower()
+    return positive_prompt
+
 def build_dynamic_negative(positive_prompt = "", insanitylevel = 0, enhance = False, existing_negative_prompt = "", base_model="SD1.5"):
 
 
@@ -4633,26 +4654,12 @@ def build_dynamic_negative(positive_prompt = "", insanitylevel = 0, enhance = Fa
     if base_model == "Stable Cascade":
         remove_weights = True
     
-    # negavite_primer, all words that should trigger a negative result
-    # the negative words to put in the negative prompt
-    negative_primer, negative_result = load_negative_list()
+    # all words that should trigger a negative result, with the negative
+    # words to put in the negative prompt
+    negative_words_by_primer = negative_lexicon()
 
     # do a trick for artists, replace with their tags instead
-    artistlist, categorylist = load_all_artist_and_category()
-    # lower them
-    artist_names = [artist.strip().lower() for artist in artistlist]
-
-    # note, should we find a trick for some shorthands of artists??
-    artistshorthands = csv_to_list(csvfilename="artistshorthands",directory="./csvfiles/special_lists/",delimiter="?")
-    for shorthand in artistshorthands:
-        parts = shorthand.split(';')
-        if parts[0] in positive_prompt:
-            positive_prompt = positive_prompt.lower().replace(parts[0].lower(), parts[1].lower())
-
-
-    for artist_name, category in zip(artist_names, categorylist):
-        positive_prompt = positive_prompt.lower().replace(artist_name, category)
-
+    positive_prompt = artists_to_tags(positive_prompt)
 
     allwords = split_prompt_to_words(positive_prompt)
 
@@ -4660,9 +4667,9 @@ def build_dynamic_negative(positive_prompt = "", insanitylevel = 0, enhance = Fa
     #lower all!
     
     for word in allwords:
-        if(word.lower() in negative_primer):
-            index_of_word = negative_primer.index(word.lower())
-            all_negative_words_list.append(negative_result[index_of_word])
+        negative_words = negative_words_by_primer.get(word.lower())
+        if(negative_words is not None):
+            all_negative_words_list.append(negative_words)
     
     all_negative_words = ", ".join(all_negative_words_list)
     all_negative_words_list = all_negative_words.split(",")
@@ -4721,20 +4728,7 @@ def enhance_positive(positive_prompt = "", amountofwords = 3):
     wordcombilist = csv_to_list(csvfilename="wordcombis", directory="./csvfiles/special_lists/",delimiter="?")
 
     # do a trick for artists, replace with their tags instead
-    artistlist, categorylist = load_all_artist_and_category()
-    # lower them
-    artist_names = [artist.strip().lower() for artist in artistlist]
-
-    # note, should we find a trick for some shorthands of artists??
-    artistshorthands = csv_to_list(csvfilename="artistshorthands",directory="./csvfiles/special_lists/",delimiter="?")
-    for shorthand in artistshorthands:
-        parts = shorthand.split(';')
-        if parts[0] in positive_prompt:
-            positive_prompt = positive_prompt.lower().replace(parts[0].lower(), parts[1].lower())
-
-
-    for artist_name, category in zip(artist_names, categorylist):
-        positive_prompt = positive_prompt.lower().replace(artist_name, category)
+    positive_prompt = artists_to_tags(positive_prompt)
 
     allwords = split_prompt_to_words(positive_prompt)
     allwords = [elem.strip().lower() for elem in allwords] # lower them
@@ -4747,13 +4741,13 @@ def enhance_positive(positive_prompt = "", amountofwords = 3):
 
     for combiset in wordcombilist:
 
-        combiwords = set(combiset.split(', '))
+        combiwords = dict.fromkeys(combiset.split(', '))
         for combiword in combiwords:
             for word in allwords:
                 if(word.lower() == combiword.lower()):
 
                     wordsfound += 1
-                    combiwords2 = set(combiset.split(', '))
+                    combiwords2 = dict.fromkeys(combiset.split(', '))
                     # remove and only take one
                     combiwords2 = [word for word in combiwords2 if word not in allwords]
                     #for combiword2 in combiwords2:
@@ -4763,7 +4757,7 @@ def enhance_positive(positive_prompt = "", amountofwords = 3):
     
     
     newwordlist = [word for word in newwordlist if word not in allwords]
-    newwordlist = list(set(newwordlist)) # make unique
+    newwordlist = list(dict.fromkeys(newwordlist)) # make unique
     
     
     for i in range(0,amountofwords):
@@ -4824,12 +4818,12 @@ def artify_prompt(insanitylevel = 5, prompt = "", artists = "all", amountofartis
     stylessuffix = [item.split('-subject-')[1] for item in styleslist]
     breakstylessuffix = [item.split(',') for item in stylessuffix]
     allstylessuffixlist = [value for sublist in breakstylessuffix for value in sublist]
-    allstylessuffixlist = list(set(allstylessuffixlist))
+    allstylessuffixlist = list(dict.fromkeys(allstylessuffixlist))
 
     artistsuffix = artist_descriptions_csv_to_list("artists_and_category")
     breakartiststylessuffix = [item.split(',') for item in artistsuffix]
     artiststylessuffixlist = [value for sublist in breakartiststylessuffix for value in sublist]
-    artiststylessuffixlist = list(set(artiststylessuffixlist))
+    artiststylessuffixlist = list(dict.fromkeys(artiststylessuffixlist))
     allstylessuffixlist += artiststylessuffixlist
 
     completeprompt = ""
@@ -5159,7 +5153,7 @@ def split_prompt_to_words(text):
         words = [word for word in words if word]
 
         # Convert the list to a set to remove duplicates, then convert it back to a list
-        listsinglewords = list(set(words))
+        listsinglewords = list(dict.fromkeys(words))
 
         # now get all words clumped together by commas
         if ',' in text:
@@ -5170,11 +5164,11 @@ def split_prompt_to_words(text):
         words = [word.strip().lower() for word in allwords]
 
         # Filter out empty words and duplicates
-        listwords = list(set(filter(None, words)))
+        listwords = list(dict.fromkeys(filter(None, words)))
 
         totallist = listsinglewords + listwords
 
-        totallist = list(set(filter(None, totallist)))
+        totallist = list(dict.fromkeys(filter(None, totallist)))
 
         return totallist
 
@@ -5708,3 +5702,19 @@ def translate_main_subject(main_subject=""):
     subjecttype = subjecttype_lookup.get(main_subject, ["all", "all"])
 
     return subjecttype
+
+
+def build_dynamic_prompts(n, seed, **options):
+    """n prompts from build_dynamic_prompt options, the same ones for the same seed.
+
+    Every prompt draws from its own Random, seeded from the batch seed, so
+    a prompt doesn't depend on the ones before it. They are built in this
+    process, one after the other: forking the server, with its threads and
+    models, to spread them out could deadlock.
+    """
+    options.pop("seed", None)
+    prompts = []
+    for prompt_seed in prompt_seeds(seed, n):
+        with seeded(prompt_seed):
+            prompts.append(build_dynamic_prompt(**options))
+    return prompts
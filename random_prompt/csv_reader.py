@@ -1,14 +1,80 @@
 import csv
-import random
+from random_prompt.rng import rng as random
+from random_prompt.sampler import Pool
 import os
 import shutil
+import stat
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+# Parsed csv files, kept in memory and only read again when their mtime or
+# size changes. Values are interned, the same words show up in many lists.
+_CsvFile = namedtuple("_CsvFile", ["signature", "rows", "keys"])
+_files = {}
+_folders = {}
+
+# Finished csv_to_list results, for the lists in the exact state they were
+# filtered from. Handed out as Pools, which copy one only when it changes.
+LIST_CACHE_SIZE = 4096
+_lists = OrderedDict()
+_lock = threading.Lock()
+
+# The artists csv and the negative list as lookups
+_ArtistIndex = namedtuple("_ArtistIndex", ["signature", "artists", "tags", "descriptions", "by_artist", "by_category", "tag_pairs"])
+_NegativeIndex = namedtuple("_NegativeIndex", ["signature", "primers", "negatives", "lexicon"])
+_artist_indexes = {}
+_negative_indexes = {}
+
+def _read_csv(path, delimiter=","):
+        """The rows of a csv file as a _CsvFile, None if there is no such file."""
+        try:
+                st = os.stat(path)
+        except OSError:
+                return None
+        if(not stat.S_ISREG(st.st_mode)):
+                return None
+        signature = (st.st_mtime_ns, st.st_size)
+        cached = _files.get((path, delimiter))
+        if(cached is None or cached.signature != signature):
+                with open(path, "r", newline="",encoding="utf8") as file:
+                        rows = tuple(tuple(sys.intern(value) for value in row) for row in csv.reader(file, delimiter=delimiter))
+                # what the antilist gets matched against, None for empty lines
+                keys = tuple(sys.intern(row[0].lower().strip()) if row else None for row in rows)
+                cached = _CsvFile(signature, rows, keys)
+                _files[(path, delimiter)] = cached
+        return cached
+
+def _listdir(folder):
+        """Names in a folder, listed again only when the folder changes."""
+        mtime = os.stat(folder).st_mtime_ns
+        cached = _folders.get(folder)
+        if(cached is None or cached[0] != mtime):
+                cached = (mtime, frozenset(os.listdir(folder)))
+                _folders[folder] = cached
+        return cached[1]
+
+def _filter_rows(csvfile, skipheader, gender, antilist, lowerandstrip):
+        csvlist = []
+        start = 1 if skipheader==True else 0
+        for row, key in zip(csvfile.rows[start:], csvfile.keys[start:]):
+                value = row[0]
+                if(gender != "all" and row[1] != gender and row[1] != "genderless" and row[1] != "both"):
+                        continue
+                if(key not in antilist):
+                        if(lowerandstrip == 1):
+                                csvlist.append(key)
+                        else:
+                                csvlist.append(value)
+        return csvlist
 
 def random_read_from_csv(filename):
     script_dir = os.path.dirname(os.path.abspath(__file__))  # Script directory
     full_path = os.path.join(script_dir, "./csvfiles/" )
-    with open(full_path + filename + ".csv", "r",encoding="utf8") as csv_file:
-            csv_reader = csv.reader(csv_file)
-            output = (random.choice([line[0] for line in csv_reader]))
+    csvfile = _read_csv(full_path + filename + ".csv")
+    if csvfile is None:
+        raise FileNotFoundError(full_path + filename + ".csv")
+    output = (random.choice([line[0] for line in csvfile.rows]))
     return output
 
 def add_from_csv(completeprompt, csvfilename, addcomma, prefix, suffix):
@@ -26,7 +92,6 @@ def csv_to_list(csvfilename, antilist=[], directory="./csvfiles/", lowerandstrip
         userfilereplacename = csvfilename + "_replace.csv"
         lightfilename = csvfilename + "_light.csv"
         mediumfilename = csvfilename + "_medium.csv"
-        csvlist = []
         script_dir = os.path.dirname(os.path.abspath(__file__))
         full_path = os.path.join(script_dir, directory )
         userfilesfolder = os.path.join(script_dir, userfilesdirectory )
@@ -34,147 +99,154 @@ def csv_to_list(csvfilename, antilist=[], directory="./csvfiles/", lowerandstrip
         
         # check if there is a replace file
         if(directory=="./csvfiles/" or directory=="./csvfiles/special_lists/" or directory=="./csvfiles/templates/"):      
-                for filename in os.listdir(userfilesfolder):
-                        if(filename == userfilereplacename):
-                                # Just override the parameters, and let it run normally
-                                full_path = os.path.join(script_dir, userfilesdirectory )
-                                csvfilename = csvfilename + "_replace"
-                                replacing = True
+                if(userfilereplacename in _listdir(userfilesfolder)):
+                        # Just override the parameters, and let it run normally
+                        full_path = os.path.join(script_dir, userfilesdirectory )
+                        csvfilename = csvfilename + "_replace"
+                        replacing = True
 
 
                 # Go check for light or medium files if there is no override and there is an insanitylevel
                 if(replacing == False and insanitylevel > 0):
                         if(insanitylevel < 4):   
-                                for filename in os.listdir(directoryfilesfolder):
-                                        if(filename == mediumfilename):
-                                                # Just override the parameters, and let it run normally
-                                                full_path = os.path.join(script_dir, directory )
-                                                csvfilename = csvfilename + "_light"
-                                                replacing = True
+                                if(mediumfilename in _listdir(directoryfilesfolder)):
+                                        # Just override the parameters, and let it run normally
+                                        full_path = os.path.join(script_dir, directory )
+                                        csvfilename = csvfilename + "_light"
+                                        replacing = True
                         # under 7, than only SOMETIMES take the full list
                         if(insanitylevel < 7 and random.randint(0,13) < 12 and replacing == False):   
-                                for filename in os.listdir(directoryfilesfolder):
-                                        if(filename == lightfilename):
-                                                # Just override the parameters, and let it run normally
-                                                full_path = os.path.join(script_dir, directory )
-                                                csvfilename = csvfilename + "_medium"
-                                                replacing = True
+                                if(lightfilename in _listdir(directoryfilesfolder)):
+                                        # Just override the parameters, and let it run normally
+                                        full_path = os.path.join(script_dir, directory )
+                                        csvfilename = csvfilename + "_medium"
+                                        replacing = True
                         
                         
 
-        # return empty list if we can't find the file. Build for antilist.csv
-        if(os.path.isfile(full_path + csvfilename + ".csv")):
-                with open(full_path + csvfilename + ".csv", "r", newline="",encoding="utf8") as file:
-                        reader = csv.reader(file, delimiter=delimiter)
-                        if(skipheader==True):
-                                next(reader)
-                        if(listoflistmode==True):
-                                csvlist = list(reader)
-                        else:
-                                for row in reader:
-                                        value = row[0]
-                                        if( 
-                                                gender != "all" and (row[1] == gender or row[1] == "genderless" or row[1] == "both")
-                                                or gender == "all"
-                                                ):
-                                                if(value.lower().strip() not in antilist):
-                                                        if(lowerandstrip == 1):
-                                                                csvlist.append(row[0].lower().strip())        
-                                                        else:
-                                                                csvlist.append(row[0])
-        # dirty hack for possible .txt files
-        if(os.path.isfile(full_path + csvfilename + ".txt")):
-                with open(full_path + csvfilename + ".txt", "r", newline="",encoding="utf8") as file:
-                        reader = csv.reader(file, delimiter=delimiter)
-                        if(skipheader==True):
-                                next(reader)
-                        if(listoflistmode==True):
-                                csvlist = list(reader)
-                        else:
-                                for row in reader:
-                                        value = row[0]
-                                        if( 
-                                                gender != "all" and (row[1] == gender or row[1] == "genderless" or row[1] == "both")
-                                                or gender == "all"
-                                                ):
-                                                if(value.lower().strip() not in antilist):
-                                                        if(lowerandstrip == 1):
-                                                                csvlist.append(row[0].lower().strip())        
-                                                        else:
-                                                                csvlist.append(row[0])
-
-        # do the add ons!
+        # a missing file just adds nothing, antilist.csv often doesn't exist.
+        # .txt files are a dirty hack, and the user add ons only go with the
+        # normal lists.
+        csvfile = _read_csv(full_path + csvfilename + ".csv", delimiter)
+        txtfile = _read_csv(full_path + csvfilename + ".txt", delimiter)
+        addonfile = None
         if(directory=="./csvfiles/" or directory=="./csvfiles/special_lists/"):
-                if(os.path.isfile(userfilesfolder + csvfilename + "_addon" + ".csv")):
-                        with open(userfilesfolder + csvfilename + "_addon" + ".csv", "r", newline="",encoding="utf8") as file:
-                                reader = csv.reader(file, delimiter=delimiter)
-                                if(skipheader==True):
-                                        next(reader)
-                                if(listoflistmode==True):
-                                        csvlist.append(list(reader))
-                                else:
-                                        for row in reader:
-                                                value = row[0]
-                                                if( 
-                                                gender != "all" and (row[1] == gender or row[1] == "genderless" or row[1] == "both")
-                                                or gender == "all"
-                                                ):
-                                                        if(value.lower().strip() not in antilist):
-                                                                if(lowerandstrip == 1):
-                                                                        csvlist.append(row[0].lower().strip())        
-                                                                else:
-                                                                        csvlist.append(row[0])
+                addonfile = _read_csv(userfilesfolder + csvfilename + "_addon" + ".csv", delimiter)
+
+        if(listoflistmode==True):
+                start = 1 if skipheader==True else 0
+                csvlist = []
+                if(csvfile is not None):
+                        csvlist = [list(row) for row in csvfile.rows[start:]]
+                if(txtfile is not None):
+                        csvlist = [list(row) for row in txtfile.rows[start:]]
+                if(addonfile is not None):
+                        csvlist.append([list(row) for row in addonfile.rows[start:]])
+                return csvlist
+
+        antilist = frozenset(antilist)
+        key = (full_path + csvfilename, directory, delimiter, skipheader, lowerandstrip, gender, antilist,
+               tuple(f.signature if f is not None else None for f in (csvfile, txtfile, addonfile)))
+        with _lock:
+                cached = _lists.get(key)
+                if(cached is not None):
+                        _lists.move_to_end(key)
+                        return Pool(cached)
 
+        csvlist = []
+        for f in (csvfile, txtfile, addonfile):
+                if(f is not None):
+                        csvlist += _filter_rows(f, skipheader, gender, antilist, lowerandstrip)
 
         # remove duplicates, but check only for lowercase stuff
         deduplicated_list = []
         lowercase_elements = set()
-        if(listoflistmode==False):
-                for element in csvlist:
-                        lowercase_element = element.lower()
-                        if lowercase_element not in lowercase_elements:
-                                lowercase_elements.add(lowercase_element)
-                                deduplicated_list.append(element)
-        else:
-                deduplicated_list = csvlist
-        
-        return deduplicated_list
+        for element in csvlist:
+                lowercase_element = element.lower()
+                if lowercase_element not in lowercase_elements:
+                        lowercase_elements.add(lowercase_element)
+                        deduplicated_list.append(element)
+
+        cached = tuple(deduplicated_list)
+        with _lock:
+                _lists[key] = cached
+                while(len(_lists) > LIST_CACHE_SIZE):
+                        _lists.popitem(last=False)
+        return Pool(cached)
+
+def _dict_rows(csvfile):
+        """The non-empty rows after the header, and the header's column numbers.
+
+        Read them with _column, which like csv.DictReader gives None for
+        columns a short row doesn't have.
+        """
+        if(not csvfile.rows):
+                return [], {}
+        columns = {name: i for i, name in enumerate(csvfile.rows[0])}
+        rows = [row for row in csvfile.rows[1:] if row]
+        return rows, columns
+
+def _column(row, columns, name):
+        i = columns[name]
+        return row[i] if i < len(row) else None
+
+def _artist_index(csvfilename):
+        """The artists csv as lookups, built again only when the file changes.
+
+        by_artist is artist -> (tags, mediums, descriptions) and by_category
+        is category -> artists, both in file order.
+        """
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(script_dir, "./csvfiles/" ) + csvfilename + ".csv"
+        csvfile = _read_csv(path, ",")
+        if(csvfile is None):
+                raise FileNotFoundError(path)
+        cached = _artist_indexes.get(path)
+        if(cached is None or cached.signature != csvfile.signature):
+                rows, columns = _dict_rows(csvfile)
+                artists = [_column(row, columns, "Artist") for row in rows]
+                tags = [_column(row, columns, "Tags") for row in rows]
+                by_artist = {}
+                for artist, tag, row in zip(artists, tags, rows):
+                        entry = by_artist.setdefault(artist, ([], [], []))
+                        entry[0].append(tag)
+                        entry[1].append(_column(row, columns, "Medium"))
+                        entry[2].append(_column(row, columns, "Description"))
+                by_category = {
+                        category: [artist for artist, row in zip(artists, rows) if _column(row, columns, category) == "1"]
+                        for category in columns
+                }
+                cached = _ArtistIndex(
+                        csvfile.signature,
+                        artists,
+                        tags,
+                        [_column(row, columns, "Description") for row in rows],
+                        by_artist,
+                        by_category,
+                        # the artist -> tags swaps build_dynamic_negative does
+                        [(artist.strip().lower(), tag) for artist, tag in zip(artists, tags)],
+                )
+                _artist_indexes[path] = cached
+        return cached
 
 def artist_category_by_category_csv_to_list(csvfilename,artist):
-        csvlist = []
-        mediumlist = []
-        descriptionlist = []
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(script_dir, "./csvfiles/" )
-        with open(full_path + csvfilename + ".csv", "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=",")
-                for row in reader:
-                        if(row["Artist"] == artist):
-                                csvlist.append(row["Tags"])
-                                mediumlist.append(row["Medium"])
-                                descriptionlist.append(row["Description"])
-        return csvlist, mediumlist, descriptionlist
+        csvlist, mediumlist, descriptionlist = _artist_index(csvfilename).by_artist.get(artist, ([], [], []))
+        return list(csvlist), list(mediumlist), list(descriptionlist)
 
 def artist_category_csv_to_list(csvfilename,category):
-        csvlist = []
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(script_dir, "./csvfiles/" )
-        with open(full_path + csvfilename + ".csv", "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=",")
-                for row in reader:
-                        if(row[category] == "1"):
-                                csvlist.append(row["Artist"])
-        return csvlist
+        index = _artist_index(csvfilename)
+        if(category not in index.by_category):
+                if(not index.artists):
+                        return []
+                raise KeyError(category)
+        return list(index.by_category[category])
 
 def artist_descriptions_csv_to_list(csvfilename):
-        csvlist = []
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(script_dir, "./csvfiles/" )
-        with open(full_path + csvfilename + ".csv", "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=",")
-                for row in reader:
-                        csvlist.append(row["Description"])
-        return csvlist
+        return list(_artist_index(csvfilename).descriptions)
+
+def artist_tag_pairs():
+        """(lowered artist name, tags) for every artist, in file order."""
+        return _artist_index("artists_and_category").tag_pairs
 
 def load_config_csv(suffix=""):
         csvlist = []
@@ -198,12 +270,12 @@ def load_config_csv(suffix=""):
                 csvlist = [list(row.values()) for row in reader if not any(value.startswith('#') for value in row.values())]
         return csvlist
 
-def load_negative_list():
-        primerlist = []
-        negativelist = []
-        primeraddonlist = []
-        negativeaddonlist = []
+def _negative_index():
+        """Primers and negatives of the negative list and its addon, cached.
 
+        lexicon maps each primer to the negatives of its first line, which is
+        what looking it up with list.index() gives.
+        """
         script_dir = os.path.dirname(os.path.abspath(__file__))
         
         full_path_default_negative_file = os.path.join(script_dir, "./csvfiles/special_lists/" )
@@ -219,44 +291,40 @@ def load_negative_list():
         if(os.path.isfile(replace_negative_file)):
                 negative_file = replace_negative_file
 
-        with open(negative_file, "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=";")
-                primerlist = [row["primer"] for row in reader]
-        with open(negative_file, "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=";")
-                negativelist = [row["negative"] for row in reader]
-
-
-        if(os.path.isfile(addon_negative_file)):
-                with open(addon_negative_file, "r", newline="",encoding="utf8") as file:
-                        reader = csv.DictReader(file, delimiter=";")
-                        primeraddonlist = [row["primer"] for row in reader]
-                with open(addon_negative_file, "r", newline="",encoding="utf8") as file:
-                        reader = csv.DictReader(file, delimiter=";")
-                        negativeaddonlist = [row["negative"] for row in reader]
-        
-        primerlist += primeraddonlist
-        negativelist += negativeaddonlist
+        csvfiles = [_read_csv(negative_file, ";")]
+        if(csvfiles[0] is None):
+                raise FileNotFoundError(negative_file)
+        addon = _read_csv(addon_negative_file, ";")
+        if(addon is not None):
+                csvfiles.append(addon)
+
+        signature = tuple((path, csvfile.signature) for path, csvfile in zip((negative_file, addon_negative_file), csvfiles))
+        cached = _negative_indexes.get("negative")
+        if(cached is None or cached.signature != signature):
+                primerlist = []
+                negativelist = []
+                for csvfile in csvfiles:
+                        rows, columns = _dict_rows(csvfile)
+                        primerlist += [_column(row, columns, "primer") for row in rows]
+                        negativelist += [_column(row, columns, "negative") for row in rows]
+                lexicon = {}
+                for primer, negative in zip(primerlist, negativelist):
+                        lexicon.setdefault(primer, negative)
+                cached = _NegativeIndex(signature, primerlist, negativelist, lexicon)
+                _negative_indexes["negative"] = cached
+        return cached
 
+def load_negative_list():
+        index = _negative_index()
+        return list(index.primers), list(index.negatives)
 
-        return primerlist, negativelist
+def negative_lexicon():
+        """primer -> negative words, for matching the words of a prompt."""
+        return _negative_index().lexicon
 
 def load_all_artist_and_category():
-        artistlist = []
-        categorylist = []
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        full_path_default_artist_file = os.path.join(script_dir, "./csvfiles/" )
-        artist_file = full_path_default_artist_file + 'artists_and_category.csv'
-
-        with open(artist_file, "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=",")
-                artistlist = [row["Artist"] for row in reader]
-        with open(artist_file, "r", newline="",encoding="utf8") as file:
-                reader = csv.DictReader(file, delimiter=",")
-                categorylist = [row["Tags"] for row in reader]
-
-        return artistlist, categorylist
+        index = _artist_index("artists_and_category")
+        return list(index.artists), list(index.tags)
 
 def sort_and_dedupe_csv_file():
         tokenlist = csv_to_list(csvfilename="tokens",skipheader=False)
@@ -1,4 +1,4 @@
-import random
+from random_prompt.rng import rng as random
 def common_dist(insanitylevel):
     return (random.randint(1, 5)<insanitylevel or insanitylevel >= 10)
 
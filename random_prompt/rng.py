@@ -0,0 +1,34 @@
+import contextlib
+import contextvars
+import random as _random
+
+# The prompt generator calls random.choice and friends all over the place.
+# Those modules import `rng as random` instead, which draws from the Random of
+# the seeded() block it runs in, and from the global generator otherwise.
+_current = contextvars.ContextVar("obp_random", default=None)
+
+
+class PromptRandom:
+    """Stands in for the random module."""
+
+    def __getattr__(self, name):
+        return getattr(_current.get() or _random, name)
+
+
+rng = PromptRandom()
+
+
+@contextlib.contextmanager
+def seeded(seed):
+    """Everything generated in the block comes from its own Random(seed)."""
+    token = _current.set(_random.Random(seed))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def prompt_seeds(seed, n):
+    """The seeds of the prompts in a batch, so every prompt can be made on its own."""
+    source = _random.Random(seed)
+    return [source.getrandbits(32) for _ in range(n)]
@@ -0,0 +1,158 @@
+import operator
+from collections.abc import MutableSequence
+from itertools import islice
+
+from random_prompt.rng import rng as random
+
+
+def draw(values):
+    """Take a random item out of a list or Pool in O(1).
+
+    The last item moves into the hole instead of everything after it
+    shifting down, as list.remove does. Uses the random numbers the same
+    way random.choice does, so it picks the same item, only the rest of the
+    list ends up in a different order.
+    """
+    if isinstance(values, Pool):
+        return values.draw()
+    i = random.randrange(len(values))
+    value = values[i]
+    last = values.pop()
+    if i < len(values):
+        values[i] = last
+    return value
+
+
+class Pool(MutableSequence):
+    """A list of values that shares a cached tuple until it is changed.
+
+    csv_to_list hands these out instead of a copy of its cached list, so a
+    list the prompt never draws from costs nothing. draw() doesn't copy
+    either: the positions it swapped are kept in a dict over the shared
+    tuple. Any other change copies the values into a list of the pool's own
+    first. Reads see the same values in the same order as a list that had
+    the same things done to it, except that a loop over a pool that hasn't
+    been changed yet doesn't see changes made in the loop.
+    """
+
+    __slots__ = ("_shared", "_swapped", "_len", "_list")
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._swapped = {}
+        self._len = len(shared)
+        self._list = None
+
+    def _copy(self):
+        if self._list is not None:
+            return list(self._list)
+        shared, swapped = self._shared, self._swapped
+        if swapped:
+            return [swapped.get(i, shared[i]) for i in range(self._len)]
+        return list(islice(shared, self._len))
+
+    def _values(self):
+        # The pool's own list, made on the first change
+        if self._list is None:
+            self._list = self._copy()
+            self._shared = self._swapped = None
+        return self._list
+
+    def _untouched(self):
+        return self._list is None and not self._swapped and self._len == len(self._shared)
+
+    def draw(self):
+        if self._list is not None:
+            return draw(self._list)
+        swapped = self._swapped
+        i = random.randrange(self._len)
+        value = swapped.get(i, self._shared[i])
+        self._len -= 1
+        last = swapped.pop(self._len, self._shared[self._len])
+        if i < self._len:
+            swapped[i] = last
+        return value
+
+    def __len__(self):
+        return self._len if self._list is None else len(self._list)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._copy()[index]
+        if self._list is not None:
+            return self._list[index]
+        index = operator.index(index)
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list index out of range")
+        return self._swapped.get(index, self._shared[index])
+
+    def __iter__(self):
+        if self._untouched():
+            return iter(self._shared)
+        return iter(self._list if self._list is not None else self._copy())
+
+    def __contains__(self, value):
+        if self._untouched():
+            return value in self._shared
+        return value in (self._list if self._list is not None else self._copy())
+
+    def __setitem__(self, index, value):
+        self._values()[index] = value
+
+    def __delitem__(self, index):
+        del self._values()[index]
+
+    def insert(self, index, value):
+        self._values().insert(index, value)
+
+    def append(self, value):
+        self._values().append(value)
+
+    def extend(self, values):
+        self._values().extend(values)
+
+    def remove(self, value):
+        self._values().remove(value)
+
+    def pop(self, index=-1):
+        return self._values().pop(index)
+
+    def clear(self):
+        self._values().clear()
+
+    def sort(self, *args, **kwargs):
+        self._values().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._values().reverse()
+
+    def index(self, *args):
+        return self._copy().index(*args)
+
+    def count(self, value):
+        return self._copy().count(value)
+
+    def copy(self):
+        return self._copy()
+
+    def __iadd__(self, values):
+        self._values().extend(values)
+        return self
+
+    def __add__(self, other):
+        return self._copy() + other
+
+    def __radd__(self, other):
+        return other + self._copy()
+
+    def __eq__(self, other):
+        if isinstance(other, Pool):
+            other = other._copy()
+        return self._copy() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._copy())
@@ -1,7 +1,4 @@
-try:
-    from transformers import CLIPTokenizer
-except:
-    pass
+from modules import prompt_tokens
 from modules.translation_manager import TranslationManager
 from modules.settings import SettingsManager
 from modules.performance import PerformanceSettings
@@ -32,11 +29,6 @@ state = {
 }
 
 wildcards = None
-try:
-    tokenizer = CLIPTokenizer.from_pretrained("openai/clip-vit-large-patch14")
-except:
-    print("No tokenizer in shared.py yet")
-    tokenizer = None
 
 settings = SettingsManager()
 path_manager = PathManager()
@@ -46,6 +38,12 @@ from modules.model_handler import Models
 models = Models()
 shared_cache = {}
 
+# shared.tokenizer loads the CLIP tokenizer on first use, None if it can't
+def __getattr__(name):
+    if name == "tokenizer":
+        return prompt_tokens.counter.tokenizer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Call this to trigger a refresh of ui components
 def update_cfg():
     state["last_config"] = str(time.time())
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import os
 import random
+import threading
+import time
 import torch
 from transformers import T5Tokenizer, T5ForConditionalGeneration
 from superprompter.download_models import download_models
@@ -10,30 +12,90 @@ global tokenizer, model
 script_dir = Path(__file__).resolve().parent  # Script directory
 modelDir = script_dir / "model_files"
 
+tokenizer = None
+model = None
+device = "cpu"
 
-def load_models():
+# Seconds without a request before the model is dropped from memory
+IDLE_TIMEOUT = 300
+
+_lock = threading.RLock()
+_last_used = 0.0
+_watchdog = None
 
-    if not os.path.isdir(modelDir):
-        print("Model files not found. Downloading...\n")
-        download_models(modelDir)
 
+def load_models():
+    # Loads the model once and keeps it warm, later calls only refresh the
+    # idle timer.
+    global tokenizer, model, device, _last_used
+
+    with _lock:
+        _last_used = time.time()
+        if tokenizer is not None and model is not None:
+            return
+
+        if not os.path.isdir(modelDir):
+            print("Model files not found. Downloading...\n")
+            download_models(modelDir)
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        tokenizer = T5Tokenizer.from_pretrained(modelDir)
+        model = T5ForConditionalGeneration.from_pretrained(
+            modelDir, torch_dtype=torch.float16
+        )
+        if device == "cpu":
+            # Half precision is slow (or unsupported) on most CPUs
+            model = model.float()
+        model.to(device)
+        model.eval()
+        _start_watchdog()
+
+
+def release_models():
+    # Drop the model from memory but keep the files on disk
     global tokenizer, model
-    tokenizer = T5Tokenizer.from_pretrained(modelDir)
-    model = T5ForConditionalGeneration.from_pretrained(
-        modelDir, torch_dtype=torch.float16
-    )
+
+    with _lock:
+        if model is None:
+            return
+        tokenizer = None
+        model = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
 
 def unload_models():
-    global tokenizer, model
-    del tokenizer
-    del model
+    release_models()
 
     for file in os.listdir(modelDir):
         os.remove(os.path.join(modelDir, file))
     os.rmdir(modelDir)
 
 
+def _watch_idle():
+    global _watchdog
+
+    while True:
+        time.sleep(min(IDLE_TIMEOUT, 30))
+        with _lock:
+            if model is None:
+                _watchdog = None
+                return
+            if time.time() - _last_used > IDLE_TIMEOUT:
+                print("SuperPrompter idle, unloading model.")
+                release_models()
+                _watchdog = None
+                return
+
+
+def _start_watchdog():
+    global _watchdog
+
+    if _watchdog is None:
+        _watchdog = threading.Thread(target=_watch_idle, daemon=True)
+        _watchdog.start()
+
+
 def answer(
     input_text="",
     max_new_tokens=512,
@@ -43,32 +105,26 @@ def answer(
     top_k=1,
     seed=-1,
 ):
-
     if seed == -1:
         seed = random.randint(1, 1000000)
 
-    torch.manual_seed(seed)
-
-    if torch.cuda.is_available():
-        device = "cuda"
-    else:
-        device = "cpu"
-
-    input_ids = tokenizer(input_text, return_tensors="pt").input_ids.to(device)
-    if torch.cuda.is_available():
-        model.to("cuda")
-
-    outputs = model.generate(
-        input_ids,
-        max_new_tokens=max_new_tokens,
-        repetition_penalty=repetition_penalty,
-        do_sample=True,
-        temperature=temperature,
-        top_p=top_p,
-        top_k=top_k,
-    )
-
-    dirty_text = tokenizer.decode(outputs[0])
-    text = dirty_text.replace("<pad>", "").replace("</s>", "").strip()
+    with _lock:
+        load_models()
+        torch.manual_seed(seed)
+
+        input_ids = tokenizer(input_text, return_tensors="pt").input_ids.to(device)
+        with torch.no_grad():
+            outputs = model.generate(
+                input_ids,
+                max_new_tokens=max_new_tokens,
+                repetition_penalty=repetition_penalty,
+                do_sample=True,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+            )
+
+        dirty_text = tokenizer.decode(outputs[0])
+        text = dirty_text.replace("<pad>", "").replace("</s>", "").strip()
 
     return text
@@ -0,0 +1,271 @@
+"""Latency, allocations and file opens of the prompt engine.
+
+Runs the text steps of process_prompt with fixed seeds on the bundled csv,
+style and wildcard files, on the CPU with the models stubbed out:
+
+python tests/benchmarks/bench_prompts.py            # compare with the baseline
+python tests/benchmarks/bench_prompts.py --save     # write a new baseline
+python tests/benchmarks/bench_prompts.py apply_style shift_attention
+
+Every call gets its own seed, so a run does the same work each time. The
+first call of a case warms the caches and isn't measured. Exits with 1 when
+a case got slower, allocates more or opens more files than the baseline
+allows. Timings depend on the machine, save a baseline on the one you
+compare on.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline_prompts.json")
+# Written by sdxl_styles on import when it isn't there
+STYLES_FILE = os.path.join(PROJECT_ROOT, "settings", "styles.csv")
+SEED = 1234
+
+
+def stub_models():
+    """Stand-ins for the modules that load models (and torch) on import."""
+    superprompter = types.ModuleType("superprompter.superprompter")
+    superprompter.answer = lambda **kwargs: ""
+    sys.modules["superprompter.superprompter"] = superprompter
+
+    llama_pipeline = types.ModuleType("modules.llama_pipeline")
+    llama_pipeline.run_llama = lambda *args, **kwargs: ""
+    llama_pipeline.llama_names = lambda: []
+    sys.modules["modules.llama_pipeline"] = llama_pipeline
+
+    class PromptExpansion:
+        def expand_prompt(self, prompt):
+            return prompt
+
+        def prefetch(self, prompts):
+            pass
+
+        def clear_prefetched(self):
+            pass
+
+    prompt_expansion = types.ModuleType("modules.prompt_expansion")
+    prompt_expansion.PromptExpansion = PromptExpansion
+    sys.modules["modules.prompt_expansion"] = prompt_expansion
+
+
+class OpenCounter:
+    """Counts files opened while active, through the "open" audit event."""
+
+    def __init__(self):
+        self.active = False
+        self.count = 0
+        sys.addaudithook(self)
+
+    def __call__(self, event, args):
+        if self.active and event == "open":
+            self.count += 1
+
+
+OBP_OPTIONS = [
+    dict(insanitylevel=5),
+    dict(insanitylevel=8, gender="female"),
+    dict(insanitylevel=3, forcesubject="humanoid", gender="male"),
+    dict(insanitylevel=6, forcesubject="landscape"),
+    dict(insanitylevel=7, artists="all", imagetype="all"),
+    dict(insanitylevel=5, OBP_preset="Standard"),
+]
+
+WILDCARD_PROMPTS = [
+    "__cp_character_full__",
+    "a __animal__ made of __element_types__, by __celeb_name__",
+    "__lovecraft_species__ with __lovecraft_appendages__ in __lovecraft_location__",
+]
+
+POSITIVE_PROMPTS = [
+    "portrait photo of a woman by Slim Aarons, anime, 3d render, vibrant",
+    "a castle in the mountains, oil painting by Greg Rutkowski, dramatic lighting",
+    "photograph of a cat in a hat, cinematic, highly detailed",
+    "architecture by Alvar Aalto, brutalism, watercolor, sketch",
+]
+
+ATTENTION_PROMPT = "a (cat:0.5~1.5) sitting on a (red:1.2~0.2~1.2) chair, (bokeh:0~1)"
+
+SWITCH_PROMPT = "a [cat|dog|fox] in a [forest:city:0.5], [sunny~rainy~snowy] day, [oil::12]"
+
+
+def cases():
+    """name -> (calls, function of the call number)"""
+    from modules import prompt_processing, sdxl_styles
+    from modules.shift_attention import shift_attention
+    from random_prompt.build_dynamic_prompt import build_dynamic_negative, build_dynamic_prompt
+
+    sdxl_styles.refresh_styles()
+    allstyles = list(sdxl_styles.allstyles)
+
+    def styles(i):
+        picks = [allstyles[i % len(allstyles)], allstyles[(i * 7 + 3) % len(allstyles)]]
+        if i % 5 == 0:
+            picks.append("Style: Pick Random")
+        return picks
+
+    return {
+        "build_dynamic_prompt": (
+            12, lambda i: build_dynamic_prompt(**OBP_OPTIONS[i % len(OBP_OPTIONS)])
+        ),
+        "process_wildcards": (
+            200, lambda i: prompt_processing.process_wildcards(WILDCARD_PROMPTS[i % len(WILDCARD_PROMPTS)])
+        ),
+        "apply_style": (
+            500, lambda i: sdxl_styles.apply_style(styles(i), f"a photo of a cat number {i % 50}", "blurry", "")
+        ),
+        "build_dynamic_negative": (
+            40, lambda i: build_dynamic_negative(POSITIVE_PROMPTS[i % len(POSITIVE_PROMPTS)], insanitylevel=5)
+        ),
+        "shift_attention": (
+            2000, lambda i: shift_attention(ATTENTION_PROMPT, (i % 101) / 100)
+        ),
+        "prompt_switch_timeline": (
+            500, lambda i: prompt_processing.prompt_switch_timeline(SWITCH_PROMPT, 20 + i % 20)
+        ),
+        "process_prompt": (
+            20, lambda i: prompt_processing.process_prompt(
+                ["Style: sai-cinematic"], WILDCARD_PROMPTS[i % len(WILDCARD_PROMPTS)], "ugly", {"auto_negative": True}
+            )
+        ),
+    }
+
+
+def measure(function, calls, counter):
+    def call(i):
+        random.seed(SEED + i)
+        return function(i)
+
+    call(0)
+
+    times = []
+    digest = hashlib.sha1()
+    for i in range(calls):
+        start = time.perf_counter()
+        result = call(i)
+        times.append(time.perf_counter() - start)
+        digest.update(repr(result).encode())
+
+    # Traced on their own, tracemalloc slows everything down
+    peaks = []
+    counter.count = 0
+    tracemalloc.start()
+    try:
+        for i in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            counter.active = True
+            call(i)
+            counter.active = False
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        counter.active = False
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        "calls": calls,
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "p90_ms": round(times[int(len(times) * 0.9)] * 1000, 4),
+        "peak_kib": round(statistics.median(peaks) / 1024, 1),
+        "opens_per_call": round(counter.count / calls, 2),
+        "digest": digest.hexdigest()[:12],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lines about regressions against the baseline, empty if there are none."""
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["median_ms"] > base["median_ms"] * (1 + tolerance):
+            problems.append(f"{name}: {result['median_ms']} ms per call, baseline {base['median_ms']} ms")
+        if result["peak_kib"] > base["peak_kib"] * (1 + tolerance) + 16:
+            problems.append(f"{name}: {result['peak_kib']} KiB peak, baseline {base['peak_kib']} KiB")
+        if result["opens_per_call"] > base["opens_per_call"]:
+            problems.append(f"{name}: {result['opens_per_call']} opens per call, baseline {base['opens_per_call']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prompt engine against a stored baseline.")
+    parser.add_argument("cases", nargs="*", help="only run these cases")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 is 50%%")
+    args = parser.parse_args(argv)
+
+    os.chdir(PROJECT_ROOT)
+    stub_models()
+    counter = OpenCounter()
+
+    styles_file = os.path.exists(STYLES_FILE)
+    try:
+        return run(parser, args, counter)
+    finally:
+        if not styles_file and os.path.exists(STYLES_FILE):
+            os.remove(STYLES_FILE)
+
+
+def run(parser, args, counter):
+    # The prompt engine prints a lot
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = cases()
+    unknown = set(args.cases) - set(selected)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["cases"]
+
+    results = {}
+    print(f"{'case':>24} {'median ms':>10} {'p90 ms':>10} {'peak KiB':>10} {'opens':>6}  baseline ms")
+    for name, (calls, function) in selected.items():
+        if args.cases and name not in args.cases:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = measure(function, calls, counter)
+        results[name] = result
+        base = baseline.get(name, {})
+        changed = " output changed" if base and base["digest"] != result["digest"] else ""
+        print(
+            f"{name:>24} {result['median_ms']:>10} {result['p90_ms']:>10} {result['peak_kib']:>10}"
+            f" {result['opens_per_call']:>6}  {base.get('median_ms', '-')}{changed}"
+        )
+
+    if args.save:
+        saved = {**baseline, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "cases": saved}, f, indent=2)
+            f.write("\n")
+        print(f"Saved {args.baseline}")
+        return 0
+
+    problems = compare(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Drawing wildcard values without replacement: list.remove, draw() on a
+copy of the list, and draw() on a Pool that shares the cached list.
+
+Runs the draws replacewildcard makes for one prompt over the bundled lists:
+python tests/benchmarks/bench_sampler.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from random_prompt.csv_reader import csv_to_list
+from random_prompt.sampler import Pool, draw
+
+# Lists a busy prompt draws from, with the number of values it takes
+DRAWS = {
+    "card_names": 2,
+    "episodetitles": 2,
+    "artists": 3,
+    "firstnames": 2,
+    "jobs": 2,
+    "descriptors": 6,
+    "lighting": 2,
+    "colors": 4,
+}
+
+
+def choice_and_remove(values):
+    value = random.choice(values)
+    values.remove(value)
+    return value
+
+
+def one_prompt(lists, copy, take):
+    for name, count in DRAWS.items():
+        values = copy(lists[name])
+        for _ in range(count):
+            take(values)
+
+
+def main(repeat=200):
+    lists = {name: tuple(csv_to_list(name)) for name in DRAWS}
+    print(f"{sum(len(v) for v in lists.values())} values in {len(lists)} lists")
+    ways = (
+        ("choice + remove", list, choice_and_remove),
+        ("draw", list, draw),
+        ("pool draw", Pool, draw),
+    )
+    for label, copy, take in ways:
+        random.seed(1)
+        seconds = min(timeit.repeat(lambda: one_prompt(lists, copy, take), number=repeat, repeat=5))
+        print(f"{label:>16}: {seconds / repeat * 1e6:8.1f} us per prompt")
+
+
+if __name__ == "__main__":
+    main()
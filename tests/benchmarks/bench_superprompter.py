@@ -0,0 +1,74 @@
+"""SuperPrompter throughput on the CPU, with the model loaded again for every
+prompt, as it used to be, against the model kept resident:
+
+python tests/benchmarks/bench_superprompter.py --prompts 8 --tokens 77
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import superprompter.superprompter as sp
+
+QUESTION = "Expand the following prompt to add more detail: "
+SUBJECTS = [
+    "a cat sitting on a windowsill",
+    "an old lighthouse in a storm",
+    "a knight in shining armor",
+    "a futuristic city at night",
+    "a bowl of fruit on a table",
+    "a dragon flying over mountains",
+    "a portrait of an old fisherman",
+    "a forest path in autumn",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=77)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    # Force CPU, this is about the cost of the model itself
+    torch.cuda.is_available = lambda: False
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    prompts = [
+        QUESTION + SUBJECTS[i % len(SUBJECTS)] for i in range(args.prompts)
+    ]
+
+    start = time.perf_counter()
+    sp.load_models()
+    print(f"Load:     {time.perf_counter() - start:.2f}s")
+
+    sp.answer(input_text=prompts[0], max_new_tokens=8, seed=1)
+
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        sp.release_models()
+        sp.answer(input_text=prompt, max_new_tokens=args.tokens, seed=i + 1)
+    reloaded = time.perf_counter() - start
+    print(f"Reloaded: {reloaded:.2f}s ({len(prompts) / reloaded:.2f} prompts/s)")
+
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        sp.answer(input_text=prompt, max_new_tokens=args.tokens, seed=i + 1)
+    resident = time.perf_counter() - start
+    print(
+        f"Resident: {resident:.2f}s "
+        f"({len(prompts) / resident:.2f} prompts/s, {reloaded / resident:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Small PNG files with RuinedFooocus metadata, shared by the image tests."""
+
+import json
+import struct
+import zlib
+
+
+def _chunk(kind, data):
+    crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def write_png(path, parameters=None):
+    ihdr = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    data = b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", ihdr)
+    if parameters is not None:
+        data += _chunk(b"tEXt", b"parameters\0" + json.dumps(parameters).encode("latin-1"))
+    data += _chunk(b"IDAT", zlib.compress(b"\0\0\0\0"))
+    data += _chunk(b"IEND", b"")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def params(prompt, **kwargs):
+    p = {
+        "Prompt": prompt,
+        "Negative": "blurry",
+        "steps": 30,
+        "cfg": 4.5,
+        "width": 1024,
+        "height": 1024,
+        "seed": 1,
+        "sampler_name": "euler",
+        "scheduler": "karras",
+        "base_model_name": "juggernaut.safetensors",
+        "base_model_hash": "abcd",
+        "loras": [["", "0.5 - detail.safetensors"]],
+    }
+    p.update(kwargs)
+    return p
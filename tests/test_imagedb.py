@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from modules.imagedb import (
+    ImageDatabase,
+    collapse,
+    create_schema,
+    encode_cursor,
+    find_similar,
+    image_row,
+    insert_images,
+    page_query,
+    parse_query,
+    sync_folders,
+)
+from modules.png_text import read_png_text
+from tests.png_helpers import params, write_png
+
+
+class TestImageDB(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "2025-01-01"))
+        self.conn = sqlite3.connect(":memory:")
+        create_schema(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.folder)
+
+    def find(self, query):
+        where, values = parse_query(query)
+        rows = self.conn.execute(
+            f"SELECT path FROM images WHERE {where} ORDER BY path", values
+        )
+        return [os.path.basename(row[0]) for row in rows]
+
+    def test_png_text_is_read_without_pixels(self):
+        path = os.path.join(self.folder, "a.png")
+        write_png(path, params("a red cat"))
+        info = read_png_text(path)
+        self.assertEqual(json.loads(info["parameters"])["Prompt"], "a red cat")
+
+    def test_non_png_gives_no_text(self):
+        path = os.path.join(self.folder, "a.png")
+        with open(path, "wb") as f:
+            f.write(b"GIF89a")
+        self.assertEqual(read_png_text(path), {})
+
+    def test_sync_is_incremental(self):
+        day = os.path.join(self.folder, "2025-01-01")
+        write_png(os.path.join(day, "a.png"), params("a red cat"))
+        write_png(os.path.join(day, "b.png"), params("a blue dog", seed=2))
+
+        changes = sync_folders(self.conn, [self.folder], workers=1)
+        self.assertEqual((changes["added"], changes["total"]), (2, 2))
+
+        changes = sync_folders(self.conn, [self.folder], workers=1)
+        self.assertEqual((changes["added"], changes["changed"], changes["removed"]), (0, 0, 0))
+
+        os.remove(os.path.join(day, "b.png"))
+        write_png(os.path.join(day, "c.png"), params("a green frog"))
+        changes = sync_folders(self.conn, [self.folder], workers=1)
+        self.assertEqual((changes["added"], changes["removed"]), (1, 1))
+        self.assertEqual(self.find(""), ["a.png", "c.png"])
+
+    def test_changed_file_keeps_its_id(self):
+        path = os.path.join(self.folder, "2025-01-01", "a.png")
+        write_png(path, params("a red cat"))
+        sync_folders(self.conn, [self.folder], workers=1)
+        image_id = self.conn.execute("SELECT id FROM images").fetchone()[0]
+
+        write_png(path, params("a blue dog", loras=[]))
+        os.utime(path, (1, 1))
+        changes = sync_folders(self.conn, [self.folder], workers=1)
+        self.assertEqual(changes["changed"], 1)
+        self.assertEqual(self.conn.execute("SELECT id FROM images").fetchall(), [(image_id,)])
+        self.assertEqual((self.find("dog"), self.find("cat"), self.find("lora:detail")), (["a.png"], [], []))
+
+    def test_old_table_is_migrated(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE images (fullpath text, path text, json text)")
+        conn.execute(
+            "INSERT INTO images VALUES (?, ?, ?)",
+            ("/x/a.png", "2025-01-01/a.png", json.dumps({"parameters": json.dumps(params("a red cat"))})),
+        )
+        create_schema(conn)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], 2)
+        where, values = parse_query("cat lora:detail")
+        rows = conn.execute(f"SELECT fullpath, dhash FROM images WHERE {where}", values).fetchall()
+        self.assertEqual(rows, [("/x/a.png", None)])
+        conn.close()
+
+    def test_query_language(self):
+        day = os.path.join(self.folder, "2025-01-01")
+        write_png(os.path.join(day, "a.png"), params("a red cat, sci-fi"))
+        write_png(os.path.join(day, "b.png"), params("a blue dog", seed=2, steps=20, loras=[]))
+        sync_folders(self.conn, [self.folder], workers=1)
+
+        self.assertEqual(self.find("cat"), ["a.png"])
+        self.assertEqual(self.find("ca"), ["a.png"])
+        self.assertEqual(self.find("-cat"), ["b.png"])
+        self.assertEqual(self.find('"red cat"'), ["a.png"])
+        self.assertEqual(self.find("neg:blurry"), ["a.png", "b.png"])
+        self.assertEqual(self.find("seed:2"), ["b.png"])
+        self.assertEqual(self.find("steps:>25"), ["a.png"])
+        self.assertEqual(self.find("cfg:4..5 size:1024x1024"), ["a.png", "b.png"])
+        self.assertEqual(self.find("lora:detail"), ["a.png"])
+        self.assertEqual(self.find("-lora:detail"), ["b.png"])
+        self.assertEqual(self.find("model:JUGGER sampler:Euler"), ["a.png", "b.png"])
+
+    def test_cursor_pages_match_offset_pages(self):
+        day = os.path.join(self.folder, "2025-01-01")
+        for i in range(7):
+            write_png(os.path.join(day, f"{i}.png"), params(f"image {i}"))
+        sync_folders(self.conn, [self.folder], workers=1)
+        where, values = parse_query("")
+
+        pages, cursor = [], None
+        for page in range(4):
+            sql, args = page_query(where, values, 3, cursor=cursor, offset=page * 3)
+            rows = self.conn.execute(sql, args).fetchall()
+            pages.append([os.path.basename(row[2]) for row in rows])
+            if rows:
+                cursor = encode_cursor(rows[-1][2], rows[-1][0])
+        self.assertEqual(pages, [["6.png", "5.png", "4.png"], ["3.png", "2.png", "1.png"], ["0.png"], []])
+
+        sql, args = page_query(where, values, 3, cursor="not a cursor", offset=3)
+        rows = self.conn.execute(sql, args).fetchall()
+        self.assertEqual(os.path.basename(rows[0][2]), "3.png")
+
+    def test_database_groups_writes_and_isolates_failures(self):
+        db = ImageDatabase(os.path.join(self.folder, "images.db"))
+        try:
+            futures = [
+                db.insert_images([image_row(f"/x/{i}.png", f"{i}.png", {})])
+                for i in range(20)
+            ]
+            bad = db.write(lambda conn: conn.execute("INSERT INTO missing VALUES (1)"))
+            futures.append(db.insert_images([image_row("/x/last.png", "last.png", {})]))
+            for future in futures:
+                future.result(timeout=10)
+            with self.assertRaises(sqlite3.OperationalError):
+                bad.result(timeout=10)
+
+            self.assertEqual(db.read_one("SELECT count(*) FROM images")[0], 21)
+            self.assertEqual(db.read_one("PRAGMA journal_mode")[0], "wal")
+        finally:
+            db.close()
+
+    def test_similar_images_by_hash(self):
+        base = 0xF0F0_1234_ABCD_8001
+        hashes = {
+            "same.png": base,
+            "close.png": base ^ 0b101,  # 2 bits off
+            "far.png": base ^ 0xFFFF_0000_0000_0000,
+            "other.png": ~base & 0xFFFF_FFFF_FFFF_FFFF,
+        }
+        insert_images(self.conn, [
+            image_row(f"/x/{name}", name, {}, stat=(1, 1.0), hashes=(h, h))
+            for name, h in hashes.items()
+        ])
+
+        found = find_similar(self.conn, (base, base), radius=4, exclude="/x/same.png")
+        self.assertEqual([(row[2], row[3]) for row in found], [("close.png", 2)])
+        found = find_similar(self.conn, (base, base), radius=0)
+        self.assertEqual([row[2] for row in found], ["same.png"])
+
+        groups = collapse([(name, h, h) for name, h in hashes.items()], radius=4)
+        self.assertEqual(groups, [("same.png", ["close.png"]), ("far.png", []), ("other.png", [])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from modules import metadata_cache
+from modules.imagedb import ImageDatabase, image_row
+from tests.png_helpers import params, write_png
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        metadata_cache._cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_parameters_come_from_db_then_cache(self):
+        path = os.path.join(self.folder, "a.png")
+        write_png(path, params("a red cat"))
+        db = ImageDatabase(os.path.join(self.folder, "images.db"))
+        try:
+            db.insert_images([image_row(path, "a.png", {"parameters": '{"Prompt": "from db"}'})]).result()
+            with mock.patch.object(metadata_cache, "read_png_text") as read:
+                self.assertEqual(metadata_cache.read_parameters(path, db)["Prompt"], "from db")
+                self.assertEqual(metadata_cache.read_parameters(path)["Prompt"], "from db")
+                read.assert_not_called()
+
+            # A changed file isn't served from the cache or the stale row
+            write_png(path, params("a blue dog"))
+            os.utime(path, ns=(1, 1))
+            self.assertEqual(metadata_cache.read_parameters(path, db)["Prompt"], "a blue dog")
+        finally:
+            db.close()
+
+    def test_preset_manifest_is_rebuilt_when_files_change(self):
+        write_png(os.path.join(self.folder, "one.png"), params("one"))
+        write_png(os.path.join(self.folder, "Place_preset_here.png"))
+        manifest = metadata_cache.PresetManifest()
+
+        first = manifest.get(self.folder)
+        self.assertEqual([p["name"] for p in first], ["one"])
+        self.assertIs(manifest.get(self.folder), first)
+
+        write_png(os.path.join(self.folder, "two.png"), params("two"))
+        self.assertEqual([p["name"] for p in manifest.get(self.folder)], ["one", "two"])
+
+
+if __name__ == "__main__":
+    unittest.main()
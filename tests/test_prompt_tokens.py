@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from modules.prompt_tokens import CHUNK_SIZE, TokenCounter
+
+
+class LetterTokenizer:
+    """One token per letter."""
+
+    def __init__(self):
+        self.calls = []
+
+    def tokenize(self, text):
+        self.calls.append(text)
+        return list(text)
+
+
+class TestTokenCounter(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = LetterTokenizer()
+        self.counter = TokenCounter()
+        self.counter._tokenizer = self.tokenizer
+        self.counter._loaded = True
+
+    def test_words_move_to_the_next_chunk_whole(self):
+        words = ["abc"] * (CHUNK_SIZE // 3) + ["xyz"]
+        prompt = " ".join(words)
+        result = self.counter.count(prompt)
+        self.assertEqual(result, {"tokens": CHUNK_SIZE + 3, "chunks": 2, "boundaries": [prompt.index("xyz")]})
+
+    def test_long_words_are_split(self):
+        prompt = " ".join(["ab"] * 37) + " " + "x" * 10 + " cd"
+        result = self.counter.count(prompt)
+        self.assertEqual(result["tokens"], 74 + 10 + 2)
+        self.assertEqual(result["boundaries"], [prompt.index("x")])
+
+    def test_words_of_long_word_tokens_move_whole(self):
+        # The 8 token word starts the second chunk whole, which fills up
+        # exactly before z
+        prompt = " ".join(["ab"] * 37) + " " + "y" * 8 + " " + " ".join(["ab"] * 33) + " c z"
+        result = self.counter.count(prompt)
+        self.assertEqual(result["boundaries"], [prompt.index("y"), prompt.index("z")])
+        self.assertEqual(result["chunks"], 3)
+
+    def test_weights_are_not_counted_and_words_are_cached(self):
+        result = self.counter.count("(Cat:1.2) cat (cat)")
+        self.assertEqual(result, {"tokens": 9, "chunks": 1, "boundaries": []})
+        self.assertEqual(self.tokenizer.calls, ["cat"])
+
+    def test_no_tokenizer(self):
+        self.counter._tokenizer = None
+        self.assertEqual(self.counter.count_many(["a cat"]), [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
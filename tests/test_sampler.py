@@ -0,0 +1,42 @@
+import os
+import random
+import sys
+import unittest
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from random_prompt.sampler import Pool, draw
+
+
+class TestPool(unittest.TestCase):
+    def test_draws_match_a_list(self):
+        shared = tuple(f"value {i}" for i in range(50))
+        values, pool = list(shared), Pool(shared)
+        for seed in range(20):
+            random.seed(seed)
+            expected = (draw(values), random.choice(values))
+            random.seed(seed)
+            self.assertEqual((draw(pool), random.choice(pool)), expected)
+            self.assertEqual(pool, values)
+        self.assertEqual(pool[-1], values[-1])
+        self.assertEqual(shared, tuple(f"value {i}" for i in range(50)))
+
+    def test_changes_leave_the_shared_values_alone(self):
+        shared = ("a", "b", "c")
+        pool = Pool(shared)
+        random.seed(1)
+        draw(pool)
+        pool.append("d")
+        pool.remove("d")
+        pool += ["e"]
+        self.assertEqual(len(pool), 3)
+        self.assertIn("e", pool)
+        self.assertEqual(["z"] + pool, ["z"] + list(pool))
+        self.assertEqual(shared, ("a", "b", "c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Ensure project root is importable when running this file directly.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from modules.wildcards import MAX_DEPTH, WildcardRegistry
+
+
+class TestWildcardRegistry(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        os.makedirs("wildcards/nested")
+        os.makedirs("wildcards_official")
+        self.env = mock.patch.dict(os.environ, {"RF_USER_DATA": ""})
+        self.env.start()
+        self.registry = WildcardRegistry()
+
+    def tearDown(self):
+        self.env.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def write(self, path, *lines):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+    def test_nested_wildcards_resolve_in_one_pass(self):
+        self.write("wildcards/color.txt", "# comment", "red")
+        self.write("wildcards/nested/animal.txt", "__color__ cat")
+        self.write("wildcards_official/color.txt", "blue")
+
+        self.assertEqual(self.registry.resolve("a __animal__, __missing__"), "a red cat, missing")
+        self.assertEqual(self.registry.names(), ["color", "animal"])
+
+    def test_recursion_is_limited(self):
+        self.write("wildcards/loop.txt", "x __loop__")
+        result = self.registry.resolve("__loop__")
+        self.assertEqual(result, "x " * MAX_DEPTH + "__loop__")
+
+    def test_added_and_changed_files_are_picked_up(self):
+        self.write("wildcards/color.txt", "red")
+        self.assertEqual(self.registry.resolve("__color__ __size__"), "red size")
+
+        self.write("wildcards/nested/size.txt", "big")
+        self.write("wildcards/color.txt", "green")
+        os.utime("wildcards/color.txt", ns=(1, 1))
+        self.assertEqual(self.registry.resolve("__color__ __size__"), "green big")
+
+    def test_onebutton_wildcards_go_to_special(self):
+        result = self.registry.resolve("__onebuttonprompt:a red fox__", special=lambda name: name.upper())
+        self.assertEqual(result, "ONEBUTTONPROMPT:A RED FOX")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -418,7 +418,7 @@ with shared.gradio_root as block:
                     def checkforwildcards(text):
                         test = find_unclosed_markers(text)
                         if test is not None:
-                            filtered = [s for s in shared.wildcards if test in s]
+                            filtered = [s for s in get_wildcard_files() if test in s]
                             filtered.append(" ")
                             return {
                                 spellcheck: gr.update(